@@ -3,22 +3,36 @@ import os
 import re
 import tempfile
 import textwrap
-from concurrent.futures import ProcessPoolExecutor
+import threading
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from copy import deepcopy
 from enum import Enum
-from functools import wraps
+from functools import partial, wraps
 from glob import glob
-from time import time
-from typing import Dict, List, Optional, Type, Union
+from time import sleep, time
+from typing import Callable, Dict, List, Optional, Tuple, Type, Union
 
+from lexoid.core.batch import run_batch_parse
+from lexoid.core.cascade import run_cascade
 from lexoid.core.conversion_utils import (
     convert_doc_to_base64_images,
     convert_schema_to_dict,
     convert_to_pdf,
+    find_schema_errors,
+    is_json_schema,
+    merge_schema_instances,
+    parse_json_response,
 )
 from lexoid.core.parse_type.llm_parser import (
     create_response,
     get_api_provider_for_model,
     parse_llm_doc,
+    warm_up_local_model,
 )
 from lexoid.core.parse_type.static_parser import parse_static_doc
 from lexoid.core.prompt_templates import (
@@ -26,25 +40,40 @@ from lexoid.core.prompt_templates import (
     LATEX_LAST_PAGE_PROMPT,
     LATEX_MIDDLE_PAGE_PROMPT,
     LATEX_USER_PROMPT,
+    SCHEMA_REASK_PROMPT,
 )
 from lexoid.core.utils import (
+    BATCH_POLL_INTERVAL,
     DEFAULT_LLM,
+    DEFAULT_LOCAL_LM,
     DEFAULT_MAX_IMAGE_DIMENSION,
     DEFAULT_STATIC_FRAMEWORK,
+    MAX_CONTINUATIONS,
+    SCHEMA_CHUNK_TOKENS,
     bbox_router,
+    compute_token_cost,
     create_sub_pdf,
     download_file,
+    estimate_page_max_tokens,
+    find_blank_pages,
+    find_duplicate_pages,
     get_file_type,
+    get_pdf_page_count,
     get_webpage_soup,
+    group_segments_by_tokens,
     has_image_in_pdf,
     is_supported_file_type,
     is_supported_url_file_type,
+    load_api_cost_mapping,
+    merge_token_cost,
+    merge_token_usage,
     recursive_read_html,
     resize_image_if_needed,
     router,
     split_pdf,
 )
 from loguru import logger
+from requests.exceptions import HTTPError
 
 
 class ParserType(Enum):
@@ -152,7 +181,10 @@ def parse_chunk(path: str, parser_type: ParserType, **kwargs) -> Dict:
         result = parse_static_doc(path, **kwargs)
     else:
         logger.debug("Using LLM parser")
-        result = parse_llm_doc(path, **kwargs)
+        if kwargs.get("cascade"):
+            result = run_cascade(path, **kwargs)
+        else:
+            result = parse_llm_doc(path, **kwargs)
 
     result["parser_used"] = parser_type
 
@@ -190,6 +222,82 @@ def parse_chunk(path: str, parser_type: ParserType, **kwargs) -> Dict:
     return result
 
 
+def restore_skipped_pages(
+    result: Dict,
+    n_pages: int,
+    duplicate_of: Dict[int, int],
+    blank_pages: List[int],
+) -> Dict:
+    """
+    Expands a result parsed from a subset of the pages of a PDF back to all of
+    its pages.
+
+    Args:
+        result (dict): Result of parsing the PDF with the skipped pages removed.
+        n_pages (int): Number of pages in the original PDF.
+        duplicate_of (dict): Maps duplicate page numbers to their representative
+            page, as returned by `find_duplicate_pages`.
+        blank_pages (list): Blank page numbers, as returned by `find_blank_pages`.
+
+    Returns:
+        Dict: The result with segments for every page. Copies of a representative
+            page carry ``duplicate_of`` in their metadata, without the page's
+            ``token_usage`` and ``token_cost``, and blank pages get an
+            empty segment marked ``skipped="blank"``. A ``deduplication`` summary
+            is added when pages were deduplicated.
+    """
+    parsed_pages = [
+        p
+        for p in range(1, n_pages + 1)
+        if p not in duplicate_of and p not in blank_pages
+    ]
+    segments_by_page = {}
+    other_segments = []
+    for segment in result["segments"]:
+        page = segment.get("metadata", {}).get("page")
+        if page is None or page > len(parsed_pages):
+            other_segments.append(segment)
+            continue
+        segment["metadata"]["page"] = parsed_pages[page - 1]
+        segments_by_page.setdefault(segment["metadata"]["page"], []).append(segment)
+
+    segments = []
+    for page in range(1, n_pages + 1):
+        if page in blank_pages:
+            segments.append(
+                {"metadata": {"page": page, "skipped": "blank"}, "content": ""}
+            )
+        elif page in duplicate_of:
+            for segment in segments_by_page.get(duplicate_of[page], []):
+                copy = deepcopy(segment)
+                copy["metadata"]["page"] = page
+                copy["metadata"]["duplicate_of"] = duplicate_of[page]
+                # The representative page already accounts for the request
+                copy["metadata"].pop("token_usage", None)
+                copy["metadata"].pop("token_cost", None)
+                segments.append(copy)
+        else:
+            segments.extend(segments_by_page.get(page, []))
+    result["segments"] = segments + other_segments
+    result["raw"] = "\n\n".join(
+        segment["content"] for segment in result["segments"] if segment["content"]
+    )
+    if not duplicate_of:
+        return result
+
+    # Estimate the saving from the average cost of the pages sent to an LLM
+    token_usage = result.get("token_usage", {})
+    llm_page_count = token_usage.get("llm_page_count", 0)
+    tokens_per_page = (
+        token_usage.get("total", 0) / llm_page_count if llm_page_count else 0
+    )
+    result["deduplication"] = {
+        "duplicates": duplicate_of,
+        "tokens_saved": round(tokens_per_page * len(duplicate_of)),
+    }
+    return result
+
+
 def parse_chunk_list(
     file_paths: List[str], parser_type: ParserType, kwargs: Dict
 ) -> Dict:
@@ -207,7 +315,8 @@ def parse_chunk_list(
     combined_segments = []
     raw_texts = []
     parsers_used = []
-    token_usage = {"input": 0, "output": 0, "llm_page_count": 0}
+    token_usages = []
+    token_costs = []
     for file_path in file_paths:
         result = parse_chunk(file_path, parser_type, **kwargs)
         combined_segments.extend(result["segments"])
@@ -215,12 +324,17 @@ def parse_chunk_list(
         parser_used = result.get("parser_used")
         parsers_used.append(parser_used.value if parser_used else "UNKNOWN")
         if parser_used == ParserType.LLM_PARSE and "token_usage" in result:
-            token_usage["input"] += result["token_usage"]["input"]
-            token_usage["output"] += result["token_usage"]["output"]
-            token_usage["llm_page_count"] += len(result["segments"])
-    token_usage["total"] = token_usage["input"] + token_usage["output"]
+            token_usages.append(
+                {
+                    "llm_page_count": len(result["segments"]),
+                    **result["token_usage"],
+                }
+            )
+        if "token_cost" in result:
+            token_costs.append(result["token_cost"])
+    token_usage = merge_token_usage(token_usages)
 
-    return {
+    chunk_result = {
         "raw": "\n\n".join(raw_texts),
         "segments": combined_segments,
         "title": kwargs.get("title", ""),
@@ -230,6 +344,9 @@ def parse_chunk_list(
         "token_usage": token_usage,
         "parsers_used": parsers_used,
     }
+    if token_costs:
+        chunk_result["token_cost"] = merge_token_cost(token_costs)
+    return chunk_result
 
 
 def parse(
@@ -276,11 +393,23 @@ def parse(
             "Forcing max_processes=1."
         )
         max_processes = 1
+    if kwargs.get("stream_callback") and max_processes != 1:
+        logger.warning(
+            "stream_callback is called from the parsing process. "
+            "Forcing max_processes=1."
+        )
+        max_processes = 1
     if (
         path.lower().endswith((".doc", ".docx"))
         and parser_type != ParserType.STATIC_PARSE
     ):
         as_pdf = True
+    if kwargs.get("pages_per_request", 1) > pages_per_split:
+        logger.warning(
+            f"pages_per_request ({kwargs['pages_per_request']}) is larger than "
+            f"pages_per_split ({pages_per_split}); requests will carry at most "
+            f"{pages_per_split} pages."
+        )
     if path.lower().endswith(".xlsx") and parser_type == ParserType.LLM_PARSE:
         logger.warning("LLM_PARSE does not support .xlsx files. Using STATIC_PARSE.")
         parser_type = ParserType.STATIC_PARSE
@@ -332,7 +461,45 @@ def parse(
             sub_pdf_path = os.path.join(sub_pdf_dir, f"{os.path.basename(path)}")
             path = create_sub_pdf(path, sub_pdf_path, kwargs["page_nums"])
 
-        if not path.lower().endswith(".pdf"):
+        source_path = path
+        duplicate_of, blank_pages, parsed_pages = {}, [], None
+        if path.lower().endswith(".pdf") and (
+            kwargs.get("skip_blank_pages", False)
+            or kwargs.get("deduplicate_pages", False)
+        ):
+            n_pages = get_pdf_page_count(path)
+            if kwargs.get("skip_blank_pages", False):
+                blank_pages = find_blank_pages(
+                    path,
+                    kwargs.get("blank_ink_threshold", 0.001),
+                    kwargs.get("blank_char_threshold", 0),
+                )
+            if kwargs.get("deduplicate_pages", False):
+                duplicate_of = {
+                    page: rep_page
+                    for page, rep_page in find_duplicate_pages(
+                        path, kwargs.get("duplicate_threshold", 0)
+                    ).items()
+                    if page not in blank_pages and rep_page not in blank_pages
+                }
+            parsed_pages = [
+                p
+                for p in range(1, n_pages + 1)
+                if p not in duplicate_of and p not in blank_pages
+            ]
+            if parsed_pages and len(parsed_pages) < n_pages:
+                logger.debug(
+                    f"Skipping blank pages {blank_pages} "
+                    f"and duplicate pages {duplicate_of}"
+                )
+                path = create_sub_pdf(
+                    path, os.path.join(temp_dir, "parsed_pages.pdf"), parsed_pages
+                )
+
+        if parsed_pages == []:
+            # Every page was skipped, so there is nothing to send to a parser
+            result = parse_chunk_list([], parser_type, kwargs)
+        elif not path.lower().endswith(".pdf"):
             kwargs["split"] = False
             result = parse_chunk_list([path], parser_type, kwargs)
         else:
@@ -350,10 +517,32 @@ def parse(
 
             process_args = [(chunk, parser_type, kwargs) for chunk in file_chunks]
 
+            executor_kwargs = {}
+            if parser_type == ParserType.LLM_PARSE:
+                api_provider = kwargs.get("api_provider")
+                model = kwargs.get(
+                    "model",
+                    DEFAULT_LOCAL_LM if api_provider == "local" else DEFAULT_LLM,
+                )
+                if (api_provider or get_api_provider_for_model(model)) == "local":
+                    # Load the model once per worker instead of once per split,
+                    # and split the cores between workers
+                    n_workers = min(max_processes, len(file_chunks))
+                    executor_kwargs = {
+                        "initializer": partial(
+                            warm_up_local_model,
+                            model,
+                            num_threads=max(1, (os.cpu_count() or 1) // n_workers),
+                            cpu_quantization=kwargs.get("cpu_quantization"),
+                        ),
+                    }
+
             if max_processes == 1 or len(file_chunks) == 1:
                 chunk_results = [parse_chunk_list(*args) for args in process_args]
             else:
-                with ProcessPoolExecutor(max_workers=max_processes) as executor:
+                with ProcessPoolExecutor(
+                    max_workers=max_processes, **executor_kwargs
+                ) as executor:
                     chunk_results = list(
                         executor.map(parse_chunk_list, *zip(*process_args))
                     )
@@ -366,49 +555,35 @@ def parse(
                 "url": kwargs.get("url", ""),
                 "parent_title": kwargs.get("parent_title", ""),
                 "recursive_docs": [],
-                "token_usage": {
-                    "input": sum(r["token_usage"]["input"] for r in chunk_results),
-                    "output": sum(r["token_usage"]["output"] for r in chunk_results),
-                    "llm_page_count": sum(
-                        r["token_usage"]["llm_page_count"] for r in chunk_results
-                    ),
-                    "total": sum(r["token_usage"]["total"] for r in chunk_results),
-                },
+                "token_usage": merge_token_usage(
+                    [r["token_usage"] for r in chunk_results]
+                ),
                 "parsers_used": [
                     parser
                     for r in chunk_results
                     for parser in r.get("parsers_used", [])
                 ],
             }
+            token_costs = [r["token_cost"] for r in chunk_results if "token_cost" in r]
+            if token_costs:
+                result["token_cost"] = merge_token_cost(token_costs)
 
-        if "api_cost_mapping" in kwargs and "token_usage" in result:
-            api_cost_mapping = kwargs["api_cost_mapping"]
-            if isinstance(api_cost_mapping, dict):
-                api_cost_mapping = api_cost_mapping
-            elif isinstance(api_cost_mapping, str) and os.path.exists(api_cost_mapping):
-                with open(api_cost_mapping, "r") as f:
-                    api_cost_mapping = json.load(f)
-            else:
-                raise ValueError(f"Unsupported API cost value: {api_cost_mapping}.")
+        if duplicate_of or blank_pages:
+            result = restore_skipped_pages(result, n_pages, duplicate_of, blank_pages)
 
+        if "api_cost_mapping" in kwargs and "token_usage" in result:
+            api_cost_mapping = load_api_cost_mapping(kwargs["api_cost_mapping"])
             api_cost = api_cost_mapping.get(kwargs.get("model", DEFAULT_LLM), None)
-            if api_cost:
-                token_usage = result["token_usage"]
-                token_cost = {
-                    "input": token_usage["input"] * api_cost["input"] / 1_000_000,
-                    "input-image": api_cost.get("input-image", 0)
-                    * token_usage.get("llm_page_count", 0),
-                    "output": token_usage["output"] * api_cost["output"] / 1_000_000,
-                }
-                token_cost["total"] = (
-                    token_cost["input"]
-                    + token_cost["input-image"]
-                    + token_cost["output"]
+            if kwargs.get("cascade"):
+                # Cascade chunks are already priced per stage, with each stage's model
+                result.setdefault("token_cost", merge_token_cost([]))
+            elif api_cost:
+                result["token_cost"] = compute_token_cost(
+                    result["token_usage"], api_cost
                 )
-                result["token_cost"] = token_cost
 
         if as_pdf:
-            result["pdf_path"] = path
+            result["pdf_path"] = source_path
 
     if depth > 1:
         recursive_docs = []
@@ -441,6 +616,400 @@ def parse(
     return result
 
 
+def parse_speculative(
+    path: str,
+    pages_per_split: int = 4,
+    max_processes: int = 4,
+    on_page_refined: Optional[Callable[[Dict], None]] = None,
+    **kwargs,
+) -> Dict:
+    """
+    Returns a fast static parse right away and refines it with LLM_PARSE in the
+    background.
+
+    Args:
+        path (str): The file path or URL.
+        pages_per_split (int, optional): Number of pages per background LLM request
+            group.
+        max_processes (int, optional): Maximum number of page groups parsed with the
+            LLM at once.
+        on_page_refined (Callable[[Dict], None], optional): Called from the
+            background thread with each LLM-parsed segment as soon as its page group
+            completes.
+        **kwargs: Additional arguments for the parsers (see `parse`).
+
+    Returns:
+        Dict: The STATIC_PARSE result, with a `refined` key holding a
+            `concurrent.futures.Future` that resolves to the merged result: LLM
+            segments where the LLM parse succeeded, static segments elsewhere.
+    """
+    static_result = parse(
+        path,
+        parser_type=ParserType.STATIC_PARSE,
+        pages_per_split=pages_per_split,
+        max_processes=max_processes,
+        **kwargs,
+    )
+    refined = Future()
+    refined.set_running_or_notify_cancel()
+    thread = threading.Thread(
+        target=refine_with_llm,
+        args=(path, static_result, refined, pages_per_split, max_processes),
+        kwargs={"on_page_refined": on_page_refined, **kwargs},
+        daemon=True,
+    )
+    thread.start()
+    static_result["refined"] = refined
+    return static_result
+
+
+def refine_with_llm(
+    path: str,
+    static_result: Dict,
+    refined: Future,
+    pages_per_split: int,
+    max_processes: int,
+    on_page_refined: Optional[Callable[[Dict], None]] = None,
+    **kwargs,
+):
+    """
+    Background half of `parse_speculative`: parses the pages in groups with
+    LLM_PARSE and resolves `refined` with the merged result.
+    """
+    try:
+        kwargs.pop("stream_callback", None)
+        if path.lower().endswith(".pdf") and os.path.exists(path):
+            pages = kwargs.pop("page_nums", None) or []
+            pages = sorted(set([pages] if isinstance(pages, int) else pages))
+            pages = pages or list(range(1, get_pdf_page_count(path) + 1))
+            groups = [
+                pages[i : i + pages_per_split]
+                for i in range(0, len(pages), pages_per_split)
+            ]
+        else:
+            groups = [None]
+
+        def parse_group(group_index: int, group: Optional[List[int]]) -> Dict:
+            group_kwargs = dict(kwargs)
+            if group is not None:
+                group_kwargs["page_nums"] = tuple(group)
+            result = parse(
+                path,
+                parser_type=ParserType.LLM_PARSE,
+                pages_per_split=pages_per_split,
+                max_processes=1,
+                **group_kwargs,
+            )
+            # Number pages like the static result, which counts from the first
+            # selected page
+            offset = group_index * pages_per_split if group is not None else 0
+            for segment in result["segments"]:
+                metadata = segment.setdefault("metadata", {})
+                if "page" in metadata:
+                    metadata["page"] += offset
+                metadata["refined"] = True
+                if on_page_refined:
+                    on_page_refined(segment)
+            return result
+
+        llm_results = []
+        with ThreadPoolExecutor(max_workers=max(1, max_processes)) as executor:
+            futures = {
+                executor.submit(parse_group, i, group): group
+                for i, group in enumerate(groups)
+            }
+            for future in as_completed(futures):
+                try:
+                    llm_results.append(future.result())
+                except Exception as e:
+                    logger.warning(
+                        f"LLM refinement failed for pages {futures[future]}: {e}. "
+                        "Keeping the static result for them."
+                    )
+
+        refined_segments = {
+            segment["metadata"].get("page"): segment
+            for result in llm_results
+            for segment in result["segments"]
+        }
+        segments = [
+            refined_segments.pop(segment.get("metadata", {}).get("page"), segment)
+            for segment in static_result["segments"]
+        ]
+        # Pages the static parser returned nothing for
+        segments.extend(
+            sorted(
+                refined_segments.values(),
+                key=lambda segment: segment["metadata"].get("page") or 0,
+            )
+        )
+        result = {
+            key: value for key, value in static_result.items() if key != "refined"
+        }
+        result["raw"] = "\n\n".join(segment["content"] for segment in segments)
+        result["segments"] = segments
+        result["token_usage"] = merge_token_usage(
+            [r["token_usage"] for r in llm_results if "token_usage" in r]
+        )
+        result["parsers_used"] = [
+            parser
+            for r in [static_result] + llm_results
+            for parser in r.get("parsers_used", [])
+        ]
+        token_costs = [r["token_cost"] for r in llm_results if "token_cost" in r]
+        if token_costs:
+            result["token_cost"] = merge_token_cost(token_costs)
+        refined.set_result(result)
+    except Exception as e:
+        logger.error(f"LLM refinement failed: {e}")
+        refined.set_exception(e)
+
+
+def parse_batch(
+    paths: List[str],
+    model: str = "gpt-4o-mini",
+    api: Optional[str] = None,
+    manifest_path: str = "lexoid_batch_manifest.json",
+    poll_interval: int = BATCH_POLL_INTERVAL,
+    **kwargs,
+) -> List[Dict]:
+    """
+    Parses a corpus of documents with an LLM through the provider's batch API.
+
+    Batch jobs trade latency (up to 24 hours) for a lower per-token price, which
+    suits offline backfills. The job is tracked in `manifest_path`; calling this
+    again with the same manifest resumes polling instead of resubmitting.
+
+    Args:
+        paths (List[str]): Paths of the PDFs / images to parse.
+        model (str, optional): LLM model name.
+        api (str, optional): Batch API provider ("openai" or "anthropic"). Inferred
+            from the model if not given.
+        manifest_path (str, optional): JSON file used to track and resume the job.
+        poll_interval (int, optional): Seconds between batch status checks.
+        **kwargs: Additional arguments for the parser (e.g.: temperature, max_tokens).
+
+    Returns:
+        List[Dict]: One result dict per path, in the same format as `parse()`.
+    """
+    if not api:
+        api = get_api_provider_for_model(model)
+        logger.debug(f"Using API provider: {api}")
+    results = run_batch_parse(
+        paths,
+        api=api,
+        manifest_path=manifest_path,
+        poll_interval=poll_interval,
+        model=model,
+        **kwargs,
+    )
+
+    if "api_cost_mapping" in kwargs:
+        api_cost = load_api_cost_mapping(kwargs["api_cost_mapping"]).get(model, None)
+        if api_cost:
+            for result in results:
+                result["token_cost"] = compute_token_cost(
+                    result["token_usage"], api_cost
+                )
+
+    return results
+
+
+def create_schema_response(
+    api: str,
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    json_schema: Dict,
+    image_url: Optional[str] = None,
+    label: str = "document",
+    validate: bool = True,
+    **kwargs,
+) -> Union[Dict, List]:
+    """
+    Requests a JSON instance of a schema from an LLM and parses it.
+
+    JSON Schema objects are enforced with the provider's structured output where
+    available. Malformed JSON (e.g. a truncated response) is repaired, and a
+    response that still does not parse or does not match the schema is asked for
+    again once, with the errors. HTTP errors are retried once after 10 seconds.
+    Neither retry happens when `retry_on_fail` is False.
+
+    Args:
+        api (str): LLM API provider.
+        model (str): LLM model name.
+        system_prompt (str): Prompt describing the schema.
+        user_prompt (str): Extraction instructions (and document content, if any).
+        json_schema (Dict): The schema to fill.
+        image_url (str, optional): Image of the page to extract from.
+        label (str, optional): What is being extracted, for log messages.
+        validate (bool, optional): Whether to check the value against the schema.
+            Partial instances, which may lack required fields, are only repaired.
+        **kwargs: Additional arguments for the LLM (e.g.: temperature, max_tokens).
+
+    Returns:
+        Union[Dict, List]: The parsed JSON value.
+    """
+    response_schema = json_schema if is_json_schema(json_schema) else None
+    retry_on_fail = kwargs.get("retry_on_fail", True)
+    prompt = user_prompt
+    for attempt in range(2):
+        try:
+            resp_dict = create_response(
+                api=api,
+                model=model,
+                user_prompt=prompt,
+                system_prompt=system_prompt,
+                image_url=image_url,
+                temperature=kwargs.get("temperature", 0.0),
+                max_tokens=kwargs.get("max_tokens", 1024),
+                prompt_caching=kwargs.get("prompt_caching", False),
+                max_continuations=kwargs.get("max_continuations", MAX_CONTINUATIONS),
+                response_schema=response_schema,
+            )
+        except HTTPError as e:
+            if attempt or not retry_on_fail:
+                raise
+            logger.error(f"Error on {label}: {e}. Retrying in 10 seconds...")
+            sleep(10)
+            continue
+
+        response = resp_dict.get("response", "")
+        logger.debug(f"Processing {label} with response: {response}")
+        try:
+            value = parse_json_response(response)
+        except ValueError as e:
+            if attempt or not retry_on_fail:
+                raise ValueError(f"Invalid JSON for {label}: {e}") from e
+            errors = [f"The response is not valid JSON: {e}"]
+        else:
+            errors = []
+            if response_schema and validate:
+                # Without structured output, a page may list several records
+                records = value if isinstance(value, list) else [value]
+                for i, record in enumerate(records):
+                    path = f"$[{i}]" if isinstance(value, list) else "$"
+                    errors.extend(find_schema_errors(record, json_schema, path))
+            if not errors:
+                return value
+            if attempt or not retry_on_fail:
+                logger.warning(f"Schema mismatch on {label}: {errors}")
+                return value
+        logger.warning(f"Asking again for {label}: {errors}")
+        reask_prompt = SCHEMA_REASK_PROMPT.format(errors="\n".join(errors))
+        prompt = f"{user_prompt}\n\n{reask_prompt}"
+
+
+def fill_schema_by_chunks(
+    api: str,
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    json_schema: Dict,
+    chunks: List[List[Dict]],
+    **kwargs,
+) -> Union[Dict, List]:
+    """
+    Fills a single schema instance for a long document with map-reduce: a partial
+    instance is extracted from each chunk of pages concurrently, and the partial
+    instances are merged with `merge_schema_instances`. With `reconcile_schema`,
+    the LLM then reconciles the partial instances into the final one.
+
+    Args:
+        api (str): LLM API provider.
+        model (str): LLM model name.
+        system_prompt (str): Prompt describing the schema.
+        user_prompt (str): Extraction instructions.
+        json_schema (Dict): The schema to fill.
+        chunks (List[List[Dict]]): Parsed page segments, grouped into chunks.
+        **kwargs: Additional arguments for the LLM (e.g.: temperature, max_tokens,
+            max_processes, reconcile_schema).
+
+    Returns:
+        Union[Dict, List]: The merged instance.
+    """
+
+    def extract_chunk(chunk: List[Dict]) -> Union[Dict, List]:
+        pages = [segment.get("metadata", {}).get("page", "?") for segment in chunk]
+        content = "\n\n".join(segment["content"] for segment in chunk)
+        chunk_prompt = (
+            f"{user_prompt}\n\nContent of pages {pages[0]}-{pages[-1]} of a longer "
+            f"document:\n<content>\n{content}\n</content>\n\nPlease return a single "
+            "JSON instance that conforms to the provided schema with the information "
+            "found in this part of the document. Leave empty the fields it does not "
+            "contain."
+        )
+        return create_schema_response(
+            api,
+            model,
+            system_prompt,
+            chunk_prompt,
+            json_schema,
+            label=f"pages {pages[0]}-{pages[-1]}",
+            validate=False,
+            **kwargs,
+        )
+
+    max_processes = max(1, min(kwargs.get("max_processes", 4), len(chunks)))
+    with ThreadPoolExecutor(max_workers=max_processes) as executor:
+        partials = list(executor.map(extract_chunk, chunks))
+    merged, conflicts = merge_schema_instances(partials)
+    if conflicts:
+        logger.debug(f"Chunks disagree on {conflicts}; keeping the first values")
+    if not kwargs.get("reconcile_schema", False):
+        return merged
+
+    reconcile_prompt = (
+        f"{user_prompt}\n\nThe following JSON instances were extracted from "
+        f"consecutive parts of one document, in order:\n<instances>\n"
+        f"{json.dumps(partials, indent=2)}\n</instances>\n\nPlease combine them "
+        "into a single JSON instance for the entire document that conforms to the "
+        "provided schema, removing duplicate entries and resolving conflicting values."
+    )
+    return create_schema_response(
+        api,
+        model,
+        system_prompt,
+        reconcile_prompt,
+        json_schema,
+        label="reconciled document",
+        **kwargs,
+    )
+
+
+def get_page_images(path: str, **kwargs) -> Tuple[List[Tuple[int, str]], List[int]]:
+    """
+    Renders the pages of a document that are sent to an LLM one page per request.
+
+    Args:
+        path (str): Path to the PDF or image.
+        **kwargs: `page_nums`, `max_image_dimension`, `max_tokens` and
+            `adaptive_max_tokens`, as for `parse`.
+
+    Returns:
+        Tuple[List[Tuple[int, str]], List[int]]: The (page_num, base64 image)
+            pairs and the max_tokens of each page, indexed by page number.
+
+    Raises:
+        ValueError: If there are no pages to render, e.g. when `page_nums`
+            matches no page of the document.
+    """
+    images = convert_doc_to_base64_images(
+        path,
+        max_dimension=kwargs.get("max_image_dimension", DEFAULT_MAX_IMAGE_DIMENSION),
+        page_nums=kwargs.get("page_nums") if path.lower().endswith(".pdf") else None,
+    )
+    if not images:
+        raise ValueError(
+            f"No pages to parse in {path} (page_nums={kwargs.get('page_nums')})"
+        )
+    if kwargs.get("adaptive_max_tokens", False):
+        page_max_tokens = estimate_page_max_tokens(path)
+    else:
+        page_max_tokens = [kwargs.get("max_tokens", 1024)] * (images[-1][0] + 1)
+    return images, page_max_tokens
+
+
 def parse_with_schema(
     path: str,
     schema: Union[Dict, Type],
@@ -461,7 +1030,12 @@ def parse_with_schema(
         model (str, optional): LLM model name.
         example_schema (Dict): JSON schema with filled example values.
         alternate_keys (Dict): JSON schema with alternate keys for the keys in the schema.
-        **kwargs: Additional arguments for the parser (e.g.: temperature, max_tokens).
+        fill_single_schema (bool): Fill a single instance for the whole document.
+            Documents longer than `schema_chunk_tokens` (estimated) are extracted
+            per chunk of pages and merged (see `fill_schema_by_chunks`).
+        **kwargs: Additional arguments for the parser (e.g.: temperature, max_tokens,
+            page_nums, max_image_dimension). Pages are extracted concurrently, with
+            up to `max_processes` (default 4) requests in flight.
 
     Returns:
         List[Dict]: List of dictionaries, one for each page, each conforming to the provided schema.
@@ -521,41 +1095,55 @@ def parse_with_schema(
         response = parse(
             path, parser_type=ParserType.LLM_PARSE, api=api, model=model, **kwargs
         )
+        chunks = group_segments_by_tokens(
+            response["segments"],
+            kwargs.get("schema_chunk_tokens", SCHEMA_CHUNK_TOKENS),
+        )
+        if len(chunks) > 1:
+            return [
+                fill_schema_by_chunks(
+                    api,
+                    model,
+                    system_prompt,
+                    user_prompt,
+                    json_schema,
+                    chunks,
+                    **kwargs,
+                )
+            ]
         content = response["raw"]
         user_prompt += f"\n\nDocument content:\n<content>\n{content}\n</content>\n\nPlease parse the entire document and return a single JSON instance that conforms to the provided schema."
-        resp_dict = create_response(
-            api=api,
-            model=model,
-            user_prompt=user_prompt,
-            system_prompt=system_prompt,
-            temperature=kwargs.get("temperature", 0.0),
-            max_tokens=kwargs.get("max_tokens", 1024),
-        )
-        response = resp_dict.get("response", "")
-        response = response.split("```json")[-1].split("```")[0].strip()
-        logger.debug(f"Processing document with response: {response}")
-        return [json.loads(response)]
-
-    responses = []
-    images = convert_doc_to_base64_images(path)
-    for i, (page_num, image) in enumerate(images):
-        resp_dict = create_response(
-            api=api,
-            model=model,
-            user_prompt=user_prompt,
-            system_prompt=system_prompt,
+        return [
+            create_schema_response(
+                api,
+                model,
+                system_prompt,
+                user_prompt,
+                json_schema,
+                label="document",
+                **kwargs,
+            )
+        ]
+
+    images, page_max_tokens = get_page_images(path, **kwargs)
+
+    def parse_page(page_num: int, image: str) -> Dict:
+        return create_schema_response(
+            api,
+            model,
+            system_prompt,
+            user_prompt,
+            json_schema,
             image_url=image,
-            temperature=kwargs.get("temperature", 0.0),
-            max_tokens=kwargs.get("max_tokens", 1024),
+            label=f"page {page_num + 1}",
+            **{**kwargs, "max_tokens": page_max_tokens[page_num]},
         )
 
-        response = resp_dict.get("response", "")
-        response = response.split("```json")[-1].split("```")[0].strip()
-        logger.debug(f"Processing page {page_num + 1} with response: {response}")
-        new_dict = json.loads(response)
-        responses.append(new_dict)
-
-    return responses
+    max_processes = max(1, min(kwargs.get("max_processes", 4), len(images)))
+    if max_processes == 1:
+        return [parse_page(page_num, image) for page_num, image in images]
+    with ThreadPoolExecutor(max_workers=max_processes) as executor:
+        return list(executor.map(parse_page, *zip(*images)))
 
 
 def parse_to_latex(
@@ -574,8 +1162,7 @@ def parse_to_latex(
 
     user_prompt = LATEX_USER_PROMPT
 
-    responses = []
-    images = convert_doc_to_base64_images(path)
+    images, page_max_tokens = get_page_images(path, **kwargs)
     total_pages = len(images)
 
     if total_pages == 1:
@@ -583,26 +1170,45 @@ def parse_to_latex(
     else:
         first_prompt += "\n\nDo NOT write \\end{document} yet."
 
-    for i, (page_num, image) in enumerate(images):
+    def convert_page(i: int, page_num: int, image: str) -> str:
         if i == 0:
             system_prompt = first_prompt
         elif i == total_pages - 1:
-            system_prompt = middle_prompt
-        else:
             system_prompt = last_prompt
+        else:
+            system_prompt = middle_prompt
 
-        resp_dict = create_response(
-            api=api,
-            model=model,
-            user_prompt=user_prompt,
-            system_prompt=system_prompt,
-            image_url=image,
-            temperature=kwargs.get("temperature", 0.0),
-            max_tokens=kwargs.get("max_tokens", 1024),
-        )
+        # Retry once on API errors, like `parse_llm_doc`
+        for attempt in range(2):
+            try:
+                resp_dict = create_response(
+                    api=api,
+                    model=model,
+                    user_prompt=user_prompt,
+                    system_prompt=system_prompt,
+                    image_url=image,
+                    temperature=kwargs.get("temperature", 0.0),
+                    max_tokens=page_max_tokens[page_num],
+                    prompt_caching=kwargs.get("prompt_caching", False),
+                    max_continuations=kwargs.get(
+                        "max_continuations", MAX_CONTINUATIONS
+                    ),
+                )
+                break
+            except HTTPError as e:
+                if attempt or not kwargs.get("retry_on_fail", True):
+                    raise
+                logger.error(
+                    f"Error on page {page_num + 1}: {e}. Retrying in 10 seconds..."
+                )
+                sleep(10)
         response = resp_dict.get("response", "").strip()
         response = response.split("```latex")[-1].split("```")[0].strip()
         logger.debug(f"Processing page {page_num + 1} with response:\n{response}")
-        responses.append(response)
+        return response
 
-    return "\n\n".join(responses)
+    # Pages do not depend on each other, so they are converted concurrently
+    max_processes = max(1, min(kwargs.get("max_processes", 4), total_pages))
+    with ThreadPoolExecutor(max_workers=max_processes) as executor:
+        responses = executor.map(convert_page, range(total_pages), *zip(*images))
+        return "\n\n".join(responses)
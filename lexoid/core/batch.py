@@ -0,0 +1,370 @@
+"""
+Offline batch mode for bulk LLM parsing.
+
+Page requests for a whole corpus are written in the provider batch formats
+(OpenAI Batch JSONL / Anthropic Message Batches), submitted, polled until they
+finish and reassembled into the same result dicts returned by `parse()`.
+
+Progress is tracked in a JSON manifest so an interrupted run can be resumed:
+submitted batches are polled again instead of being resubmitted and finished
+results are kept in the manifest. The OpenAI and Anthropic clients honour
+`OPENAI_BASE_URL` / `ANTHROPIC_BASE_URL`, which can point at a local stand-in
+server implementing the batch endpoints.
+"""
+
+import io
+import json
+import os
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from lexoid.core.conversion_utils import convert_doc_to_base64_images
+from lexoid.core.parse_type.llm_parser import (
+    extract_output_content,
+    get_anthropic_request_params,
+    get_anthropic_usage,
+    get_openai_request_params,
+    get_openai_usage,
+    get_parser_prompts,
+    to_token_usage,
+)
+from lexoid.core.utils import (
+    BATCH_MAX_BYTES,
+    BATCH_MAX_REQUESTS,
+    BATCH_POLL_INTERVAL,
+    DEFAULT_MAX_IMAGE_DIMENSION,
+    create_sub_pdf,
+    get_file_type,
+    merge_token_usage,
+    resize_image_if_needed,
+)
+
+BATCH_APIS = {"openai", "anthropic"}
+OPENAI_BATCH_ENDPOINT = "/v1/chat/completions"
+
+
+def build_batch_request(api: str, custom_id: str, image_url: str, **kwargs) -> Dict:
+    """
+    Build a single batch request line for one page image.
+
+    Args:
+        api (str): Batch API provider ("openai" or "anthropic").
+        custom_id (str): Identifier used to match the result to the page.
+        image_url (str): Base64 data URL of the page image.
+        **kwargs: Parser arguments (model, temperature, max_tokens, etc.).
+
+    Returns:
+        Dict: Request in the provider's batch input format.
+    """
+    system_prompt, user_prompt = get_parser_prompts(api, **kwargs)
+    if api == "openai":
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": OPENAI_BATCH_ENDPOINT,
+            "body": get_openai_request_params(
+                api=api,
+                model=kwargs["model"],
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                image_url=image_url,
+                prompt_caching=kwargs.get("prompt_caching", False),
+            ),
+        }
+    if api == "anthropic":
+        return {
+            "custom_id": custom_id,
+            "params": get_anthropic_request_params(
+                model=kwargs["model"],
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                image_url=image_url,
+                temperature=kwargs.get("temperature", 0.0),
+                max_tokens=kwargs.get("max_tokens", 1024),
+                prompt_caching=kwargs.get("prompt_caching", False),
+            ),
+        }
+    raise ValueError(f"Batch mode is not supported for the {api} API")
+
+
+def submit_openai_batch(requests: List[Dict]) -> str:
+    from openai import OpenAI
+
+    client = OpenAI()
+    jsonl = "\n".join(json.dumps(request) for request in requests)
+    input_file = client.files.create(
+        file=("lexoid_batch.jsonl", io.BytesIO(jsonl.encode("utf-8"))),
+        purpose="batch",
+    )
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=OPENAI_BATCH_ENDPOINT,
+        completion_window="24h",
+    )
+    return batch.id
+
+
+def poll_openai_batch(batch_id: str) -> Tuple[str, Optional[Dict[str, Dict]]]:
+    """Returns the batch status and, once the batch has ended, its results."""
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletion
+
+    client = OpenAI()
+    batch = client.batches.retrieve(batch_id)
+    if batch.status not in ("completed", "failed", "expired", "cancelled"):
+        return batch.status, None
+
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                error = item.get("error") or response.get("body", {}).get("error")
+                results[item["custom_id"]] = {"error": str(error)}
+                continue
+            completion = ChatCompletion.model_validate(response["body"])
+            results[item["custom_id"]] = {
+                "response": completion.choices[0].message.content,
+                "usage": get_openai_usage(completion.usage),
+            }
+    return batch.status, results
+
+
+def submit_anthropic_batch(requests: List[Dict]) -> str:
+    from anthropic import Anthropic
+
+    client = Anthropic()
+    batch = client.messages.batches.create(requests=requests)
+    return batch.id
+
+
+def poll_anthropic_batch(batch_id: str) -> Tuple[str, Optional[Dict[str, Dict]]]:
+    """Returns the batch status and, once the batch has ended, its results."""
+    from anthropic import Anthropic
+
+    client = Anthropic()
+    batch = client.messages.batches.retrieve(batch_id)
+    if batch.processing_status != "ended":
+        return batch.processing_status, None
+
+    results = {}
+    for item in client.messages.batches.results(batch_id):
+        if item.result.type != "succeeded":
+            error = getattr(item.result, "error", None) or item.result.type
+            results[item.custom_id] = {"error": str(error)}
+            continue
+        message = item.result.message
+        results[item.custom_id] = {
+            "response": message.content[0].text,
+            "usage": get_anthropic_usage(message.usage),
+        }
+    return batch.processing_status, results
+
+
+BATCH_BACKENDS: Dict[str, Tuple[Callable, Callable]] = {
+    "openai": (submit_openai_batch, poll_openai_batch),
+    "anthropic": (submit_anthropic_batch, poll_anthropic_batch),
+}
+
+
+def load_manifest(manifest_path: str, api: str, model: str) -> Dict:
+    if not os.path.exists(manifest_path):
+        return {
+            "api": api,
+            "model": model,
+            "documents": [],
+            "batches": [],
+            "results": {},
+        }
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if (manifest["api"], manifest["model"]) != (api, model):
+        raise ValueError(
+            f"Manifest {manifest_path} was created for {manifest['api']}/"
+            f"{manifest['model']}, not {api}/{model}."
+        )
+    return manifest
+
+
+def save_manifest(manifest: Dict, manifest_path: str):
+    # Write to a temporary file first so an interrupted run never leaves a
+    # truncated manifest behind.
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def get_page_images(path: str, temp_dir: str, **kwargs) -> List[Tuple[int, str]]:
+    """Render the pages of a PDF or image the same way `parse()` prepares them."""
+    max_dimension = kwargs.get("max_image_dimension", DEFAULT_MAX_IMAGE_DIMENSION)
+    if "image" in get_file_type(path):
+        path = resize_image_if_needed(
+            path, max_dimension=max_dimension, tmpdir=temp_dir
+        )
+    elif "page_nums" in kwargs and path.lower().endswith(".pdf"):
+        sub_pdf_path = os.path.join(temp_dir, os.path.basename(path))
+        path = create_sub_pdf(path, sub_pdf_path, kwargs["page_nums"])
+    return convert_doc_to_base64_images(path, max_dimension=max_dimension)
+
+
+def submit_pending_requests(
+    api: str, manifest: Dict, manifest_path: str, paths: List[str], **kwargs
+):
+    """Add new documents to the manifest and submit every page not yet in a batch."""
+    submit, _ = BATCH_BACKENDS[api]
+    known_paths = {doc["path"] for doc in manifest["documents"]}
+    for path in paths:
+        if path not in known_paths:
+            manifest["documents"].append(
+                {"path": path, "title": os.path.basename(path), "pages": None}
+            )
+            known_paths.add(path)
+
+    submitted = {
+        custom_id for batch in manifest["batches"] for custom_id in batch["custom_ids"]
+    }
+    pending_requests, pending_bytes = [], 0
+
+    def flush():
+        nonlocal pending_requests, pending_bytes
+        if not pending_requests:
+            return
+        batch_id = submit(pending_requests)
+        custom_ids = [request["custom_id"] for request in pending_requests]
+        manifest["batches"].append(
+            {"id": batch_id, "status": "submitted", "custom_ids": custom_ids}
+        )
+        save_manifest(manifest, manifest_path)
+        logger.debug(f"Submitted batch {batch_id} with {len(custom_ids)} requests")
+        pending_requests, pending_bytes = [], 0
+
+    for doc_idx, doc in enumerate(manifest["documents"]):
+        if doc["pages"] is not None and all(
+            page["custom_id"] in submitted for page in doc["pages"]
+        ):
+            continue
+        with tempfile.TemporaryDirectory() as temp_dir:
+            images = get_page_images(doc["path"], temp_dir, **kwargs)
+        doc["pages"] = [
+            {"page": page_num, "custom_id": f"doc{doc_idx}-page{page_num}"}
+            for page_num, _ in images
+        ]
+        for page, (_, image_url) in zip(doc["pages"], images):
+            if page["custom_id"] in submitted:
+                continue
+            request = build_batch_request(api, page["custom_id"], image_url, **kwargs)
+            request_bytes = len(json.dumps(request))
+            if pending_requests and (
+                len(pending_requests) >= BATCH_MAX_REQUESTS
+                or pending_bytes + request_bytes > BATCH_MAX_BYTES
+            ):
+                flush()
+            pending_requests.append(request)
+            pending_bytes += request_bytes
+    flush()
+    save_manifest(manifest, manifest_path)
+
+
+def wait_for_batches(
+    api: str, manifest: Dict, manifest_path: str, poll_interval: int
+) -> None:
+    """Poll unfinished batches until all of them have ended, storing their results."""
+    _, poll = BATCH_BACKENDS[api]
+    while True:
+        running = [batch for batch in manifest["batches"] if not batch.get("ended")]
+        for batch in running:
+            status, results = poll(batch["id"])
+            batch["status"] = status
+            if results is None:
+                continue
+            for custom_id in batch["custom_ids"]:
+                manifest["results"][custom_id] = results.get(
+                    custom_id, {"error": f"No result in batch ({status})"}
+                )
+            batch["ended"] = True
+            logger.debug(f"Batch {batch['id']} ended with status {status}")
+        save_manifest(manifest, manifest_path)
+        if all(batch.get("ended") for batch in manifest["batches"]):
+            return
+        time.sleep(poll_interval)
+
+
+def assemble_result(doc: Dict, results: Dict, **kwargs) -> Dict:
+    """Build a `parse()` result dict for one document from its batch results."""
+    segments, token_usages = [], []
+    for page in doc["pages"]:
+        result = results[page["custom_id"]]
+        metadata = {"page": kwargs.get("start", 0) + page["page"] + 1}
+        if "error" in result:
+            logger.warning(
+                f"Batch request for page {page['page'] + 1} of {doc['path']} "
+                f"failed: {result['error']}"
+            )
+            metadata["error"] = result["error"]
+            segments.append({"metadata": metadata, "content": ""})
+            continue
+        token_usage = to_token_usage(result["usage"])
+        token_usages.append({**token_usage, "llm_page_count": 1})
+        metadata["token_usage"] = token_usage
+        segments.append(
+            {
+                "metadata": metadata,
+                "content": extract_output_content(result["response"]),
+            }
+        )
+
+    return {
+        "raw": "\n\n".join(segment["content"] for segment in segments),
+        "segments": segments,
+        "title": doc["title"],
+        "url": kwargs.get("url", ""),
+        "parent_title": kwargs.get("parent_title", ""),
+        "recursive_docs": [],
+        "token_usage": merge_token_usage(token_usages),
+        "parsers_used": ["LLM_PARSE"],
+    }
+
+
+def run_batch_parse(
+    paths: List[str],
+    api: str,
+    manifest_path: str,
+    poll_interval: int = BATCH_POLL_INTERVAL,
+    **kwargs,
+) -> List[Dict]:
+    """
+    Parse documents through a provider batch API.
+
+    Args:
+        paths (List[str]): Paths of the PDFs / images to parse.
+        api (str): Batch API provider ("openai" or "anthropic").
+        manifest_path (str): JSON manifest used to track and resume the job.
+        poll_interval (int): Seconds between batch status checks.
+        **kwargs: Parser arguments (model, temperature, max_tokens, etc.).
+
+    Returns:
+        List[Dict]: One `parse()` style result dict per path, in order.
+    """
+    if api not in BATCH_APIS:
+        raise ValueError(
+            f"Batch mode is not supported for the {api} API. "
+            f"Supported APIs: {sorted(BATCH_APIS)}"
+        )
+    manifest = load_manifest(manifest_path, api, kwargs["model"])
+    submit_pending_requests(api, manifest, manifest_path, paths, **kwargs)
+    wait_for_batches(api, manifest, manifest_path, poll_interval)
+
+    documents = {doc["path"]: doc for doc in manifest["documents"]}
+    return [
+        assemble_result(documents[path], manifest["results"], **kwargs)
+        for path in paths
+    ]
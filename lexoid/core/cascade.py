@@ -0,0 +1,273 @@
+"""
+Cheap-first model cascade for LLM parsing.
+
+Every page is parsed with the first model of the cascade. Pages whose output
+fails one of that stage's quality checks are parsed again with the next model,
+and so on, so that stronger (and more expensive) models only see the pages that
+need them. Each page records the model that produced its final content and the
+usage and cost of every model it went through.
+"""
+
+import os
+import re
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from lexoid.core.parse_type.llm_parser import parse_llm_doc, split_token_usage
+from lexoid.core.utils import (
+    TOKEN_USAGE_KEYS,
+    compute_token_cost,
+    create_sub_pdf,
+    estimate_page_chars,
+    get_pdf_page_texts,
+    load_api_cost_mapping,
+    merge_token_cost,
+    merge_token_usage,
+    strip_markdown,
+)
+
+CASCADE_CHECKS = [
+    "short_output",
+    "malformed_table",
+    "missing_output_tag",
+    "text_layer_mismatch",
+]
+# Stage keys that configure escalation; all other keys are passed to the parser
+STAGE_RULE_KEYS = {"escalate_on", "min_output_ratio", "min_text_overlap"}
+
+TABLE_SEPARATOR_PATTERN = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+WORD_PATTERN = re.compile(r"\w{3,}")
+
+
+def has_malformed_table(content: str) -> bool:
+    """
+    Checks for broken tables: unbalanced HTML table tags, or Markdown tables
+    without a separator row or with rows of differing column counts.
+    """
+    for tag in ("table", "tr"):
+        if len(re.findall(rf"<{tag}[\s>]", content)) != content.count(f"</{tag}>"):
+            return True
+
+    table: List[str] = []
+    for line in content.splitlines() + [""]:
+        line = line.strip()
+        if line.startswith("|"):
+            table.append(line)
+            continue
+        if len(table) > 1:
+            if not TABLE_SEPARATOR_PATTERN.match(table[1]):
+                return True
+            column_counts = {len(row.strip("|").split("|")) for row in table}
+            if len(column_counts) > 1:
+                return True
+        table = []
+    return False
+
+
+def text_layer_overlap(content: str, text_layer: str) -> Optional[float]:
+    """
+    Fraction of the distinct words of the PDF text layer that appear in the
+    parsed content, or None if the text layer has too few words to judge.
+    """
+    layer_words = set(WORD_PATTERN.findall(text_layer.lower()))
+    if len(layer_words) < 20:
+        return None
+    content_words = set(WORD_PATTERN.findall(strip_markdown(content).lower()))
+    return len(layer_words & content_words) / len(layer_words)
+
+
+def check_page(
+    segment: Dict, expected_chars: float, text_layer: str, stage: Dict
+) -> List[str]:
+    """
+    Runs the escalation checks configured for a cascade stage on one page.
+
+    Args:
+        segment (Dict): The page's parsed segment.
+        expected_chars (float): Estimated character count of the page.
+        text_layer (str): The page's PDF text layer ("" for images).
+        stage (Dict): Cascade stage, with optional `escalate_on`,
+            `min_output_ratio` and `min_text_overlap`.
+
+    Returns:
+        List[str]: Names of the failed checks.
+    """
+    content = segment["content"]
+    failed = []
+    for check in stage.get("escalate_on", CASCADE_CHECKS):
+        if check == "short_output":
+            n_chars = len("".join(strip_markdown(content).split()))
+            if expected_chars >= 200 and n_chars < expected_chars * stage.get(
+                "min_output_ratio", 0.2
+            ):
+                failed.append(check)
+        elif check == "malformed_table":
+            if has_malformed_table(content):
+                failed.append(check)
+        elif check == "missing_output_tag":
+            if segment.get("metadata", {}).get("missing_output_tag"):
+                failed.append(check)
+        elif check == "text_layer_mismatch":
+            overlap = text_layer_overlap(content, text_layer)
+            if overlap is not None and overlap < stage.get("min_text_overlap", 0.5):
+                failed.append(check)
+        else:
+            raise ValueError(
+                f"Unknown cascade check: {check}. Use one of {CASCADE_CHECKS}."
+            )
+    return failed
+
+
+def run_cascade(path: str, **kwargs) -> Dict:
+    """
+    Parses a document with a cascade of LLMs, escalating failing pages.
+
+    Args:
+        path (str): Path to the PDF or image.
+        **kwargs: Parser arguments. `cascade` lists the stages in order; each is
+            a dict with the `model` (and optionally `api_provider` or any other
+            parser argument) plus escalation rules: `escalate_on` (checks run
+            on that stage's output, default all of `CASCADE_CHECKS`),
+            `min_output_ratio` and `min_text_overlap`.
+
+    Returns:
+        Dict: Dictionary containing parsed document data. Each segment's
+            metadata has `model_used`, the per-model `cascade` history and the
+            page's summed `token_usage` (and `token_cost` when
+            `api_cost_mapping` is given). The result's `token_cost` prices each
+            stage with its own model.
+    """
+    cascade = kwargs.pop("cascade")
+    start = kwargs.get("start", 0)
+    is_pdf = path.lower().endswith(".pdf")
+    expected_chars = estimate_page_chars(path)
+    text_layers = get_pdf_page_texts(path) if is_pdf else [""]
+    n_pages = len(expected_chars)
+    api_cost_mapping = (
+        load_api_cost_mapping(kwargs["api_cost_mapping"])
+        if "api_cost_mapping" in kwargs
+        else {}
+    )
+
+    segments: Dict[int, Dict] = {}
+    history: Dict[int, List[Dict]] = {page: [] for page in range(n_pages)}
+    token_usages = []
+    token_costs = []
+    pending = list(range(n_pages))
+    for level, stage in enumerate(cascade):
+        if not pending:
+            break
+        stage_kwargs = {
+            **kwargs,
+            **{k: v for k, v in stage.items() if k not in STAGE_RULE_KEYS},
+            "start": 0,
+        }
+        if "api_provider" not in stage:
+            # The provider is inferred from each stage's model
+            stage_kwargs.pop("api_provider", None)
+        model = stage_kwargs["model"]
+        stage_path = path
+        if is_pdf and len(pending) < n_pages:
+            stage_path = create_sub_pdf(
+                path,
+                os.path.join(
+                    kwargs.get("temp_dir") or os.path.dirname(path),
+                    f"cascade_{level}_{os.path.basename(path)}",
+                ),
+                [page + 1 for page in pending],
+            )
+        logger.debug(
+            f"Cascade stage {level + 1}: parsing pages "
+            f"{[start + page + 1 for page in pending]} with {model}"
+        )
+        result = parse_llm_doc(stage_path, **stage_kwargs)
+        stage_usage = {
+            key: result.get("token_usage", {}).get(key, 0)
+            for key in TOKEN_USAGE_KEYS + ["total"]
+        }
+        token_usages.append({**stage_usage, "llm_page_count": len(pending)})
+        if model in api_cost_mapping:
+            token_costs.append(
+                compute_token_cost(token_usages[-1], api_cost_mapping[model])
+            )
+
+        # Usage is per page for page-by-page APIs, otherwise split evenly
+        shared_usages = split_token_usage(stage_usage, max(1, len(result["segments"])))
+        stage_segments = {}
+        for i, segment in enumerate(result["segments"]):
+            index = segment["metadata"]["page"] - 1
+            if 0 <= index < len(pending):
+                segment["metadata"].setdefault("token_usage", shared_usages[i])
+                stage_segments[pending[index]] = segment
+
+        is_last = level == len(cascade) - 1
+        next_pending = []
+        for page in pending:
+            segment = stage_segments.get(page)
+            if segment is None:
+                failed = ["missing_page"]
+                usage = {key: 0 for key in TOKEN_USAGE_KEYS + ["total"]}
+            else:
+                failed = check_page(
+                    segment, expected_chars[page], text_layers[page], stage
+                )
+                usage = segment["metadata"]["token_usage"]
+                segments[page] = segment
+            attempt = {"model": model, "failed_checks": failed, "token_usage": usage}
+            if model in api_cost_mapping:
+                attempt["token_cost"] = compute_token_cost(
+                    {**usage, "llm_page_count": 1},
+                    api_cost_mapping[model],
+                )
+            history[page].append(attempt)
+            if failed and not is_last:
+                next_pending.append(page)
+        if next_pending:
+            logger.debug(
+                f"Escalating pages {[start + page + 1 for page in next_pending]}"
+            )
+        pending = next_pending
+
+    ordered_segments = []
+    for page in range(n_pages):
+        segment = segments.get(page)
+        if segment is None:
+            # Keep an empty segment so that pages stay aligned with the input
+            logger.warning(f"No cascade stage returned page {start + page + 1}")
+            segment = {"metadata": {"missing_page": True}, "content": ""}
+        attempts = history[page]
+        metadata = segment["metadata"]
+        metadata["page"] = start + page + 1
+        metadata["model_used"] = next(
+            (
+                attempt["model"]
+                for attempt in reversed(attempts)
+                if attempt["failed_checks"] != ["missing_page"]
+            ),
+            None,
+        )
+        metadata["cascade"] = attempts
+        metadata["token_usage"] = {
+            key: sum(attempt["token_usage"].get(key, 0) for attempt in attempts)
+            for key in TOKEN_USAGE_KEYS + ["total"]
+        }
+        if api_cost_mapping:
+            metadata["token_cost"] = merge_token_cost(
+                [attempt.get("token_cost", {}) for attempt in attempts]
+            )
+        ordered_segments.append(segment)
+
+    result = {
+        "raw": "\n\n".join(segment["content"] for segment in ordered_segments),
+        "segments": ordered_segments,
+        "title": kwargs.get("title", ""),
+        "url": kwargs.get("url", ""),
+        "parent_title": kwargs.get("parent_title", ""),
+        "recursive_docs": [],
+        "token_usage": merge_token_usage(token_usages),
+    }
+    if api_cost_mapping:
+        # Priced per stage, as each stage's request was billed
+        result["token_cost"] = merge_token_cost(token_costs)
+    return result
@@ -1,11 +1,23 @@
 import base64
 import dataclasses
 import io
+import json
 import mimetypes
 import os
 import subprocess
 import sys
-from typing import Any, Dict, List, Tuple, Type, Union, get_args, get_origin
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+    get_args,
+    get_origin,
+)
 
 import cv2
 import docx2pdf
@@ -45,7 +57,9 @@ def convert_pdf_page_to_base64(
 
 
 def convert_doc_to_base64_images(
-    path: str, max_dimension: int = DEFAULT_MAX_IMAGE_DIMENSION
+    path: str,
+    max_dimension: int = DEFAULT_MAX_IMAGE_DIMENSION,
+    page_nums: Optional[Union[Tuple[int, ...], List[int], int]] = None,
 ) -> List[Tuple[int, str]]:
     """
     Converts a document (PDF or image) to a base64 encoded string.
@@ -53,6 +67,9 @@ def convert_doc_to_base64_images(
     Args:
         path (str): Path to the document.
         max_dimension (int): Maximum dimension (width or height) for the output images.
+        page_nums (Union[Tuple[int, ...], List[int], int], optional): 1-based page
+            numbers of a PDF to convert. All pages are converted if not given,
+            and numbers outside the document are ignored.
 
     Returns:
         List[Tuple[int, str]]: A list of tuples where each tuple contains the page number
@@ -60,12 +77,23 @@ def convert_doc_to_base64_images(
     """
     if path.endswith(".pdf"):
         pdf_document = pdfium.PdfDocument(path)
+        if isinstance(page_nums, int):
+            page_nums = (page_nums,)
+        page_indices = (
+            [
+                page - 1
+                for page in sorted(set(page_nums))
+                if 1 <= page <= len(pdf_document)
+            ]
+            if page_nums
+            else range(len(pdf_document))
+        )
         images = [
             (
                 page_num,
                 f"data:image/png;base64,{convert_pdf_page_to_base64(pdf_document, page_num, max_dimension)}",
             )
-            for page_num in range(len(pdf_document))
+            for page_num in page_indices
         ]
         pdf_document.close()
         return images
@@ -76,6 +104,33 @@ def convert_doc_to_base64_images(
             return [(0, f"data:{mime_type};base64,{image_base64}")]
 
 
+def convert_doc_to_np_arrays(path: str, scale: float = 2.0) -> Iterator[np.ndarray]:
+    """
+    Renders a document (PDF or image) to one BGR numpy array per page.
+
+    Pages are rendered as they are consumed, so only the pages the caller holds
+    on to are kept in memory.
+
+    Args:
+        path (str): Path to the document.
+        scale (float): Render scale for PDF pages (1.0 = 72 DPI).
+
+    Yields:
+        np.ndarray: Page images in OpenCV (BGR) channel order.
+    """
+    if not path.lower().endswith(".pdf"):
+        yield cv2.imread(path)
+        return
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        for page_num in range(len(pdf_document)):
+            # pdfium renders in BGR byte order, which is what OpenCV-based models
+            # expect
+            yield pdf_document[page_num].render(scale=scale).to_numpy()
+    finally:
+        pdf_document.close()
+
+
 def base64_to_bytesio(b64_string: str) -> io.BytesIO:
     image_data = base64.b64decode(b64_string.split(",")[1])
     return io.BytesIO(image_data)
@@ -339,3 +394,204 @@ def _python_type_to_schema(tp: Any) -> Dict:
 
     # Fallback
     return {"type": "string"}
+
+
+JSON_SCHEMA_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def is_json_schema(schema: Dict) -> bool:
+    """
+    Whether a schema is a JSON Schema object (as produced for dataclasses and
+    Pydantic models), rather than an informal dict of field names to types.
+    """
+    return schema.get("type") == "object" and isinstance(schema.get("properties"), dict)
+
+
+def _matches_json_type(value: Any, json_type: str) -> bool:
+    if json_type not in JSON_SCHEMA_TYPES:
+        return True
+    if isinstance(value, bool) and json_type in ("integer", "number"):
+        return False
+    return isinstance(value, JSON_SCHEMA_TYPES[json_type])
+
+
+def find_schema_errors(value: Any, schema: Dict, path: str = "$") -> List[str]:
+    """
+    Checks a JSON value against the subset of JSON Schema used by Lexoid
+    (`type`, `properties`, `required`, `items` and `enum`).
+
+    Args:
+        value (Any): The parsed JSON value.
+        schema (Dict): The JSON Schema.
+        path (str): Location of `value`, used in the error messages.
+
+    Returns:
+        List[str]: Human-readable validation errors (empty if the value is valid).
+    """
+    json_types = schema.get("type", [])
+    if isinstance(json_types, str):
+        json_types = [json_types]
+    if json_types and not any(_matches_json_type(value, t) for t in json_types):
+        return [f"{path}: expected {' or '.join(json_types)}, got {value!r:.50}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r:.50} is not one of {schema['enum']}"]
+
+    errors = []
+    if isinstance(value, dict):
+        required = schema.get("required", [])
+        errors.extend(
+            f"{path}: missing required property '{key}'"
+            for key in required
+            if key not in value
+        )
+        for key, property_schema in schema.get("properties", {}).items():
+            # Optional fields may be null
+            if key in value and (value[key] is not None or key in required):
+                errors.extend(
+                    find_schema_errors(value[key], property_schema, f"{path}.{key}")
+                )
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for i, item in enumerate(value):
+            errors.extend(find_schema_errors(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _merge_values(values: List[Any], path: str, conflicts: List[str]) -> Any:
+    filled = [value for value in values if not _is_empty(value)]
+    if not filled:
+        return values[0] if values else None
+    if all(isinstance(value, dict) for value in filled):
+        keys = dict.fromkeys(key for value in filled for key in value)
+        return {
+            key: _merge_values(
+                [value[key] for value in filled if key in value],
+                f"{path}.{key}",
+                conflicts,
+            )
+            for key in keys
+        }
+    if all(isinstance(value, list) for value in filled):
+        merged, seen = [], set()
+        for item in (item for value in filled for item in value):
+            item_key = json.dumps(item, sort_keys=True)
+            if item_key not in seen:
+                seen.add(item_key)
+                merged.append(item)
+        return merged
+    if any(value != filled[0] for value in filled[1:]):
+        conflicts.append(path)
+    return filled[0]
+
+
+def merge_schema_instances(instances: List[Any]) -> Tuple[Any, List[str]]:
+    """
+    Deterministically merges partial JSON instances of a schema, extracted from
+    consecutive parts of a document.
+
+    Objects are merged key by key, lists are concatenated in order without
+    duplicate items, and for other values the first non-empty one wins.
+
+    Args:
+        instances (List[Any]): The partial instances, in document order.
+
+    Returns:
+        Tuple[Any, List[str]]: The merged instance and the paths of the values
+            that differed between instances.
+    """
+    conflicts: List[str] = []
+    return _merge_values(instances, "$", conflicts), conflicts
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort repair of a JSON value in LLM output.
+
+    Text around the first object or array (prose, code fences) and trailing
+    commas are dropped, and strings, arrays and objects left open by a truncated
+    response are closed. A trailing member that was cut off mid-value is removed.
+
+    Args:
+        text (str): The model response.
+
+    Returns:
+        str: The repaired JSON text. It is not guaranteed to be valid.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object or array found in the response")
+
+    out: List[str] = []
+    stack: List[str] = []
+    # Output length and open containers at the last point a truncated value can
+    # be cut back to: right after an opening bracket or before a comma
+    checkpoint: Tuple[int, List[str]] = (0, [])
+    in_string = escaped = False
+    for char in text[min(starts) :]:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            out.append(char)
+            checkpoint = (len(out), list(stack))
+            continue
+        elif char in "}]":
+            if not stack or char != stack[-1]:
+                break
+            while out and out[-1] in ", \t\r\n":
+                out.pop()
+            stack.pop()
+            out.append(char)
+            if not stack:
+                return "".join(out)
+            continue
+        elif char == ",":
+            checkpoint = (len(out), list(stack))
+        out.append(char)
+
+    if escaped:
+        out.pop()
+    closed = "".join(out) + ('"' if in_string else "")
+    closed = closed.rstrip(", \t\r\n") + "".join(reversed(stack))
+    try:
+        json.loads(closed)
+        return closed
+    except ValueError:
+        length, open_containers = checkpoint
+        truncated = "".join(out[:length]).rstrip(", \t\r\n")
+        return truncated + "".join(reversed(open_containers))
+
+
+def parse_json_response(response: str) -> Any:
+    """
+    Parses the JSON value in an LLM response, taken from the last ```json code
+    block if there is one, falling back to `repair_json` for malformed output.
+
+    Raises:
+        ValueError: If no JSON value can be recovered.
+    """
+    text = response.split("```json")[-1].split("```")[0].strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(repair_json(response))
@@ -0,0 +1,201 @@
+import re
+from collections import deque
+from typing import List, Tuple
+
+# Reference: https://huggingface.co/ibm-granite/granite-docling-258M
+TAG_PATTERN = re.compile(r"<[^>]+>")
+# Same matches as TAG_PATTERN, with well-formed <loc_N> tags captured for a fast path
+TOKEN_PATTERN = re.compile(r"<loc_(\d+)>|<[^>]+>")
+LOC_PATTERN = re.compile(r"<loc_(\d+)>")
+HEADER_OPEN_PATTERN = re.compile(r"<section_header_level_(\d+)>")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Parser states
+_TOP, _HEADER, _TEXT, _OTSL, _CELL = range(5)
+
+
+class DocTagsParser:
+    """
+    Single-pass, incremental parser for a subset of DocTags/OTSL:
+      - <section_header_level_N>Title</section_header_level_N> -> Markdown #... heading
+      - <text>Paragraph</text> -> Markdown paragraph
+      - <otsl> with <ched>, <fcel>, <nl> -> Markdown table
+    Bboxes: when 4 successive <loc_*> appear before a textual atom, assign that bbox
+    normalized to [0,1] via 500-scale reported by the model.
+
+    Model output can be passed to `feed` in arbitrary chunks as it is generated;
+    `finish` closes any open block and returns ``(markdown, bboxes)``.
+    """
+
+    def __init__(self):
+        self.md_lines: List[str] = []
+        self.bboxes: List[Tuple[str, List[float]]] = []
+        self._buffer = ""
+        self._state = _TOP
+        self._level = 1
+        self._inner: List[str] = []
+        self._locs: deque = deque(maxlen=4)
+        # Set by every <loc_N> once four have been seen; the pending bbox is then
+        # always the last four locs, so it is only materialized when taken.
+        self._bbox_pending = False
+        self._headers: List[str] = []
+        self._rows: List[List[str]] = []
+        self._current_row: List[str] = []
+        self._cell_is_header = False
+
+    def feed(self, chunk: str) -> None:
+        """Consume every complete tag in the buffered output, keeping the tail."""
+        buffer = self._buffer + chunk
+        locs = self._locs
+        token = self._token
+        pos = 0
+        for match in TOKEN_PATTERN.finditer(buffer):
+            start = match.start()
+            if start != pos:
+                token(buffer[pos:start])
+            loc = match.group(1)
+            if loc is None:
+                token(match.group())
+            else:
+                # <loc_N> updates the bbox in every state, but still ends a cell
+                if self._state == _CELL:
+                    self._close_cell()
+                locs.append(int(loc))
+                if len(locs) == 4:
+                    self._bbox_pending = True
+            pos = match.end()
+        self._buffer = buffer[pos:]
+
+    def finish(self) -> Tuple[str, List[Tuple[str, List[float]]]]:
+        self._token(self._buffer)
+        self._buffer = ""
+        if self._state in (_HEADER, _TEXT):
+            self._close_block()
+        elif self._state in (_OTSL, _CELL):
+            if self._state == _CELL:
+                self._close_cell()
+            self._close_table()
+        self._state = _TOP
+        return "\n".join(self.md_lines), self.bboxes
+
+    def _update_bbox(self, tag: str) -> None:
+        m = LOC_PATTERN.fullmatch(tag)
+        if m:
+            self._locs.append(int(m.group(1)))
+            if len(self._locs) == 4:
+                self._bbox_pending = True
+
+    def _take_bbox(self, text_value: str) -> None:
+        if self._bbox_pending:
+            self.bboxes.append((text_value, [v / 500 for v in self._locs]))
+            self._bbox_pending = False  # consume per atom
+
+    def _collect_inner(self) -> str:
+        # Collapse spaces and non-breaking spaces left by tag splits
+        text = WHITESPACE_PATTERN.sub(" ", "".join(self._inner)).strip()
+        self._inner = []
+        return text
+
+    def _close_block(self) -> None:
+        text = self._collect_inner()
+        if text:
+            if self._state == _HEADER:
+                self.md_lines.append("#" * self._level + " " + text)
+            else:
+                self.md_lines.append(text)
+            self._take_bbox(text)
+        self._state = _TOP
+
+    def _close_cell(self) -> None:
+        text = self._collect_inner()
+        if text:
+            if self._cell_is_header:
+                self._headers.append(text)
+            else:
+                self._current_row.append(text)
+            self._take_bbox(text)
+        self._state = _OTSL
+
+    def _flush_row(self) -> None:
+        if any(cell.strip() for cell in self._current_row):
+            self._rows.append(self._current_row)
+        self._current_row = []
+
+    def _close_table(self) -> None:
+        if self._current_row:
+            self._flush_row()
+        md_lines = self.md_lines
+        md_lines.append("")  # blank line before table
+        headers = self._headers
+        if headers:
+            md_lines.append("| " + " | ".join(headers) + " |")
+            md_lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
+        for i, row in enumerate(self._rows):
+            if i == 1 and not headers:
+                # if no headers, add a separator after first row
+                md_lines.append("| " + " | ".join(["---"] * len(row)) + " |")
+            if row:
+                md_lines.append("| " + " | ".join(row) + " |")
+        self._headers, self._rows, self._current_row = [], [], []
+        self._state = _TOP
+
+    def _token(self, tok: str) -> None:
+        if not tok:
+            return
+        state = self._state
+        is_tag = tok[0] == "<"
+
+        if state == _CELL:
+            if not is_tag:
+                self._inner.append(tok)
+                return
+            # A cell runs up to the next tag, which is then handled as usual
+            self._close_cell()
+            state = _OTSL
+
+        if state == _OTSL:
+            if tok == "</otsl>":
+                self._close_table()
+            elif tok.startswith("<loc_"):
+                self._update_bbox(tok)
+            elif tok == "<ched>" or tok == "<fcel>":
+                self._cell_is_header = tok == "<ched>"
+                self._state = _CELL
+            elif tok == "<nl>":
+                self._flush_row()
+            # skip other tags (including formatting) and stray text
+            return
+
+        if state == _TOP:
+            if tok.startswith("<loc_"):
+                self._update_bbox(tok)
+            elif tok == "<text>":
+                self._state = _TEXT
+            elif tok == "<otsl>":
+                self._state = _OTSL
+            elif is_tag and (m := HEADER_OPEN_PATTERN.fullmatch(tok)):
+                self._level = max(1, min(6, int(m.group(1))))
+                self._state = _HEADER
+            # Ignore other tags and plain text outside known blocks
+            return
+
+        # Inside a heading or paragraph
+        if not is_tag:
+            self._inner.append(tok)
+        elif tok.startswith("<loc_"):
+            self._update_bbox(tok)
+        elif state == _HEADER:
+            if tok.startswith("</section_header_level_"):
+                self._close_block()
+        elif tok == "</text>":
+            self._close_block()
+        # ignore other tags inside the block
+
+
+def doctags_to_markdown_and_bboxes(
+    doctags: str,
+) -> Tuple[str, List[Tuple[str, List[float]]]]:
+    """Convert a complete DocTags string to Markdown and normalized bboxes."""
+    parser = DocTagsParser()
+    parser.feed(doctags)
+    return parser.finish()
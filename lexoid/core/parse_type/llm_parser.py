@@ -1,31 +1,44 @@
 import ast
 import base64
+import hashlib
 import io
+import json
 import mimetypes
 import os
 import re
 import time
+from collections import OrderedDict
+from datetime import datetime, timezone
 from functools import wraps
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import requests
 from lexoid.core.conversion_utils import (
     convert_doc_to_base64_images,
     convert_image_to_pdf,
 )
+from lexoid.core.parse_type.doctags import doctags_to_markdown_and_bboxes
 from lexoid.core.prompt_templates import (
     AUDIO_TO_MARKDOWN_PROMPT,
+    CONTINUATION_PROMPT,
     INSTRUCTIONS_ADD_PG_BREAK,
     LLAMA_PARSER_PROMPT,
     OPENAI_USER_PROMPT,
     PARSER_PROMPT,
 )
+from lexoid.core.replay import create_replay_response, get_replay_api, replay_exchange
+from lexoid.core.response_cache import cache_response
 from lexoid.core.utils import (
     DEFAULT_LLM,
     DEFAULT_LOCAL_LM,
     DEFAULT_MAX_IMAGE_DIMENSION,
+    GEMINI_FILE_CACHE_PATH,
+    LOCAL_MODEL_CACHE_SIZE,
+    MAX_CONTINUATIONS,
     OLLAMA_BASE_URL,
     OLLAMA_TIMEOUT,
+    TOKEN_USAGE_KEYS,
+    estimate_page_max_tokens,
     get_api_provider_for_model,
     get_file_type,
 )
@@ -94,6 +107,12 @@ def parse_llm_doc(path: str, **kwargs) -> Dict:
     if "api_provider" in kwargs:
         if kwargs["api_provider"] == "local":
             return parse_with_local_model(path, **kwargs)
+        elif (
+            kwargs["api_provider"] == "replay"
+            and get_replay_api(kwargs.get("model", DEFAULT_LLM)) == "gemini"
+        ):
+            # Record and replay the whole-split requests that Gemini is sent
+            return parse_with_gemini(path, **kwargs)
         elif kwargs["api_provider"]:
             return parse_with_api(path, api=kwargs["api_provider"], **kwargs)
 
@@ -127,30 +146,44 @@ def build_ollama_prompt(
     return "\n\n".join(prompt_parts)
 
 
+def as_image_list(image_url: Optional[Union[str, List[str]]]) -> List[str]:
+    """Normalize a single image URL or a list of image URLs to a list."""
+    if not image_url:
+        return []
+    if isinstance(image_url, str):
+        return [image_url]
+    return list(image_url)
+
+
 def create_ollama_response(
     model: str,
     prompt: str,
-    image_url: Optional[str] = None,
+    image_url: Optional[Union[str, List[str]]] = None,
     temperature: float = 0.0,
     max_tokens: int = 1024,
+    text_callback: Optional[Callable[[str], None]] = None,
 ) -> Dict:
     import requests
 
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": text_callback is not None,
         "options": {
             "temperature": temperature,
             "num_predict": max_tokens,
         },
     }
     if image_url:
-        payload["images"] = [strip_data_url_prefix(image_url)]
+        payload["images"] = [
+            strip_data_url_prefix(url) for url in as_image_list(image_url)
+        ]
 
     url = f"{OLLAMA_BASE_URL.rstrip('/')}/api/generate"
     try:
-        response = requests.post(url, json=payload, timeout=OLLAMA_TIMEOUT)
+        response = requests.post(
+            url, json=payload, timeout=OLLAMA_TIMEOUT, stream=text_callback is not None
+        )
     except requests.RequestException as exc:
         raise requests.RequestException(
             f"Ollama transport error for model '{model}' at {url}: {exc}"
@@ -167,7 +200,19 @@ def create_ollama_response(
             f"Ollama request failed with status {response.status_code}{detail_suffix}"
         )
 
-    result = response.json()
+    if text_callback is None:
+        result = response.json()
+    else:
+        # Streamed responses are NDJSON; the final line carries the token counts
+        chunks = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            result = json.loads(line)
+            if result.get("response"):
+                text_callback(result["response"])
+                chunks.append(result["response"])
+        result["response"] = "".join(chunks)
     prompt_eval_count = result.get("prompt_eval_count", 0)
     eval_count = result.get("eval_count", 0)
     raw_response = result.get("response", "")
@@ -179,213 +224,116 @@ def create_ollama_response(
             "output_tokens": eval_count,
             "total_tokens": prompt_eval_count + eval_count,
         },
+        "finish_reason": result.get("done_reason"),
     }
 
 
-def doctags_to_markdown_and_bboxes(
-    doctags: str,
-) -> Tuple[str, List[Tuple[str, List[float]]]]:
+def parse_with_local_model(path: str, **kwargs) -> Dict:
+    model_name = kwargs.get("model", DEFAULT_LOCAL_LM)
+    if model_name.lower().startswith("paddlepaddle/paddleocr-vl"):
+        return parse_with_paddleocr_vl(path, **kwargs)
+    return parse_with_docling(path, **kwargs)
+
+
+def warm_up_local_model(
+    model: str = DEFAULT_LOCAL_LM, num_threads: Optional[int] = None, **kwargs
+):
     """
-    # Reference: https://huggingface.co/ibm-granite/granite-docling-258M
-
-    Parse a subset of DocTags/OTSL:
-      - <section_header_level_N>Title</section_header_level_N> -> Markdown #... heading
-      - <text>Paragraph</text> -> Markdown paragraph
-      - <otsl> with <ched>, <fcel>, <nl> -> Markdown table
-    Bboxes: when 4 successive <loc_*> appear before a textual atom, assign that bbox
-    normalized to [0,1] via 500-scale reported by the model.
+    Load a local model into the in-process model cache ahead of parsing.
+
+    `parse()` uses this as the worker initializer for local models, so each worker
+    process loads the model once at start-up instead of once per split, and limits
+    torch to `num_threads` intra-op threads so workers do not oversubscribe cores.
     """
-    # Tokenize into tags and text
-    tokens = re.split(r"(<[^>]+>)", doctags)
-    md_lines: List[str] = []
-    bboxes: List[Tuple[str, List[float]]] = []
-
-    # State for capturing bounding boxes
-    loc_buffer: List[int] = []
-    pending_bbox: List[float] = None
-
-    def update_bbox_from_tag(tag: str):
-        nonlocal loc_buffer, pending_bbox
-        m = re.fullmatch(r"<loc_(\d+)>", tag)
-        if m:
-            loc_buffer.append(int(m.group(1)))
-            if len(loc_buffer) >= 4:
-                vals = loc_buffer[-4:]
-                pending_bbox = [
-                    vals[0] / 500,
-                    vals[1] / 500,
-                    vals[2] / 500,
-                    vals[3] / 500,
-                ]
-
-    def take_bbox_for(text_value: str):
-        nonlocal pending_bbox
-        if text_value and pending_bbox is not None:
-            bboxes.append((text_value, pending_bbox))
-            pending_bbox = None  # consume per atom
-
-    def finalize_text(s: str) -> str:
-        # Collapse spaces and non-breaking spaces left by tag splits
-        return re.sub(r"\s+", " ", s).strip()
-
-    i = 0
-    L = len(tokens)
-    while i < L:
-        tok = tokens[i]
-
-        # Track loc tags regardless of context
-        if tok.startswith("<loc_"):
-            update_bbox_from_tag(tok)
-            i += 1
-            continue
+    if model.lower().startswith("paddlepaddle/paddleocr-vl"):
+        _get_paddleocr_vl_pipeline(get_paddleocr_vl_pipeline_kwargs(model, **kwargs))
+        return
 
-        # Section headers
-        m_hdr_open = re.fullmatch(r"<section_header_level_(\d+)>", tok)
-        if m_hdr_open:
-            level = max(1, min(6, int(m_hdr_open.group(1))))
-            # accumulate inner text until closing tag
-            j = i + 1
-            inner = []
-            while j < L:
-                if tokens[j].startswith("</section_header_level_"):
-                    break
-                if tokens[j].startswith("<"):
-                    # allow loc tags inside
-                    if tokens[j].startswith("<loc_"):
-                        update_bbox_from_tag(tokens[j])
-                else:
-                    inner.append(tokens[j])
-                j += 1
-            title = finalize_text("".join(inner))
-            if title:
-                md_lines.append(("#" * level) + " " + title)
-                take_bbox_for(title)
-            i = j + 1
-            continue
+    import torch
 
-        # Paragraph text
-        if tok == "<text>":
-            j = i + 1
-            inner = []
-            while j < L and tokens[j] != "</text>":
-                if tokens[j].startswith("<"):
-                    if tokens[j].startswith("<loc_"):
-                        update_bbox_from_tag(tokens[j])
-                    # ignore other tags inside <text> block
-                else:
-                    inner.append(tokens[j])
-                j += 1
-            paragraph = finalize_text("".join(inner))
-            if paragraph:
-                md_lines.append(paragraph)
-                take_bbox_for(paragraph)
-            i = j + 1
-            continue
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    _get_docling_model(
+        model, get_local_device(), cpu_quantization=kwargs.get("cpu_quantization")
+    )
 
-        # OTSL table
-        if tok == "<otsl>":
-            j = i + 1
-            headers: List[str] = []
-            rows: List[List[str]] = []
-            current_row: List[str] = []
-
-            def flush_row():
-                nonlocal current_row, rows
-                if any(cell.strip() for cell in current_row):
-                    rows.append(current_row)
-                current_row = []
-
-            while j < L and tokens[j] != "</otsl>":
-                t = tokens[j]
-
-                if t.startswith("<loc_"):
-                    update_bbox_from_tag(t)
-                    j += 1
-                    continue
-
-                if t == "<ched>":
-                    # header cell up to next tag
-                    k = j + 1
-                    cell = []
-                    while k < L and not tokens[k].startswith("<"):
-                        cell.append(tokens[k])
-                        k += 1
-                    text_cell = finalize_text("".join(cell))
-                    if text_cell:
-                        headers.append(text_cell)
-                        take_bbox_for(text_cell)
-                    j = k
-                    continue
-
-                if t == "<fcel>":
-                    k = j + 1
-                    cell = []
-                    while k < L and not tokens[k].startswith("<"):
-                        cell.append(tokens[k])
-                        k += 1
-                    text_cell = finalize_text("".join(cell))
-                    if text_cell:
-                        current_row.append(text_cell)
-                        take_bbox_for(text_cell)
-                    j = k
-                    continue
-
-                if t == "<nl>":
-                    flush_row()
-                    j += 1
-                    continue
-
-                # skip other tags (including formatting)
-                j += 1
-
-            # flush any trailing row
-            if current_row:
-                flush_row()
-
-            md_lines.append("")  # blank line before table
-
-            # Render Markdown table
-            if headers:
-                md_lines.append("| " + " | ".join(headers) + " |")
-                md_lines.append("| " + " | ".join(["---"] * len(headers)) + " |")
-            for i, r in enumerate(rows):
-                if i == 1 and not headers:
-                    # if no headers, add a separator after first row
-                    md_lines.append("| " + " | ".join(["---"] * len(r)) + " |")
-                if r:
-                    md_lines.append("| " + " | ".join(r) + " |")
-
-            i = j + 1
-            continue
 
-        # Ignore other tags and plain text outside known blocks
-        i += 1
+def get_local_device() -> str:
+    import torch
 
-    markdown = "\n".join([ln for ln in md_lines])
-    return markdown, bboxes
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
 
-def parse_with_local_model(path: str, **kwargs) -> Dict:
-    model_name = kwargs.get("model", DEFAULT_LOCAL_LM)
-    if model_name.lower().startswith("paddlepaddle/paddleocr-vl"):
-        return parse_with_paddleocr_vl(path, **kwargs)
-    return parse_with_docling(path, **kwargs)
+def _evict_local_models(cache: OrderedDict) -> bool:
+    """Drop least recently used entries beyond LOCAL_MODEL_CACHE_SIZE."""
+    evicted = False
+    while len(cache) > LOCAL_MODEL_CACHE_SIZE:
+        evicted_key, _ = cache.popitem(last=False)
+        logger.debug(f"Evicted local model {evicted_key} from the model cache")
+        evicted = True
+    return evicted
 
 
-def parse_with_docling(path: str, **kwargs) -> Dict:
-    # Source: https://huggingface.co/ibm-granite/granite-docling-258M
+# (processor, model) pairs keyed by (model, device, dtype, quantization), least
+# recently used first. At most LOCAL_MODEL_CACHE_SIZE models stay loaded.
+_DOCLING_MODEL_CACHE: OrderedDict = OrderedDict()
+# Chat-templated prompts keyed by (model, instruction)
+_DOCLING_PROMPT_CACHE: Dict[Tuple[str, str], str] = {}
+CPU_QUANTIZATION_MODES = ("int8", "bf16")
+
+
+def _get_docling_model(
+    model_name: str, device: str, cpu_quantization: Optional[str] = None
+) -> Tuple:
     import torch
-    from PIL import Image
     from transformers import AutoModelForVision2Seq, AutoProcessor
 
-    model_name = kwargs.get("model", DEFAULT_LOCAL_LM)
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if cpu_quantization not in (None, *CPU_QUANTIZATION_MODES):
+        raise ValueError(
+            f"Unsupported cpu_quantization: {cpu_quantization}. "
+            f"Supported values: {CPU_QUANTIZATION_MODES}"
+        )
+    if device != "cpu":
+        cpu_quantization = None
+
+    torch_dtype = (
+        torch.bfloat16
+        if device == "cuda" or cpu_quantization == "bf16"
+        else torch.float32
+    )
+    cache_key = (model_name, device, str(torch_dtype), cpu_quantization)
+    if cache_key in _DOCLING_MODEL_CACHE:
+        _DOCLING_MODEL_CACHE.move_to_end(cache_key)
+        return _DOCLING_MODEL_CACHE[cache_key]
 
     processor = AutoProcessor.from_pretrained(model_name)
     model = AutoModelForVision2Seq.from_pretrained(
         model_name,
-        torch_dtype=torch.bfloat16 if device == "cuda" else torch.float32,
+        torch_dtype=torch_dtype,
     ).to(device)
+    if cpu_quantization == "int8":
+        # Dynamic quantization: int8 weights for the linear layers, activations
+        # quantized on the fly. Only available on CPU.
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    model.eval()
+    _DOCLING_MODEL_CACHE[cache_key] = (processor, model)
+    if _evict_local_models(_DOCLING_MODEL_CACHE) and device == "cuda":
+        torch.cuda.empty_cache()
+    return processor, model
+
+
+def parse_with_docling(path: str, **kwargs) -> Dict:
+    # Source: https://huggingface.co/ibm-granite/granite-docling-258M
+    import torch
+    from PIL import Image
+
+    model_name = kwargs.get("model", DEFAULT_LOCAL_LM)
+    device = get_local_device()
+    processor, model = _get_docling_model(
+        model_name, device, cpu_quantization=kwargs.get("cpu_quantization")
+    )
 
     max_dimension = kwargs.get("max_image_dimension", DEFAULT_MAX_IMAGE_DIMENSION)
     images = convert_doc_to_base64_images(path, max_dimension=max_dimension)
@@ -420,17 +368,35 @@ def parse_with_docling(path: str, **kwargs) -> Dict:
 
     start_page = kwargs.get("start", 0)
 
-    # Run per page for clean segments
-    for idx, img in enumerate(proc_images):
-        # Build messages and prompt mirroring the Space
+    # Build messages and prompt mirroring the Space
+    prompt_key = (model_name, instruction)
+    if prompt_key not in _DOCLING_PROMPT_CACHE:
         messages = [
             {
                 "role": "user",
                 "content": [{"type": "image"}, {"type": "text", "text": instruction}],
             }
         ]
-        prompt = processor.apply_chat_template(messages, add_generation_prompt=True)
-        inputs = processor(text=prompt, images=[[img]], return_tensors="pt").to(device)
+        _DOCLING_PROMPT_CACHE[prompt_key] = processor.apply_chat_template(
+            messages, add_generation_prompt=True
+        )
+    prompt = _DOCLING_PROMPT_CACHE[prompt_key]
+    pad_token = processor.tokenizer.pad_token
+
+    batch_size = max(1, kwargs.get("docling_batch_size", 1))
+    doctag_outputs = []
+    for batch_start in range(0, len(proc_images), batch_size):
+        batch_images = proc_images[batch_start : batch_start + batch_size]
+        # Pages in a batch get different numbers of image tokens, so prompts are
+        # left-padded to end at the same position and generation starts right
+        # after. Passed per call to leave the cached processor's tokenizer as is.
+        inputs = processor(
+            text=[prompt] * len(batch_images),
+            images=[[img] for img in batch_images],
+            padding=len(batch_images) > 1,
+            padding_side="left",
+            return_tensors="pt",
+        ).to(device)
         with torch.no_grad():
             generated_ids = model.generate(
                 **inputs,
@@ -441,8 +407,16 @@ def parse_with_docling(path: str, **kwargs) -> Dict:
             )
         prompt_len = inputs.input_ids.shape[1]
         trimmed = generated_ids[:, prompt_len:]
-        doctag_output = processor.batch_decode(trimmed, skip_special_tokens=False)[0]
-        doctag_output = doctag_output.replace("<end_of_utterance>", "").strip()
+        doctag_outputs.extend(
+            processor.batch_decode(trimmed, skip_special_tokens=False)
+        )
+
+    for idx, doctag_output in enumerate(doctag_outputs):
+        doctag_output = doctag_output.replace("<end_of_utterance>", "")
+        if pad_token and batch_size > 1:
+            # Pages that finish early are padded up to the longest in the batch
+            doctag_output = doctag_output.replace(pad_token, "")
+        doctag_output = doctag_output.strip()
 
         # DocTags cleanup and chart remapping
         if "<chart>" in doctag_output:
@@ -474,7 +448,7 @@ def parse_with_docling(path: str, **kwargs) -> Dict:
     }
 
 
-_PADDLEOCR_VL_PIPELINE_CACHE: Dict[Tuple, object] = {}
+_PADDLEOCR_VL_PIPELINE_CACHE: OrderedDict = OrderedDict()
 
 
 def _get_paddleocr_vl_pipeline(pipeline_kwargs: Dict):
@@ -487,7 +461,9 @@ def _get_paddleocr_vl_pipeline(pipeline_kwargs: Dict):
         ) from e
 
     cache_key = tuple(sorted(pipeline_kwargs.items()))
-    if cache_key not in _PADDLEOCR_VL_PIPELINE_CACHE:
+    if cache_key in _PADDLEOCR_VL_PIPELINE_CACHE:
+        _PADDLEOCR_VL_PIPELINE_CACHE.move_to_end(cache_key)
+    else:
         try:
             _PADDLEOCR_VL_PIPELINE_CACHE[cache_key] = PaddleOCRVL(**pipeline_kwargs)
         except RuntimeError as e:
@@ -497,21 +473,27 @@ def _get_paddleocr_vl_pipeline(pipeline_kwargs: Dict):
                 "pip install -U 'paddleocr[doc-parser]'. "
                 "See https://paddlepaddle.github.io/PaddleOCR/main/version3.x/pipeline_usage/PaddleOCR-VL.html"
             ) from e
+        _evict_local_models(_PADDLEOCR_VL_PIPELINE_CACHE)
     return _PADDLEOCR_VL_PIPELINE_CACHE[cache_key]
 
 
-def parse_with_paddleocr_vl(path: str, **kwargs) -> Dict:
-    # Source: https://huggingface.co/PaddlePaddle/PaddleOCR-VL
-    model_name = kwargs.get("model", "")
+def get_paddleocr_vl_pipeline_kwargs(model_name: str, **kwargs) -> Dict:
     default_pipeline_version = (
         "v1.5" if model_name.lower().endswith("paddleocr-vl-1.5") else "v1"
     )
-    pipeline_kwargs = {
+    return {
         "pipeline_version": kwargs.get("pipeline_version", default_pipeline_version),
         "use_doc_orientation_classify": False,
         "use_doc_unwarping": False,
     }
-    pipeline = _get_paddleocr_vl_pipeline(pipeline_kwargs)
+
+
+def parse_with_paddleocr_vl(path: str, **kwargs) -> Dict:
+    # Source: https://huggingface.co/PaddlePaddle/PaddleOCR-VL
+    model_name = kwargs.get("model", "")
+    pipeline = _get_paddleocr_vl_pipeline(
+        get_paddleocr_vl_pipeline_kwargs(model_name, **kwargs)
+    )
 
     results = pipeline.predict(path)
 
@@ -543,6 +525,95 @@ def parse_with_paddleocr_vl(path: str, **kwargs) -> Dict:
     }
 
 
+# Files uploaded through the Gemini Files API, keyed by content hash. Mirrors the
+# JSON file at GEMINI_FILE_CACHE_PATH so handles are shared across processes/runs.
+_GEMINI_FILE_CACHE: Dict[str, Dict] = {}
+# Re-upload files that expire within this many seconds
+GEMINI_FILE_EXPIRY_MARGIN = 3600
+
+
+def _load_gemini_file_cache() -> Dict[str, Dict]:
+    if os.path.exists(GEMINI_FILE_CACHE_PATH):
+        try:
+            with open(GEMINI_FILE_CACHE_PATH, "r") as f:
+                _GEMINI_FILE_CACHE.update(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable Gemini file cache: {e}")
+    now = datetime.now(timezone.utc).timestamp()
+    for key in list(_GEMINI_FILE_CACHE):
+        if _GEMINI_FILE_CACHE[key]["expires_at"] - now < GEMINI_FILE_EXPIRY_MARGIN:
+            del _GEMINI_FILE_CACHE[key]
+    return _GEMINI_FILE_CACHE
+
+
+def _save_gemini_file_cache():
+    os.makedirs(os.path.dirname(GEMINI_FILE_CACHE_PATH) or ".", exist_ok=True)
+    tmp_path = f"{GEMINI_FILE_CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_GEMINI_FILE_CACHE, f, indent=2)
+    os.replace(tmp_path, GEMINI_FILE_CACHE_PATH)
+
+
+def upload_gemini_file(
+    path: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    content: Optional[bytes] = None,
+) -> Dict:
+    """
+    Upload a file (or in-memory content) through the Gemini Files API.
+
+    Uploads are cached by content hash and API key until shortly before they expire,
+    so the same document is only uploaded once across splits, retries and runs.
+
+    Returns:
+        Dict: The file handle with "name", "uri", "mime_type" and "expires_at".
+    """
+    from google import genai
+    from google.genai import types
+
+    if content is None:
+        with open(path, "rb") as f:
+            content = f.read()
+    mime_type = (
+        mime_type
+        or (path and mimetypes.guess_type(path)[0])
+        or "application/octet-stream"
+    )
+    api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY", "")
+    cache_key = ":".join(
+        [
+            hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12],
+            hashlib.sha256(content).hexdigest(),
+            mime_type,
+        ]
+    )
+
+    cache = _load_gemini_file_cache()
+    if cache_key in cache:
+        return cache[cache_key]
+
+    client = genai.Client()
+    uploaded = client.files.upload(
+        file=io.BytesIO(content), config=types.UploadFileConfig(mime_type=mime_type)
+    )
+    while uploaded.state and uploaded.state.name == "PROCESSING":
+        time.sleep(1)
+        uploaded = client.files.get(name=uploaded.name)
+    if uploaded.state and uploaded.state.name == "FAILED":
+        raise HTTPError(f"Gemini file upload failed: {uploaded.error}")
+
+    handle = {
+        "name": uploaded.name,
+        "uri": uploaded.uri,
+        "mime_type": uploaded.mime_type or mime_type,
+        "expires_at": uploaded.expiration_time.timestamp(),
+    }
+    cache[cache_key] = handle
+    _save_gemini_file_cache()
+    logger.debug(f"Uploaded {path or 'document'} to Gemini as {uploaded.name}")
+    return handle
+
+
 def parse_with_gemini(path: str, **kwargs) -> List[Dict] | str:
     # Check if the file is an image and convert to PDF if necessary
     mime_type, _ = mimetypes.guess_type(path)
@@ -550,6 +621,20 @@ def parse_with_gemini(path: str, **kwargs) -> List[Dict] | str:
     if mime_type and mime_type.startswith("audio"):
         return parse_audio_with_gemini(path, **kwargs)
 
+    if kwargs.get("use_file_api"):
+        if mime_type and mime_type.startswith("image"):
+            handle = upload_gemini_file(
+                path, mime_type="application/pdf", content=convert_image_to_pdf(path)
+            )
+        else:
+            handle = upload_gemini_file(path, mime_type=mime_type)
+        return parse_image_with_gemini(
+            base64_file=None,
+            mime_type=handle["mime_type"],
+            file_uri=handle["uri"],
+            **kwargs,
+        )
+
     if mime_type and mime_type.startswith("image"):
         pdf_content = convert_image_to_pdf(path)
         mime_type = "application/pdf"
@@ -564,30 +649,113 @@ def parse_with_gemini(path: str, **kwargs) -> List[Dict] | str:
     )
 
 
-def parse_image_with_gemini(
-    base64_file: Optional[str], mime_type: str = "image/png", **kwargs
-) -> Dict:
+def get_page_break_instruction(n_pages: int) -> str:
+    """Prompt instruction asking the model to separate multiple pages with `<page-break>`."""
+    if n_pages == 1:
+        return ""
+    return f"- Total number of pages: {n_pages}. {INSTRUCTIONS_ADD_PG_BREAK}"
+
+
+def get_gemini_text(result: Dict) -> str:
+    return "".join(
+        part["text"]
+        for candidate in result.get("candidates", [])
+        for part in candidate.get("content", {}).get("parts", [])
+        if "text" in part
+    )
+
 
+def send_gemini_request(
+    model: str, payload: Dict, text_callback: Optional[Callable[[str], None]] = None
+) -> Tuple[Dict, str]:
+    """
+    Sends a generateContent request to the Gemini API, streaming the response
+    to `text_callback` if given.
+
+    Returns:
+        Tuple[Dict, str]: The response JSON (the last event when streaming),
+            which carries the token usage, and the response text.
+    """
     api_key = os.environ.get("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY environment variable is not set")
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{kwargs['model']}:generateContent?key={api_key}"
+    if text_callback is None:
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    else:
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
+
+    headers = {"Content-Type": "application/json"}
+    try:
+        response = requests.post(
+            url,
+            json=payload,
+            headers=headers,
+            timeout=120,
+            stream=text_callback is not None,
+        )
+        response.raise_for_status()
+    except requests.Timeout as e:
+        raise HTTPError(f"Timeout error occurred: {e}")
+
+    if text_callback is None:
+        result = response.json()
+        return result, get_gemini_text(result)
+
+    # Server-sent events; every chunk carries the usage so far
+    chunks = []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        result = json.loads(line[len("data:") :])
+        delta = get_gemini_text(result)
+        if delta:
+            text_callback(delta)
+            chunks.append(delta)
+    return result, "".join(chunks)
+
+
+@cache_response(
+    "token_usage",
+    [
+        "base64_file",
+        "mime_type",
+        "file_uri",
+        "model",
+        "temperature",
+        "max_tokens",
+        "system_prompt",
+        "pages_per_split_",
+        "start",
+        "response_schema",
+    ],
+)
+def parse_image_with_gemini(
+    base64_file: Optional[Union[str, List[str]]], mime_type: str = "image/png", **kwargs
+) -> Dict:
+    text_callback = kwargs.get("text_callback")
+    page_stream = None
+    if text_callback is None and kwargs.get("stream_callback"):
+        page_stream = OutputStreamParser(
+            kwargs["stream_callback"], first_page=kwargs.get("start", 0) + 1
+        )
+        text_callback = page_stream.feed
 
     if "system_prompt" in kwargs:
         prompt = kwargs["system_prompt"]
     else:
         # Ideally, we do this ourselves. But, for now this might be a good enough.
-        custom_instruction = f"""- Total number of pages: {kwargs["pages_per_split_"]}. {INSTRUCTIONS_ADD_PG_BREAK}"""
-        if kwargs["pages_per_split_"] == 1:
-            custom_instruction = ""
+        custom_instruction = get_page_break_instruction(kwargs["pages_per_split_"])
         prompt = PARSER_PROMPT.format(custom_instructions=custom_instruction)
 
     generation_config = {
         "temperature": kwargs.get("temperature", 0),
     }
+    if kwargs.get("response_schema"):
+        generation_config["responseMimeType"] = "application/json"
+        generation_config["responseJsonSchema"] = kwargs["response_schema"]
     parts = [{"text": prompt}]
-    if base64_file:
+    if base64_file or kwargs.get("file_uri"):
         if kwargs["model"] == "gemini-2.5-pro":
             generation_config["thinkingConfig"] = {"thinkingBudget": 128}
         elif kwargs["model"].startswith("gemini-2.5-flash"):
@@ -598,7 +766,13 @@ def parse_image_with_gemini(
             else:
                 generation_config["thinkingConfig"] = {"thinkingLevel": "low"}
 
-        parts.append({"inline_data": {"mime_type": mime_type, "data": base64_file}})
+        base64_files = [base64_file] if isinstance(base64_file, str) else base64_file
+        for data in base64_files or []:
+            parts.append({"inline_data": {"mime_type": mime_type, "data": data}})
+        if kwargs.get("file_uri"):
+            parts.append(
+                {"file_data": {"mime_type": mime_type, "file_uri": kwargs["file_uri"]}}
+            )
     payload = {
         "contents": [
             {
@@ -608,22 +782,32 @@ def parse_image_with_gemini(
         "generationConfig": generation_config,
     }
 
-    headers = {"Content-Type": "application/json"}
-    try:
-        response = requests.post(url, json=payload, headers=headers, timeout=120)
-        response.raise_for_status()
-    except requests.Timeout as e:
-        raise HTTPError(f"Timeout error occurred: {e}")
-
-    result = response.json()
-
-    raw_text = "".join(
-        part["text"]
-        for candidate in result.get("candidates", [])
-        for part in candidate.get("content", {}).get("parts", [])
-        if "text" in part
-    )
+    if kwargs.get("api_provider") == "replay":
+        # The whole request is recorded, and replayed text is delivered at once
+        request = {
+            "model": kwargs["model"],
+            "base64_file": base64_file,
+            "mime_type": mime_type,
+            "file_uri": kwargs.get("file_uri"),
+            "prompt": prompt,
+            "generation_config": generation_config,
+        }
+        result = replay_exchange(
+            "gemini",
+            request,
+            lambda: send_gemini_request(kwargs["model"], payload)[0],
+        )
+        raw_text = get_gemini_text(result)
+        if text_callback and raw_text:
+            text_callback(raw_text)
+    else:
+        result, raw_text = send_gemini_request(kwargs["model"], payload, text_callback)
+    if page_stream:
+        page_stream.finish()
 
+    metadata = {}
+    if "<output>" not in raw_text and "</output>" not in raw_text:
+        metadata["missing_output_tag"] = True
     combined_text = raw_text
     if "<output>" in raw_text:
         combined_text = raw_text.split("<output>")[-1].strip()
@@ -633,11 +817,15 @@ def parse_image_with_gemini(
     token_usage = result["usageMetadata"]
     input_tokens = token_usage.get("promptTokenCount", 0)
     output_tokens = token_usage.get("candidatesTokenCount", 0)
+    cached_input_tokens = token_usage.get("cachedContentTokenCount", 0)
     total_tokens = input_tokens + output_tokens
     return {
         "raw": combined_text.replace("<page-break>", "\n\n"),
         "segments": [
-            {"metadata": {"page": kwargs.get("start", 0) + page_no}, "content": page}
+            {
+                "metadata": {"page": kwargs.get("start", 0) + page_no, **metadata},
+                "content": page,
+            }
             for page_no, page in enumerate(combined_text.split("<page-break>"), start=1)
         ],
         "title": kwargs.get("title", ""),
@@ -648,12 +836,19 @@ def parse_image_with_gemini(
             "input": input_tokens,
             "output": output_tokens,
             "total": total_tokens,
+            "cached_input": cached_input_tokens,
+            "cache_creation_input": 0,
         },
+        "finish_reason": next(
+            (c.get("finishReason") for c in result.get("candidates", [])), None
+        ),
     }
 
 
 def get_messages(
-    system_prompt: Optional[str], user_prompt: Optional[str], image_url: Optional[str]
+    system_prompt: Optional[str],
+    user_prompt: Optional[str],
+    image_url: Optional[Union[str, List[str]]],
 ) -> List[Dict]:
     messages = []
     if system_prompt:
@@ -670,16 +865,13 @@ def get_messages(
         if user_prompt
         else []
     )
-    image_message = (
-        [
-            {
-                "type": "image_url",
-                "image_url": {"url": image_url},
-            }
-        ]
-        if image_url
-        else []
-    )
+    image_message = [
+        {
+            "type": "image_url",
+            "image_url": {"url": url},
+        }
+        for url in as_image_list(image_url)
+    ]
 
     messages.append(
         {
@@ -691,15 +883,217 @@ def get_messages(
     return messages
 
 
-def create_response(
+def get_anthropic_request_params(
+    model: str,
+    system_prompt: Optional[str],
+    user_prompt: Optional[str],
+    image_url: Optional[Union[str, List[str]]],
+    temperature: float = 0.0,
+    max_tokens: int = 1024,
+    prompt_caching: bool = False,
+    response_schema: Optional[Dict] = None,
+) -> Dict:
+    """Build the `messages.create` parameters for an Anthropic request."""
+    content = [
+        {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": url.split(";")[0].split(":")[1],
+                "data": url.split(",")[1],
+            },
+        }
+        for url in as_image_list(image_url)
+    ]
+    text_block = {"type": "text", "text": user_prompt}
+    if prompt_caching:
+        # Cache breakpoint after the instructions, which are identical for
+        # every page; the page images come after the cached prefix.
+        text_block["cache_control"] = {"type": "ephemeral"}
+        content.insert(0, text_block)
+    else:
+        content.append(text_block)
+    request_params = {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens,
+    }
+    if system_prompt:
+        request_params["system"] = system_prompt
+        if prompt_caching:
+            request_params["system"] = [
+                {
+                    "type": "text",
+                    "text": system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ]
+    if response_schema:
+        # Structured output through a tool the model is forced to call
+        request_params["tools"] = [
+            {
+                "name": ANTHROPIC_SCHEMA_TOOL,
+                "description": "Record the extracted data.",
+                "input_schema": response_schema,
+            }
+        ]
+        request_params["tool_choice"] = {"type": "tool", "name": ANTHROPIC_SCHEMA_TOOL}
+    # Opus 4.7+ deprecated `temperature`
+    if not re.match(r"claude-opus-4-[78]$", model):
+        request_params["temperature"] = temperature
+    return request_params
+
+
+def get_anthropic_text(response) -> str:
+    """Text of an Anthropic message, or the JSON input of its forced tool call."""
+    for block in response.content:
+        if block.type == "tool_use":
+            return json.dumps(block.input)
+    return "".join(block.text for block in response.content if block.type == "text")
+
+
+def get_anthropic_usage(usage) -> Dict:
+    """Convert an Anthropic `Usage` object to the `create_response` usage dict."""
+    cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+    cache_creation = getattr(usage, "cache_creation_input_tokens", None) or 0
+    # Anthropic reports cached tokens separately from `input_tokens`
+    input_tokens = usage.input_tokens + cache_read + cache_creation
+    return {
+        "input_tokens": input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": input_tokens + usage.output_tokens,
+        "cached_input_tokens": cache_read,
+        "cache_creation_input_tokens": cache_creation,
+    }
+
+
+def get_openai_request_params(
+    api: str,
+    model: str,
+    system_prompt: Optional[str],
+    user_prompt: Optional[str],
+    image_url: Optional[Union[str, List[str]]],
+    prompt_caching: bool = False,
+    response_schema: Optional[Dict] = None,
+) -> Dict:
+    """Build the `chat.completions.create` parameters for OpenAI-compatible APIs."""
+    # Common completion parameters
+    completion_params = {
+        "model": model,
+        "messages": get_messages(system_prompt, user_prompt, image_url),
+    }
+    if prompt_caching and api == "openai":
+        # OpenAI caches prompt prefixes automatically; a stable cache key routes
+        # requests sharing the same instructions to the same cache.
+        prompt_hash = hashlib.sha256(
+            f"{system_prompt}\n{user_prompt}".encode("utf-8")
+        ).hexdigest()
+        completion_params["prompt_cache_key"] = f"lexoid-{prompt_hash[:32]}"
+    if response_schema and api in STRUCTURED_OUTPUT_OPENAI_APIS:
+        completion_params["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "extracted_data", "schema": response_schema},
+        }
+    return completion_params
+
+
+def get_openai_usage(usage) -> Dict:
+    """Convert an OpenAI `CompletionUsage` object to the `create_response` usage dict."""
+    prompt_details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "input_tokens": getattr(usage, "prompt_tokens", 0),
+        "output_tokens": getattr(usage, "completion_tokens", 0),
+        "total_tokens": getattr(usage, "total_tokens", 0),
+        "cached_input_tokens": getattr(prompt_details, "cached_tokens", None) or 0,
+    }
+
+
+def create_single_response(
     api: str,
     model: str,
     system_prompt: Optional[str] = None,
     user_prompt: Optional[str] = None,
-    image_url: Optional[str] = None,
+    image_url: Optional[Union[str, List[str]]] = None,
     temperature: float = 0.0,
     max_tokens: int = 1024,
+    prompt_caching: bool = False,
+    text_callback: Optional[Callable[[str], None]] = None,
+    response_schema: Optional[Dict] = None,
 ) -> Dict:
+    """
+    Send a single request to an LLM API and return its text response with token usage.
+
+    If `text_callback` is given, the response is streamed and the callback is called
+    with each text delta as it arrives (OpenAI-compatible APIs, Anthropic, Gemini and
+    Ollama). Other APIs call it once with the complete response. The returned dict is
+    the same in both cases.
+
+    When `prompt_caching` is set, the prompt is laid out with a stable prefix
+    (instructions before images) and provider-side caching is requested where it is
+    opt-in (Anthropic `cache_control` breakpoints, OpenAI `prompt_cache_key`).
+    Cached prompt tokens are reported in `usage["cached_input_tokens"]` and cache
+    writes in `usage["cache_creation_input_tokens"]`; both are included in
+    `usage["input_tokens"]`.
+
+    When `response_schema` (a JSON Schema object) is given, the response is
+    constrained to it with the provider's structured output: `response_format`
+    for OpenAI, OpenRouter and Fireworks, `responseJsonSchema` for Gemini and a
+    forced tool call for Anthropic, whose tool input is returned as the JSON
+    response. Other APIs rely on the prompt alone.
+
+    The "replay" API serves responses recorded from the real provider, for offline
+    runs (see `lexoid.core.replay`).
+    """
+    if api == "replay":
+        return create_replay_response(
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            image_url=image_url,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_caching=prompt_caching,
+            text_callback=text_callback,
+            response_schema=response_schema,
+        )
+
+    if api == "gemini":
+        if image_url:
+            image_url = [strip_data_url_prefix(url) for url in as_image_list(image_url)]
+        # Gemini requests carry the instructions as a single text part
+        prompt = "\n\n".join(p for p in (system_prompt, user_prompt) if p)
+        response = parse_image_with_gemini(
+            base64_file=image_url,
+            model=model,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            system_prompt=prompt,
+            text_callback=text_callback,
+            response_schema=response_schema,
+        )
+        token_usage = response["token_usage"]
+        return {
+            "response": response["raw"],
+            "usage": {
+                "input_tokens": token_usage["input"],
+                "output_tokens": token_usage["output"],
+                "total_tokens": token_usage["total"],
+                "cached_input_tokens": token_usage["cached_input"],
+            },
+            "finish_reason": response["finish_reason"],
+        }
+
+    if api == "ollama":
+        _instructions = build_ollama_prompt(system_prompt, user_prompt)
+        return create_ollama_response(
+            model=model,
+            prompt=_instructions,
+            image_url=image_url,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            text_callback=text_callback,
+        )
+
     from anthropic import Anthropic
     from huggingface_hub import InferenceClient
     from mistralai import Mistral
@@ -730,49 +1124,27 @@ def create_response(
         "anthropic": lambda: Anthropic(
             api_key=os.environ["ANTHROPIC_API_KEY"],
         ),
-        "gemini": lambda: None,  # Gemini is handled separately
-        "ollama": lambda: None,
     }
     assert api in clients, f"Unsupported API: {api}"
 
-    if api == "gemini":
-        if image_url:
-            image_url = strip_data_url_prefix(image_url)
-        response = parse_image_with_gemini(
-            base64_file=image_url,
-            model=model,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            system_prompt=system_prompt,
-        )
-        return {
-            "response": response["raw"],
-            "usage": response["token_usage"],
-        }
-
-    if api == "ollama":
-        _instructions = build_ollama_prompt(system_prompt, user_prompt)
-        return create_ollama_response(
-            model=model,
-            prompt=_instructions,
-            image_url=image_url,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
-
     client = clients[api]()
 
     if api == "mistral":
         if "ocr" not in model:
             raise ValueError("Only OCR models are currently supported for Mistral")
+        images = as_image_list(image_url)
+        if len(images) > 1:
+            raise ValueError("Mistral OCR accepts a single image per request")
         response = client.ocr.process(
             model=model,
             document={
                 "type": "image_url",
-                "image_url": image_url,
+                "image_url": images[0] if images else None,
             },
             include_image_base64=True,
         )
+        if text_callback:
+            text_callback(response.pages[0].markdown)
         return {
             "response": response.pages[0].markdown,
             "usage": {
@@ -780,70 +1152,463 @@ def create_response(
                 "output_tokens": 0,
                 "total_tokens": 0,  # Mistral does not provide token usage
             },
+            "finish_reason": "stop",
         }
 
     if api == "anthropic":
-        content = [{"type": "text", "text": user_prompt}]
-        if image_url:
-            image_media_type = image_url.split(";")[0].split(":")[1]
-            image_data = image_url.split(",")[1]
-            content.insert(
-                0,
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": image_media_type,
-                        "data": image_data,
-                    },
-                },
-            )
-        request_params = {
-            "model": model,
-            "messages": [{"role": "user", "content": content}],
-            "max_tokens": max_tokens,
+        request_params = get_anthropic_request_params(
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=user_prompt,
+            image_url=image_url,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_caching=prompt_caching,
+            response_schema=response_schema,
+        )
+        if text_callback is None:
+            response = client.messages.create(**request_params)
+        else:
+            with client.messages.stream(**request_params) as stream:
+                for delta in stream.text_stream:
+                    text_callback(delta)
+                response = stream.get_final_message()
+            if response_schema:
+                # Tool input is not part of the text stream
+                text_callback(get_anthropic_text(response))
+        return {
+            "response": get_anthropic_text(response),
+            "usage": get_anthropic_usage(response.usage),
+            "finish_reason": response.stop_reason,
         }
-        # Opus 4.7+ deprecated `temperature`
-        if not re.match(r"claude-opus-4-[78]$", model):
-            request_params["temperature"] = temperature
-        response = client.messages.create(**request_params)
 
+    completion_params = get_openai_request_params(
+        api=api,
+        model=model,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        image_url=image_url,
+        prompt_caching=prompt_caching,
+        response_schema=response_schema,
+    )
+    if text_callback and api in STREAMING_OPENAI_APIS:
+        completion_params["stream"] = True
+        completion_params["stream_options"] = {"include_usage": True}
+        chunks, usage, finish_reason = [], None, None
+        for chunk in client.chat.completions.create(**completion_params):
+            if chunk.choices and chunk.choices[0].delta.content:
+                text_callback(chunk.choices[0].delta.content)
+                chunks.append(chunk.choices[0].delta.content)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.usage:
+                usage = chunk.usage
         return {
-            "response": response.content[0].text,
-            "usage": {
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens,
-                "total_tokens": response.usage.input_tokens
-                + response.usage.output_tokens,
-            },
+            "response": "".join(chunks),
+            "usage": get_openai_usage(usage),
+            "finish_reason": finish_reason,
         }
 
-    # Prepare messages for the API call
-    messages = get_messages(system_prompt, user_prompt, image_url)
+    # Get completion from selected API
+    response = client.chat.completions.create(**completion_params)
+    if text_callback:
+        text_callback(response.choices[0].message.content)
 
-    # Common completion parameters
-    completion_params = {
-        "model": model,
-        "messages": messages,
+    return {
+        "response": response.choices[0].message.content,
+        "usage": get_openai_usage(response.usage),
+        "finish_reason": response.choices[0].finish_reason,
     }
 
-    # Get completion from selected API
-    response = client.chat.completions.create(**completion_params)
-    token_usage = response.usage
 
-    # Extract the response text
-    page_text = response.choices[0].message.content
+# Finish reasons reported when a response stops at the output token limit
+TRUNCATED_FINISH_REASONS = {"length", "max_tokens", "MAX_TOKENS"}
+# How much of the truncated response is quoted back in a continuation request
+CONTINUATION_CONTEXT_CHARS = 500
+
+
+def join_continuation(text: str, continuation: str) -> str:
+    """
+    Append a continuation to a truncated response, dropping a repeated opening
+    `<output>` tag or code fence and any text the model repeated from the end
+    of the truncated response.
+    """
+    if "<output>" in text and continuation.lstrip().startswith("<output>"):
+        continuation = continuation.lstrip()[len("<output>") :]
+    if "```" in text:
+        continuation = re.sub(r"^\s*```[\w-]*\n", "", continuation)
+    for size in range(
+        min(len(text), len(continuation), CONTINUATION_CONTEXT_CHARS), 0, -1
+    ):
+        if text.endswith(continuation[:size]):
+            # Short overlaps are likely coincidental, e.g. a shared space
+            if size >= 20:
+                continuation = continuation[size:]
+            break
+    return text + continuation
+
+
+@cache_response(
+    "usage",
+    [
+        "api",
+        "model",
+        "system_prompt",
+        "user_prompt",
+        "image_url",
+        "temperature",
+        "max_tokens",
+        "prompt_caching",
+        "max_continuations",
+        "response_schema",
+    ],
+)
+def create_response(
+    api: str,
+    model: str,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+    image_url: Optional[Union[str, List[str]]] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 1024,
+    prompt_caching: bool = False,
+    text_callback: Optional[Callable[[str], None]] = None,
+    max_continuations: int = 0,
+    response_schema: Optional[Dict] = None,
+) -> Dict:
+    """
+    Send a request to an LLM API and return its text response with token usage,
+    following up on truncated responses.
+
+    Takes the same arguments as `create_single_response`. When a response stops
+    at the output token limit (`finish_reason` "length" or "max_tokens") and
+    `max_continuations` allows it, the model is asked to continue from the end
+    of what it wrote, with the same prompt and images. The pieces are joined into
+    a single response and their usage is summed; `continuations` reports the
+    number of follow-up requests made. Continued text is passed to
+    `text_callback` as one delta per continuation. Continuations of a
+    `response_schema` response are requested as plain text, since a constrained
+    response would restart the JSON value.
+    """
+    response = create_single_response(
+        api=api,
+        model=model,
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        image_url=image_url,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        prompt_caching=prompt_caching,
+        text_callback=text_callback,
+        response_schema=response_schema,
+    )
+    text, usages = response["response"], [response["usage"]]
+    continuations = 0
+    while (
+        response.get("finish_reason") in TRUNCATED_FINISH_REASONS
+        and continuations < max_continuations
+    ):
+        continuations += 1
+        logger.debug(
+            f"Response truncated at {max_tokens} tokens, "
+            f"requesting continuation {continuations}/{max_continuations}"
+        )
+        continuation_prompt = CONTINUATION_PROMPT.format(
+            previous=text[-CONTINUATION_CONTEXT_CHARS:]
+        )
+        response = create_single_response(
+            api=api,
+            model=model,
+            system_prompt=system_prompt,
+            user_prompt=f"{user_prompt or ''}\n\n{continuation_prompt}",
+            image_url=image_url,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_caching=prompt_caching,
+        )
+        joined = join_continuation(text, response["response"])
+        if text_callback and len(joined) > len(text):
+            text_callback(joined[len(text) :])
+        text = joined
+        usages.append(response["usage"])
 
     return {
-        "response": page_text,
+        "response": text,
         "usage": {
-            "input_tokens": getattr(token_usage, "prompt_tokens", 0),
-            "output_tokens": getattr(token_usage, "completion_tokens", 0),
-            "total_tokens": getattr(token_usage, "total_tokens", 0),
+            key: sum(usage.get(key, 0) for usage in usages)
+            for key in dict.fromkeys(key for usage in usages for key in usage)
         },
+        "finish_reason": response.get("finish_reason"),
+        "continuations": continuations,
     }
 
 
+def to_token_usage(usage: Dict) -> Dict:
+    """Convert the `usage` dict returned by `create_response` to result token usage."""
+    return {
+        "input": usage["input_tokens"],
+        "output": usage["output_tokens"],
+        "total": usage["total_tokens"],
+        "cached_input": usage.get("cached_input_tokens", 0),
+        "cache_creation_input": usage.get("cache_creation_input_tokens", 0),
+        "response_cache_hits": usage.get("response_cache_hits", 0),
+    }
+
+
+# Providers whose vision endpoints accept several images in a single message
+MULTI_IMAGE_APIS = {"openai", "anthropic", "openrouter"}
+# OpenAI-compatible APIs whose responses are streamed to a text callback
+STREAMING_OPENAI_APIS = {"openai", "openrouter", "fireworks"}
+# OpenAI-compatible APIs that accept a `json_schema` response format
+STRUCTURED_OUTPUT_OPENAI_APIS = {"openai", "openrouter", "fireworks"}
+# Name of the tool Anthropic models are forced to call for structured output
+ANTHROPIC_SCHEMA_TOOL = "record_extracted_data"
+
+
+def get_request_provider(api: str, model: str) -> str:
+    """
+    The provider whose prompts and capabilities apply to requests sent through
+    `api`: the recorded provider for "replay", which only replaces the transport.
+    """
+    return get_replay_api(model) if api == "replay" else api
+
+
+def get_parser_prompts(
+    api: str, n_pages: int = 1, **kwargs
+) -> Tuple[Optional[str], str]:
+    """
+    Returns the (system_prompt, user_prompt) pair used to parse `n_pages` page images
+    in a single request with the given API.
+    """
+    page_break_instruction = get_page_break_instruction(n_pages)
+    if api in {"openai", "ollama"}:
+        system_prompt = kwargs.get(
+            "system_prompt",
+            PARSER_PROMPT.format(custom_instructions=page_break_instruction),
+        )
+        user_prompt = kwargs.get("user_prompt", OPENAI_USER_PROMPT)
+        if page_break_instruction and "system_prompt" in kwargs:
+            user_prompt += f"\n{page_break_instruction}"
+    else:
+        system_prompt = kwargs.get("system_prompt", None)
+        user_prompt = kwargs.get("user_prompt", LLAMA_PARSER_PROMPT)
+        if page_break_instruction:
+            user_prompt += f"\n{page_break_instruction}"
+    return system_prompt, user_prompt
+
+
+def extract_output_content(page_text: str) -> str:
+    """Extract content between <output> tags if present."""
+    if "<output>" in page_text and "</output>" in page_text:
+        return page_text.split("<output>", 1)[1].split("</output>", 1)[0].strip()
+    elif "<output>" in page_text:
+        return page_text.split("<output>", 1)[1].strip()
+    elif "</output>" in page_text:
+        return page_text.split("</output>", 1)[0].strip()
+    return page_text
+
+
+class OutputStreamParser:
+    """
+    Incrementally extracts page content from a streamed LLM response.
+
+    Mirrors `extract_output_content` and `<page-break>` splitting on a stream of
+    text deltas: text before `<output>` and after `</output>` is dropped, each page
+    is stripped of surrounding whitespace and `callback(page, delta)` is called with
+    the 1-based page number as soon as text is known to belong to a page. Partial
+    tags at the end of a delta are held back until the next delta resolves them.
+    """
+
+    OUTPUT_START = "<output>"
+    OUTPUT_END = "</output>"
+    PAGE_BREAK = "<page-break>"
+
+    def __init__(
+        self,
+        callback: Callable[[int, str], None],
+        first_page: int = 1,
+        split_pages: bool = True,
+    ):
+        self.callback = callback
+        self.page = first_page
+        self.split_pages = split_pages
+        self.state = "before_output"
+        self.buffer = ""
+        self.page_started = False
+
+    def feed(self, delta: str):
+        self.buffer += delta
+        if self.state == "before_output":
+            # Content is only known once the opening tag arrives; responses
+            # without it are resolved in `finish`.
+            if self.OUTPUT_START not in self.buffer:
+                return
+            self.buffer = self.buffer.split(self.OUTPUT_START, 1)[1]
+            self.state = "in_output"
+        if self.state == "in_output":
+            self._consume(final=False)
+
+    def finish(self):
+        if self.state == "before_output":
+            self.state = "in_output"
+        if self.state == "in_output":
+            self._consume(final=True)
+        self.buffer = ""
+
+    def _consume(self, final: bool):
+        tags = [self.OUTPUT_END] + ([self.PAGE_BREAK] if self.split_pages else [])
+        while True:
+            positions = [(self.buffer.find(tag), tag) for tag in tags]
+            positions = [(pos, tag) for pos, tag in positions if pos != -1]
+            if not positions:
+                break
+            pos, tag = min(positions)
+            self._emit(self.buffer[:pos], end_of_page=True)
+            self.buffer = self.buffer[pos + len(tag) :]
+            if tag == self.OUTPUT_END:
+                self.state = "after_output"
+                self.buffer = ""
+                return
+            self.page += 1
+            self.page_started = False
+
+        if final:
+            self._emit(self.buffer, end_of_page=True)
+            self.buffer = ""
+            return
+        # Hold back a trailing partial tag and trailing whitespace, which is
+        # stripped if it turns out to end the page.
+        hold = len(self.buffer) - len(self.buffer.rstrip())
+        for tag in tags:
+            for size in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if self.buffer.endswith(tag[:size]):
+                    hold = max(
+                        hold, len(self.buffer) - len(self.buffer[:-size].rstrip())
+                    )
+                    break
+        text = self.buffer[: len(self.buffer) - hold]
+        self.buffer = self.buffer[len(self.buffer) - hold :]
+        self._emit(text, end_of_page=False)
+
+    def _emit(self, text: str, end_of_page: bool):
+        if not self.page_started:
+            text = text.lstrip()
+        if end_of_page:
+            text = text.rstrip()
+        if text:
+            self.page_started = True
+            self.callback(self.page, text)
+
+
+def split_token_usage(usage: Dict, n_pages: int) -> List[Dict]:
+    """
+    Distribute the token usage of a multi-page request across its pages.
+    Integer remainders go to the first page so that the per-page counts add up.
+    """
+    page_usages = [{} for _ in range(n_pages)]
+    for key, value in usage.items():
+        share, remainder = divmod(value, n_pages)
+        for i, page_usage in enumerate(page_usages):
+            page_usage[key] = share + (remainder if i == 0 else 0)
+    return page_usages
+
+
+def parse_page_batch(
+    api: str, batch: List[Tuple[int, str]], **kwargs
+) -> List[Tuple[int, str, Dict, Dict]]:
+    """
+    Parse one or more page images with a single request.
+
+    Args:
+        api (str): Which API to use
+        batch (List[Tuple[int, str]]): (page_num, image_url) pairs sent together
+        **kwargs: Additional arguments including model, temperature, title, etc.
+
+    Returns:
+        List[Tuple[int, str, Dict, Dict]]: (page_num, content, token_usage,
+            metadata) for each page, where metadata holds extra segment metadata
+            such as `missing_output_tag`
+    """
+    provider = get_request_provider(api, kwargs["model"])
+    system_prompt, user_prompt = get_parser_prompts(provider, len(batch), **kwargs)
+    if kwargs.get("page_max_tokens"):
+        max_tokens = sum(kwargs["page_max_tokens"][page_num] for page_num, _ in batch)
+    else:
+        default_max_tokens = 4096 if provider == "ollama" else 1024
+        max_tokens = kwargs.get("max_tokens", default_max_tokens) * len(batch)
+    page_stream = None
+    # Multi-page responses are only streamed once they split into the expected
+    # pages, since a mismatch re-parses the pages one at a time
+    if kwargs.get("stream_callback") and len(batch) == 1:
+        page_stream = OutputStreamParser(
+            kwargs["stream_callback"],
+            first_page=kwargs.get("start", 0) + batch[0][0] + 1,
+            split_pages=False,
+        )
+    response = create_response(
+        api=api,
+        model=kwargs["model"],
+        system_prompt=system_prompt,
+        user_prompt=user_prompt,
+        image_url=[image_url for _, image_url in batch],
+        temperature=kwargs.get("temperature", 0.0),
+        max_tokens=max_tokens,
+        prompt_caching=kwargs.get("prompt_caching", False),
+        text_callback=page_stream.feed if page_stream else None,
+        max_continuations=kwargs.get("max_continuations", MAX_CONTINUATIONS),
+    )
+    if page_stream:
+        page_stream.finish()
+
+    # Get completion from selected API
+    page_text = response["response"]
+    token_usage = to_token_usage(response["usage"])
+    page_nums = [page_num for page_num, _ in batch]
+
+    if kwargs.get("verbose", None):
+        logger.debug(f"Pages {[p + 1 for p in page_nums]} response: {page_text}")
+    metadata = {}
+    if "<output>" not in page_text and "</output>" not in page_text:
+        metadata["missing_output_tag"] = True
+
+    if len(batch) == 1:
+        return [
+            (page_nums[0], extract_output_content(page_text), token_usage, metadata)
+        ]
+
+    pages = extract_output_content(page_text).split("<page-break>")
+    if len(pages) != len(batch):
+        logger.warning(
+            f"Expected {len(batch)} pages but the response contained {len(pages)}. "
+            "Re-parsing these pages one at a time."
+        )
+        results = [
+            result
+            for page in batch
+            for result in parse_page_batch(api, [page], **kwargs)
+        ]
+        # The failed request is billed too; count it with the first page
+        page_num, content, page_usage, page_metadata = results[0]
+        page_usage = {
+            key: page_usage.get(key, 0) + token_usage.get(key, 0)
+            for key in dict.fromkeys([*page_usage, *token_usage])
+        }
+        results[0] = (page_num, content, page_usage, page_metadata)
+        return results
+
+    pages = [page.strip() for page in pages]
+    if kwargs.get("stream_callback"):
+        for page_num, page in zip(page_nums, pages):
+            if page:
+                kwargs["stream_callback"](kwargs.get("start", 0) + page_num + 1, page)
+    return [
+        (page_num, page, page_usage, dict(metadata))
+        for page_num, page, page_usage in zip(
+            page_nums, pages, split_token_usage(token_usage, len(batch))
+        )
+    ]
+
+
 def parse_with_api(path: str, api: str, **kwargs) -> Dict:
     """
     Parse documents (PDFs or images) using various vision model APIs.
@@ -852,6 +1617,14 @@ def parse_with_api(path: str, api: str, **kwargs) -> Dict:
         path (str): Path to the document to parse
         api (str): Which API to use ("openai", "huggingface", or "together")
         **kwargs: Additional arguments including model, temperature, title, etc.
+            pages_per_request (int): Number of page images packed into a single
+                request for APIs that accept several images per message.
+            stream_callback (Callable[[int, str], None]): Called with
+                (page, delta) as page content is streamed from the API.
+            max_continuations (int): Follow-up requests allowed per request
+                whose output was cut off at the token limit.
+            adaptive_max_tokens (bool): Size max_tokens per page from the
+                page's text density instead of using max_tokens.
 
     Returns:
         Dict: Dictionary containing parsed document data
@@ -859,58 +1632,30 @@ def parse_with_api(path: str, api: str, **kwargs) -> Dict:
     logger.debug(f"Parsing with {api} API and model {kwargs['model']}")
     max_dimension = kwargs.get("max_image_dimension", DEFAULT_MAX_IMAGE_DIMENSION)
     images = convert_doc_to_base64_images(path, max_dimension=max_dimension)
+    if kwargs.get("adaptive_max_tokens", False):
+        kwargs["page_max_tokens"] = estimate_page_max_tokens(path)
+        logger.debug(f"Adaptive max_tokens per page: {kwargs['page_max_tokens']}")
 
-    # Process each page/image
-    all_results = []
-    for page_num, image_url in images:
-        if api in {"openai", "ollama"}:
-            system_prompt = kwargs.get(
-                "system_prompt", PARSER_PROMPT.format(custom_instructions="")
-            )
-            user_prompt = kwargs.get("user_prompt", OPENAI_USER_PROMPT)
-        else:
-            system_prompt = kwargs.get("system_prompt", None)
-            user_prompt = kwargs.get("user_prompt", LLAMA_PARSER_PROMPT)
-
-        default_max_tokens = 4096 if api == "ollama" else 1024
-        response = create_response(
-            api=api,
-            model=kwargs["model"],
-            system_prompt=system_prompt,
-            user_prompt=user_prompt,
-            image_url=image_url,
-            temperature=kwargs.get("temperature", 0.0),
-            max_tokens=kwargs.get("max_tokens", default_max_tokens),
+    pages_per_request = kwargs.get("pages_per_request", 1)
+    if (
+        pages_per_request > 1
+        and get_request_provider(api, kwargs["model"]) not in MULTI_IMAGE_APIS
+    ):
+        logger.warning(
+            f"pages_per_request is not supported for the {api} API. "
+            "Sending one page per request."
         )
+        pages_per_request = 1
 
-        # Get completion from selected API
-        page_text = response["response"]
-        token_usage = response["usage"]
-
-        if kwargs.get("verbose", None):
-            logger.debug(f"Page {page_num + 1} response: {page_text}")
-
-        # Extract content between output tags if present
-        result = page_text
-        if "<output>" in page_text and "</output>" in page_text:
-            result = page_text.split("<output>", 1)[1].split("</output>", 1)[0].strip()
-        elif "<output>" in page_text:
-            result = page_text.split("<output>", 1)[1].strip()
-        elif "</output>" in page_text:
-            result = page_text.split("</output>", 1)[0].strip()
-        all_results.append(
-            (
-                page_num,
-                result,
-                token_usage["input_tokens"],
-                token_usage["output_tokens"],
-                token_usage["total_tokens"],
-            )
-        )
+    # Process each page/image
+    all_results = []
+    for i in range(0, len(images), pages_per_request):
+        batch = images[i : i + pages_per_request]
+        all_results.extend(parse_page_batch(api, batch, **kwargs))
 
     # Sort results by page number and combine
     all_results.sort(key=lambda x: x[0])
-    all_texts = [text for _, text, _, _, _ in all_results]
+    all_texts = [text for _, text, _, _ in all_results]
     combined_text = "\n\n".join(all_texts)
 
     return {
@@ -919,33 +1664,33 @@ def parse_with_api(path: str, api: str, **kwargs) -> Dict:
             {
                 "metadata": {
                     "page": kwargs.get("start", 0) + page_no + 1,
-                    "token_usage": {
-                        "input": input_tokens,
-                        "output": output_tokens,
-                        "total": total_tokens,
-                    },
+                    "token_usage": token_usage,
+                    **metadata,
                 },
                 "content": page,
             }
-            for page_no, page, input_tokens, output_tokens, total_tokens in all_results
+            for page_no, page, token_usage, metadata in all_results
         ],
         "title": kwargs["title"],
         "url": kwargs.get("url", ""),
         "parent_title": kwargs.get("parent_title", ""),
         "recursive_docs": [],
         "token_usage": {
-            "input": sum(input_tokens for _, _, input_tokens, _, _ in all_results),
-            "output": sum(output_tokens for _, _, _, output_tokens, _ in all_results),
-            "total": sum(total_tokens for _, _, _, _, total_tokens in all_results),
+            key: sum(token_usage.get(key, 0) for _, _, token_usage, _ in all_results)
+            for key in TOKEN_USAGE_KEYS + ["total"]
         },
     }
 
 
 def parse_audio_with_gemini(path: str, **kwargs) -> Dict:
     from google import genai
+    from google.genai import types
 
     client = genai.Client()
-    audio_file = client.files.upload(file=path)
+    handle = upload_gemini_file(path)
+    audio_file = types.Part.from_uri(
+        file_uri=handle["uri"], mime_type=handle["mime_type"]
+    )
     system_prompt = kwargs.get("system_prompt", None)
     if system_prompt == "" or system_prompt is None:
         system_prompt = AUDIO_TO_MARKDOWN_PROMPT + f"Audio file name is: {path}\n"
@@ -954,6 +1699,7 @@ def parse_audio_with_gemini(path: str, **kwargs) -> Dict:
         model=kwargs["model"], contents=[system_prompt, audio_file]
     )
 
+    cached_input_tokens = response.usage_metadata.cached_content_token_count or 0
     return {
         "raw": response.text,
         "segments": [
@@ -973,5 +1719,7 @@ def parse_audio_with_gemini(path: str, **kwargs) -> Dict:
                 response.usage_metadata.prompt_token_count
                 + response.usage_metadata.candidates_token_count
             ),
+            "cached_input": cached_input_tokens,
+            "cache_creation_input": 0,
         },
     }
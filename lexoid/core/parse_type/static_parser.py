@@ -1,18 +1,21 @@
+import hashlib
+import math
 import os
 import re
-import tempfile
-from functools import wraps
+from collections import Counter, OrderedDict, defaultdict
+from functools import lru_cache, wraps
+from itertools import islice
 from time import time
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+from lexoid.core.conversion_utils import convert_doc_to_np_arrays
 from lexoid.core.utils import (
     get_file_type,
-    get_uri_rect,
     html_to_markdown,
     split_bbox_by_word_length,
     split_md_by_headings,
-    split_pdf,
 )
 
 os.environ.setdefault("PADDLE_PDX_DISABLE_MODEL_SOURCE_CHECK", "True")
@@ -188,52 +191,66 @@ def embed_links_in_text(page, text, links):
         str: The text with hyperlinks embedded inline.
     """
     words = page.extract_words(x_tolerance=1)
-    words_with_positions = []
+    # Position and length of each word in the text, and its (x0, top) in PDF
+    # coordinates as a zero-size box for the spatial lookup
+    word_spans = []
+    word_points = []
     cur_position = 0
     for word in words:
         try:
-            word_pos = text[cur_position:].index(word["text"]) + cur_position
+            word_pos = text.index(word["text"], cur_position)
         except ValueError:
             continue
-        words_with_positions.append(
-            (word["text"], word["x0"], page.mediabox[-1] - word["top"], word_pos)
-        )
+        word_spans.append((word_pos, len(word["text"])))
+        word_top = page.mediabox[-1] - word["top"]
+        word_points.append((word["x0"], word_top, word["x0"], word_top))
         cur_position = word_pos + len(word["text"])
+    word_index = BBoxGridIndex(word_points)
 
-    offset = 0
+    link_words = []
     for rect, uri in links:
         rect_left, rect_top, rect_right, rect_bottom = rect
-        text_span = []
-        start_pos = end_pos = None
-
-        for word, x0, word_top, word_pos in words_with_positions:
-            if (
-                rect_left - 1 <= x0 <= rect_right + 1
-                and rect_top - 1 <= word_top <= rect_bottom + 1
-            ):
-                if not start_pos:
-                    start_pos = word_pos + offset
-                end_pos = word_pos + len(word) + offset
-                text_span.append(word)
-
-        if start_pos is None:
+        matches = word_index.query(
+            (rect_left - 1, rect_top - 1, rect_right + 1, rect_bottom + 1)
+        )
+        if not matches:
             logger.warning(f"No matching words found for link: {uri}")
             continue
-
-        # Set start_pos to previous space.
+        link_words.append((matches, uri))
+
+    def get_link_span(text, matches, offset):
+        start_pos = word_spans[matches[0]][0] + offset
+        if not start_pos and len(matches) > 1:
+            start_pos = word_spans[matches[1]][0] + offset
+        end_pos = sum(word_spans[matches[-1]]) + offset
+        # Extend the span to the surrounding spaces
         if start_pos > 0 and text[start_pos - 1] != " ":
-            start_pos = start_pos - len(text[:start_pos].split(" ")[-1])
-        if end_pos < len(text) and text[end_pos : end_pos + 1] != " ":
-            end_pos = end_pos + len(text[end_pos:].split(" ")[0])
-        if text_span:
-            text = (
-                text[:start_pos]
-                + f"[{text[start_pos:end_pos]}]({uri})"
-                + text[end_pos:]
-            )
-            offset += len(uri) + 4  # Adjust offset for added link syntax
-        else:
-            logger.warning(f"No matching text found for link: {uri}")
+            start_pos = text.rfind(" ", 0, start_pos) + 1
+        if end_pos < len(text) and text[end_pos] != " ":
+            next_space = text.find(" ", end_pos)
+            end_pos = len(text) if next_space == -1 else next_space
+        return start_pos, end_pos
+
+    # Links that follow each other in the text are spliced in a single pass
+    fragments = []
+    cursor = 0
+    for matches, uri in link_words:
+        if fragments and word_spans[matches[0]][0] <= cursor:
+            break
+        start_pos, end_pos = get_link_span(text, matches, 0)
+        fragments.append(text[cursor:start_pos])
+        fragments.append(f"[{text[start_pos:end_pos]}]({uri})")
+        cursor = end_pos
+    else:
+        fragments.append(text[cursor:])
+        return "".join(fragments)
+
+    # Out of order or overlapping links are embedded one at a time
+    offset = 0
+    for matches, uri in link_words:
+        start_pos, end_pos = get_link_span(text, matches, offset)
+        text = text[:start_pos] + f"[{text[start_pos:end_pos]}]({uri})" + text[end_pos:]
+        offset += len(uri) + 4  # Adjust offset for added link syntax
     return text
 
 
@@ -245,6 +262,30 @@ def detect_indentation_level(word, base_left_position):
     return int(left_diff // 25) + 1
 
 
+def most_common_value(values):
+    """
+    Mode of values, counted in a single pass. Ties are broken the same way as
+    max(set(values), key=values.count).
+    """
+    counts = Counter(values)
+    return max(set(values), key=counts.__getitem__)
+
+
+@lru_cache(maxsize=None)
+def get_font_formatting(font_name: str) -> Dict[str, bool]:
+    """
+    Detect text formatting from a font name. The result is shared between calls
+    and must not be modified.
+    """
+    font_name = font_name.lower()
+    return {
+        # Check font name for common bold/italic indicators
+        "bold": any(style in font_name for style in ["bold", "heavy", "black"]),
+        "italic": any(style in font_name for style in ["italic", "oblique"]),
+        "monospace": "mono" in font_name,
+    }
+
+
 def embed_email_links(text: str) -> str:
     """
     Detect email addresses in text and wrap them in angle brackets.
@@ -256,6 +297,49 @@ def embed_email_links(text: str) -> str:
     return email_pattern.sub(lambda match: f"<{match.group('email')}>", text)
 
 
+class BBoxGridIndex:
+    """
+    Uniform grid over (x0, top, x1, bottom) boxes, so that the boxes overlapping
+    a region are found without scanning every box on the page.
+    """
+
+    def __init__(self, bboxes, cell_size: float = 50.0):
+        self.cell_size = cell_size
+        self.bboxes = list(bboxes)
+        self.cells = defaultdict(list)
+        for i, bbox in enumerate(self.bboxes):
+            for cell in self._cells(bbox):
+                self.cells[cell].append(i)
+
+    def _cells(self, bbox):
+        x0, top, x1, bottom = bbox
+        for gx in range(
+            math.floor(x0 / self.cell_size), math.floor(x1 / self.cell_size) + 1
+        ):
+            for gy in range(
+                math.floor(top / self.cell_size),
+                math.floor(bottom / self.cell_size) + 1,
+            ):
+                yield gx, gy
+
+    def query(self, bbox) -> List[int]:
+        """
+        Indices of the boxes overlapping bbox, edges included, in insertion order.
+        """
+        x0, top, x1, bottom = bbox
+        candidates = set()
+        for cell in self._cells(bbox):
+            candidates.update(self.cells.get(cell, ()))
+        return [
+            i
+            for i in sorted(candidates)
+            if self.bboxes[i][0] <= x1
+            and self.bboxes[i][2] >= x0
+            and self.bboxes[i][1] <= bottom
+            and self.bboxes[i][3] >= top
+        ]
+
+
 def process_pdf_page_with_pdfplumber(
     page, uri_rects, **kwargs
 ) -> Tuple[str, List[Tuple[str, Tuple[float, float, float, float]]]]:
@@ -319,35 +403,20 @@ def process_pdf_page_with_pdfplumber(
         markdown_table = df.to_markdown(index=False, tablefmt="pipe")
         markdown_table = f"\n{markdown_table}\n\n"
 
-        words_on_page = page.extract_words(
-            extra_attrs=["top", "bottom", "fontname", "size"],
-        )
-
-        def intersects(word_bbox, cell_bbox):
-            wx0, wtop, wx1, wbot = word_bbox
-            cx0, ctop, cx1, cbot = cell_bbox
-            x_overlap = (wx0 <= cx1) and (wx1 >= cx0)
-            y_overlap = (wtop <= cbot) and (wbot >= ctop)
-            return x_overlap and y_overlap
-
         table_bboxes = []
         for cell in table.cells:  # cell is a tuple: (x0, top, x1, bottom)
-            cx0, ctop, cx1, cbot = cell
-            cell_bbox = (cx0, ctop, cx1, cbot)
-
-            for w in words_on_page:
-                word_bbox = (w["x0"], w["top"], w["x1"], w["bottom"])
-                if intersects(word_bbox, cell_bbox):
-                    text = (w.get("text") or "").strip()
-                    if not text:
-                        continue
-                    norm_bbox = (
-                        w["x0"] / page_width,
-                        w["top"] / page_height,
-                        w["x1"] / page_width,
-                        w["bottom"] / page_height,
-                    )
-                    table_bboxes.append((text, norm_bbox))
+            for i in table_word_index.query(cell):
+                w = table_words[i]
+                text = (w.get("text") or "").strip()
+                if not text:
+                    continue
+                norm_bbox = (
+                    w["x0"] / page_width,
+                    w["top"] / page_height,
+                    w["x1"] / page_width,
+                    w["bottom"] / page_height,
+                )
+                table_bboxes.append((text, norm_bbox))
 
         return markdown_table, table_bboxes
 
@@ -360,15 +429,27 @@ def process_pdf_page_with_pdfplumber(
         }
     )
     table_zones = []
+    if tables:
+        # Extract and index the words once for the cells of every table
+        table_words = page.extract_words(
+            extra_attrs=["top", "bottom", "fontname", "size"],
+        )
+        table_word_index = BBoxGridIndex(
+            (w["x0"], w["top"], w["x1"], w["bottom"]) for w in table_words
+        )
     for table in tables:
         table_md, table_bboxes = process_table(table)
         table_zones.append((table.bbox, table_md, table_bboxes))
 
     # Create a filtered page excluding table areas
     filtered_page = page
-    for table_bbox, _, _ in table_zones:
-        filtered_page = filtered_page.filter(
-            lambda obj: get_bbox_overlap(obj_to_bbox(obj), table_bbox) is None
+    if table_zones:
+        table_zone_bboxes = [table_bbox for table_bbox, _, _ in table_zones]
+        filtered_page = page.filter(
+            lambda obj: all(
+                get_bbox_overlap(obj_to_bbox(obj), table_bbox) is None
+                for table_bbox in table_zone_bboxes
+            )
         )
 
     words = filtered_page.extract_words(
@@ -379,61 +460,35 @@ def process_pdf_page_with_pdfplumber(
 
     if words:
         font_sizes = [w.get("size", 12) for w in words]
-        body_font_size = max(set(font_sizes), key=font_sizes.count)
+        body_font_size = most_common_value(font_sizes)
+
+        # A line starts at each word whose top differs from the previous word's
+        tops = np.array([w["top"] for w in words])
+        new_lines = np.ones(len(words), dtype=bool)
+        new_lines[1:] = np.abs(np.diff(tops)) > y_tolerance
+        left_positions = np.array([w["x0"] for w in words])[new_lines].tolist()
+        # Find the most common minimum left position (mode)
+        base_left = most_common_value(left_positions)
     else:
         body_font_size = 12
-
-    left_positions = []
-    prev_bottom = None
-
-    for word in words:
-        # Check if this is likely a new line (first word in line)
-        if prev_bottom is None or abs(word["top"] - prev_bottom) > y_tolerance:
-            left_positions.append(word["x0"])
-        prev_bottom = word["top"]
-
-    # Find the most common minimum left position (mode)
-    if left_positions:
-        base_left = max(set(left_positions), key=left_positions.count)
-    else:
         base_left = 0
 
+    word_index = BBoxGridIndex((w["x0"], w["top"], w["x1"], w["bottom"]) for w in words)
     for line in horizontal_lines:
-        # Check each word to see if it overlaps with this line
-        for word in words:
-            # Get word bounding box coordinates
-            word_left = word["x0"]
-            word_right = word["x1"]
-            word_top = word["top"]
-            word_bottom = word["bottom"]
-
-            # Check if word overlaps with line in both x and y dimensions
-            x_overlap = (word_left <= line["x1"]) and (word_right >= line["x0"])
-            y_overlap = (word_top <= line["bottom"]) and (word_bottom >= line["top"])
-
-            if x_overlap and y_overlap:
-                word["text"] = f"~~{word['text']}~~"
-                break
+        # Strike through the first word that overlaps with this line
+        overlapping = word_index.query(
+            (line["x0"], line["top"], line["x1"], line["bottom"])
+        )
+        if overlapping:
+            word = words[overlapping[0]]
+            word["text"] = f"~~{word['text']}~~"
 
     def get_text_formatting(word):
         """
         Detect text formatting based on font properties
         Returns a dict of formatting attributes
         """
-        formatting = {
-            "bold": False,
-            "italic": False,
-            "monospace": False,
-        }
-        # Check font name for common bold/italic indicators
-        font_name = word.get("fontname", "").lower()
-        if any(style in font_name for style in ["bold", "heavy", "black"]):
-            formatting["bold"] = True
-        if any(style in font_name for style in ["italic", "oblique"]):
-            formatting["italic"] = True
-        if "mono" in font_name:  # Detect monospace fonts
-            formatting["monospace"] = True
-        return formatting
+        return get_font_formatting(word.get("fontname", ""))
 
     def apply_markdown_formatting(text, formatting):
         """Apply markdown formatting to text based on detected styles"""
@@ -518,6 +573,12 @@ def process_pdf_page_with_pdfplumber(
             return 3
         return None
 
+    # Heading levels only depend on the font size
+    heading_levels = {
+        size: detect_heading_level(size, body_font_size)
+        for size in set(word["size"] for word in words)
+    }
+
     tables = []
     for bbox, table_md, table_bboxes in table_zones:
         tables.append(
@@ -566,7 +627,7 @@ def process_pdf_page_with_pdfplumber(
         # If there are any pending paragraphs or headings, add them first
         if element_type == "table":
             if current_heading:
-                level = detect_heading_level(current_heading[0]["size"], body_font_size)
+                level = heading_levels[current_heading[0]["size"]]
                 heading_text = format_paragraph(current_heading)
                 markdown_content.append(f"{'#' * level} {heading_text}")
                 current_heading = []
@@ -592,7 +653,7 @@ def process_pdf_page_with_pdfplumber(
             # Process word
             word = element
             # Check if this might be a heading
-            heading_level = detect_heading_level(word["size"], body_font_size)
+            heading_level = heading_levels[word["size"]]
 
             # Detect new line based on vertical position
             is_new_line = last_y is not None and abs(word["top"] - last_y) > y_tolerance
@@ -600,9 +661,7 @@ def process_pdf_page_with_pdfplumber(
             if is_new_line:
                 # If we were collecting a heading
                 if current_heading:
-                    level = detect_heading_level(
-                        current_heading[0]["size"], body_font_size
-                    )
+                    level = heading_levels[current_heading[0]["size"]]
                     heading_text = format_paragraph(current_heading)
                     markdown_content.append(f"{'#' * level} {heading_text}")
                     current_heading = []
@@ -624,9 +683,7 @@ def process_pdf_page_with_pdfplumber(
                 current_heading.append(word)
             else:
                 if current_heading:  # Flush any pending heading
-                    level = detect_heading_level(
-                        current_heading[0]["size"], body_font_size
-                    )
+                    level = heading_levels[current_heading[0]["size"]]
                     heading_text = format_paragraph(current_heading)
                     markdown_content.append(f"{'#' * level} {heading_text}")
                     current_heading = []
@@ -636,7 +693,7 @@ def process_pdf_page_with_pdfplumber(
 
     # Handle remaining content
     if current_heading:
-        level = detect_heading_level(current_heading[0]["size"], body_font_size)
+        level = heading_levels[current_heading[0]["size"]]
         heading_text = format_paragraph(current_heading)
         markdown_content.append(f"{'#' * level} {heading_text}")
 
@@ -680,19 +737,23 @@ def process_pdf_with_pdfplumber(
     Each page returns a (markdown_text, [(word, (x0, top, x1, bottom))]) tuple for both content and bounding box mapping.
     """
     import pdfplumber
-    page_data = []
-
-    with tempfile.TemporaryDirectory() as temp_dir:
-        paths = split_pdf(path, temp_dir, pages_per_split=1)
+    from pdfplumber.utils import resolve_all
 
-        for split_path in paths:
-            uri_rects = get_uri_rect(split_path)
-            with pdfplumber.open(split_path) as pdf:
-                for page in pdf.pages:
-                    page_content, word_bboxes = process_pdf_page_with_pdfplumber(
-                        page, uri_rects, **kwargs
-                    )
-                    page_data.append((page_content.strip(), word_bboxes))
+    page_data = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            # Link rectangles in PDF user space, as the annotations store them
+            uri_rects = {
+                annot["uri"]: [float(v) for v in resolve_all(annot["data"]["Rect"])]
+                for annot in page.annots
+                if annot.get("uri")
+            }
+            page_content, word_bboxes = process_pdf_page_with_pdfplumber(
+                page, uri_rects, **kwargs
+            )
+            page_data.append((page_content.strip(), word_bboxes))
+            # Drop the parsed layout and objects of pages already processed
+            page.close()
 
     return page_data
 
@@ -748,54 +809,116 @@ def parse_with_docx(path: str, **kwargs) -> Dict:
     }
 
 
+PADDLEOCR_CONFIG = {
+    "use_doc_orientation_classify": False,
+    "use_doc_unwarping": False,
+    "use_textline_orientation": False,
+}
+_PADDLEOCR_CACHE: Dict[Tuple, object] = {}
+# Per-page OCR words keyed by (file hash, OCR config, batch size), so the bbox pass
+# and the cost-priority route reuse an earlier OCR run on the same file.
+_PADDLEOCR_RESULT_CACHE: OrderedDict = OrderedDict()
+PADDLEOCR_RESULT_CACHE_SIZE = 32
+
+
+def _get_paddleocr(ocr_kwargs: Dict):
+    from paddleocr import PaddleOCR
+
+    cache_key = tuple(sorted(ocr_kwargs.items()))
+    if cache_key not in _PADDLEOCR_CACHE:
+        _PADDLEOCR_CACHE[cache_key] = PaddleOCR(**ocr_kwargs)
+    return _PADDLEOCR_CACHE[cache_key]
+
+
+def ocr_result_to_words(result) -> List[Tuple[str, List[float]]]:
+    """Converts a PaddleOCR page result to (word, normalized bbox) pairs."""
+    words = []
+    height_img, width_img, _ = result["doc_preprocessor_res"]["output_img"].shape
+    for text, bbox in zip(result["rec_texts"], result["dt_polys"]):
+        x_coords = bbox[:, 0]
+        y_coords = bbox[:, 1]
+        x_min = x_coords.min().item()
+        y_min = y_coords.min().item()
+        x_max = x_coords.max().item()
+        y_max = y_coords.max().item()
+
+        top = y_min / height_img
+        bottom = y_max / height_img
+        x0 = x_min / width_img
+        x1 = x_max / width_img
+
+        split_words = split_bbox_by_word_length([x0, top, x1, bottom], text)
+
+        for word_bbox, word_text in split_words:
+            words.append((word_text, word_bbox))
+    return words
+
+
+def run_paddleocr(
+    path: str, batch_size: Optional[int] = None
+) -> List[Tuple[int, List[Tuple[str, List[float]]]]]:
+    """
+    Runs PaddleOCR on a document, reusing the cached result for the same file.
+
+    Args:
+        path (str): Path to the PDF or image.
+        batch_size (int, optional): If set, pages are rendered to arrays and
+            passed to PaddleOCR this many at a time instead of passing the path.
+            Only one batch of rendered pages is held in memory at a time.
+
+    Returns:
+        List[Tuple[int, List]]: (page_num, [(word, bbox), ...]) for each page.
+    """
+    with open(path, "rb") as f:
+        file_hash = hashlib.sha256(f.read()).hexdigest()
+    cache_key = (file_hash, tuple(sorted(PADDLEOCR_CONFIG.items())), batch_size)
+    if cache_key in _PADDLEOCR_RESULT_CACHE:
+        logger.debug(f"Reusing PaddleOCR result for {os.path.basename(path)}")
+        _PADDLEOCR_RESULT_CACHE.move_to_end(cache_key)
+        return _PADDLEOCR_RESULT_CACHE[cache_key]
+
+    ocr = _get_paddleocr(PADDLEOCR_CONFIG)
+    pages = []
+    if batch_size:
+        # PaddleOCR renders PDF pages at 2x (144 DPI); match it
+        page_arrays = convert_doc_to_np_arrays(path, scale=2.0)
+        batch_start = 0
+        while batch := list(islice(page_arrays, batch_size)):
+            for offset, result in enumerate(ocr.predict(batch)):
+                pages.append((batch_start + offset, ocr_result_to_words(result)))
+            batch_start += len(batch)
+    else:
+        for result in ocr.predict(path):
+            # OCRResult as dict
+            page_num = dict(result).get("page_index", 0)  # return value could be None
+            page_num = page_num or 0
+            pages.append((page_num, ocr_result_to_words(result)))
+
+    _PADDLEOCR_RESULT_CACHE[cache_key] = pages
+    while len(_PADDLEOCR_RESULT_CACHE) > PADDLEOCR_RESULT_CACHE_SIZE:
+        _PADDLEOCR_RESULT_CACHE.popitem(last=False)
+    return pages
+
+
 def parse_with_paddleocr(path: str, **kwargs) -> Dict:
     """
     Parse document using PaddleOCR and return bboxes.
 
     Args:
         path (str): Path to the PDF document.
+        **kwargs: Additional arguments, including paddleocr_batch_size to OCR
+            pre-rendered pages in batches.
 
     Returns:
         Dict: Dictionary containing parsed document data with segments per page.
     """
-    from paddleocr import PaddleOCR
-
-    ocr = PaddleOCR(
-        use_doc_orientation_classify=False,
-        use_doc_unwarping=False,
-        use_textline_orientation=False,
-    )
-
     segments = []
     all_texts = []
 
-    results = ocr.predict(path)
-    for result in results:
-        page_texts = []
-        page_bboxes = []
-        # OCRResult as dict
-        page_num = dict(result).get("page_index", 0)  # return value could be None
-        page_num = page_num or 0
-
-        height_img, width_img, _ = result["doc_preprocessor_res"]["output_img"].shape
-        for text, bbox in zip(result["rec_texts"], result["dt_polys"]):
-            x_coords = bbox[:, 0]
-            y_coords = bbox[:, 1]
-            x_min = x_coords.min().item()
-            y_min = y_coords.min().item()
-            x_max = x_coords.max().item()
-            y_max = y_coords.max().item()
-
-            top = y_min / height_img
-            bottom = y_max / height_img
-            x0 = x_min / width_img
-            x1 = x_max / width_img
-
-            split_words = split_bbox_by_word_length([x0, top, x1, bottom], text)
-
-            for word_bbox, word_text in split_words:
-                page_texts.append(word_text)
-                page_bboxes.append((word_text, word_bbox))
+    pages = run_paddleocr(path, batch_size=kwargs.get("paddleocr_batch_size"))
+    for page_num, words in pages:
+        page_texts = [word_text for word_text, _ in words]
+        page_bboxes = list(words)
 
         page_text_str = " ".join(page_texts)
         all_texts.append(page_text_str)
@@ -78,6 +78,22 @@ Ensure accurate representation of all content, including tables and visual eleme
 
 INSTRUCTIONS_ADD_PG_BREAK = "Insert a `<page-break>` tag between the content of each page to maintain the original page structure."
 
+CONTINUATION_PROMPT = """\
+Your previous response was cut off because it reached the output length limit. It ended with:
+<previous>
+{previous}
+</previous>
+Continue the response from exactly where it stopped. Do not repeat text that was already written, do not start the response over, and do not add an opening `<output>` tag or any explanation.
+"""
+
+SCHEMA_REASK_PROMPT = """\
+Your previous response was not a valid instance of the required JSON schema:
+<errors>
+{errors}
+</errors>
+Return the complete, corrected JSON instance and nothing else.
+"""
+
 LLAMA_PARSER_PROMPT = """\
 You are a document conversion assistant. Your task is to accurately reproduce the content of an image in Markdown and HTML format, maintaining the visual structure and layout of the original document as closely as possible.
 
@@ -0,0 +1,233 @@
+"""
+Record/replay LLM provider for deterministic offline runs.
+
+With `api_provider="replay"`, LLM requests are served from a cassette directory
+(`REPLAY_CASSETTE_DIR`) holding one JSON file per request. With
+`REPLAY_MODE=record`, each request is sent to the real provider
+(`REPLAY_RECORD_API`, or the one inferred from the model) and the exchange is
+saved along with its latency. In the default replay mode, the saved response is
+returned after a simulated latency (`REPLAY_LATENCY`), and rate-limit errors can
+be injected (`REPLAY_ERROR_RATE`, `REPLAY_ERROR_BURST`) to exercise the
+scheduling, concurrency and retry behaviour of `parse()` without a network.
+
+Only the transport is replaced: requests are built and routed as for the
+recorded provider (prompts, multi-image requests, whole-split Gemini requests),
+so that the cassettes hold the requests that provider is sent.
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+import requests
+from lexoid.core.response_cache import request_key
+from lexoid.core.utils import (
+    REPLAY_CASSETTE_DIR,
+    REPLAY_ERROR_BURST,
+    REPLAY_ERROR_RATE,
+    REPLAY_LATENCY,
+    REPLAY_MODE,
+    REPLAY_RECORD_API,
+    REPLAY_SEED,
+    get_api_provider_for_model,
+)
+from loguru import logger
+from requests.exceptions import HTTPError
+
+_lock = threading.Lock()
+_state = {"rng": None, "errors_left": 0, "latency_checked": False}
+
+
+class ReplayConfigError(RuntimeError):
+    """
+    An invalid replay setting. Unlike a ValueError, it is not retried by
+    `retry_on_error`.
+    """
+
+
+def _get_rng() -> random.Random:
+    if _state["rng"] is None:
+        _state["rng"] = random.Random(int(REPLAY_SEED) if REPLAY_SEED else None)
+    return _state["rng"]
+
+
+def sample_latency(spec: str, recorded: float, rng: random.Random) -> float:
+    """
+    Draws a simulated latency in seconds.
+
+    Args:
+        spec (str): One of "recorded" (the latency measured when recording),
+            "none", "fixed:S", "scale:F" (recorded latency times F),
+            "uniform:MIN,MAX" or "lognormal:MEDIAN,SIGMA".
+        recorded (float): The recorded latency of the exchange.
+        rng (random.Random): Random number generator.
+
+    Returns:
+        float: The latency.
+    """
+    kind, _, params = spec.partition(":")
+    try:
+        values = [float(value) for value in params.split(",")] if params else []
+    except ValueError:
+        raise ValueError(f"Invalid replay latency: {spec}") from None
+    if kind == "recorded":
+        return recorded
+    if kind == "none":
+        return 0.0
+    if kind == "fixed" and len(values) == 1:
+        return values[0]
+    if kind == "scale" and len(values) == 1:
+        return recorded * values[0]
+    if kind == "uniform" and len(values) == 2:
+        return rng.uniform(*values)
+    if kind == "lognormal" and len(values) == 2 and values[0] > 0:
+        return rng.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError(f"Invalid replay latency: {spec}")
+
+
+def check_replay_latency():
+    """
+    Checks `REPLAY_LATENCY` once, on the first replay request.
+
+    Raises:
+        ReplayConfigError: If the latency spec is malformed.
+    """
+    if _state["latency_checked"]:
+        return
+    try:
+        sample_latency(REPLAY_LATENCY, 0.0, random.Random(0))
+    except ValueError as e:
+        raise ReplayConfigError(str(e)) from None
+    _state["latency_checked"] = True
+
+
+def raise_injected_error():
+    """
+    Raises a simulated 429 error with probability `REPLAY_ERROR_RATE`. Once an
+    error is injected, the next `REPLAY_ERROR_BURST - 1` requests fail as well.
+    """
+    with _lock:
+        if _state["errors_left"] > 0:
+            _state["errors_left"] -= 1
+        elif REPLAY_ERROR_RATE > 0 and _get_rng().random() < REPLAY_ERROR_RATE:
+            _state["errors_left"] = max(0, REPLAY_ERROR_BURST - 1)
+        else:
+            return
+    response = requests.Response()
+    response.status_code = 429
+    response.reason = "Too Many Requests"
+    raise HTTPError(
+        "429 Client Error: Too Many Requests (injected by the replay provider)",
+        response=response,
+    )
+
+
+def get_replay_api(model: str) -> str:
+    """
+    The provider that replay requests for `model` are recorded from, whose
+    prompts and capabilities apply to them.
+    """
+    return REPLAY_RECORD_API or get_api_provider_for_model(model)
+
+
+def replay_exchange(name: str, request: Dict, send: Callable[[], Dict]) -> Dict:
+    """
+    Records or replays the response to a request.
+
+    Args:
+        name (str): Kind of request, part of the cassette key.
+        request (Dict): JSON-serializable request that identifies the cassette.
+        send (Callable[[], Dict]): Sends the request to the real provider and
+            returns its JSON-serializable response. Only called when recording.
+
+    Returns:
+        Dict: The response.
+
+    Raises:
+        FileNotFoundError: If no response was recorded for the request.
+        HTTPError: When a simulated rate-limit error is injected.
+        ReplayConfigError: If `REPLAY_LATENCY` is malformed.
+    """
+    check_replay_latency()
+    path = os.path.join(REPLAY_CASSETTE_DIR, f"{request_key(name, request)}.json")
+
+    if REPLAY_MODE == "record":
+        start = time.perf_counter()
+        response = send()
+        latency = time.perf_counter() - start
+        os.makedirs(REPLAY_CASSETTE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "model": request.get("model"),
+                    "latency": latency,
+                    "response": response,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, path)
+        logger.debug(f"Recorded {name} response to {path}")
+        return response
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No recorded response for this {request.get('model')} request in "
+            f"{REPLAY_CASSETTE_DIR}. Record it with REPLAY_MODE=record."
+        )
+    with open(path, "r") as f:
+        cassette = json.load(f)
+    raise_injected_error()
+    with _lock:
+        latency = sample_latency(REPLAY_LATENCY, cassette["latency"], _get_rng())
+    time.sleep(latency)
+    return cassette["response"]
+
+
+def create_replay_response(
+    model: str,
+    system_prompt: Optional[str] = None,
+    user_prompt: Optional[str] = None,
+    image_url: Optional[Union[str, List[str]]] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 1024,
+    prompt_caching: bool = False,
+    text_callback: Optional[Callable[[str], None]] = None,
+    response_schema: Optional[Dict] = None,
+) -> Dict:
+    """
+    Records or replays a single LLM request. Takes the same arguments as
+    `create_single_response`, except for `api`, and returns the same dict.
+
+    Raises:
+        FileNotFoundError: If no response was recorded for the request.
+        HTTPError: When a simulated rate-limit error is injected.
+        ReplayConfigError: If `REPLAY_LATENCY` is malformed.
+    """
+    from lexoid.core.parse_type import llm_parser
+
+    request = {
+        "model": model,
+        "system_prompt": system_prompt,
+        "user_prompt": user_prompt,
+        "image_url": image_url,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "prompt_caching": prompt_caching,
+        "response_schema": response_schema,
+    }
+    response = replay_exchange(
+        "replay",
+        request,
+        lambda: llm_parser.create_single_response(
+            api=get_replay_api(model), text_callback=text_callback, **request
+        ),
+    )
+    if text_callback and REPLAY_MODE != "record":
+        text_callback(response["response"])
+    return response
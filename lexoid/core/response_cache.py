@@ -0,0 +1,207 @@
+"""
+Disk-backed cache of LLM responses.
+
+Responses are memoized in a SQLite database, keyed by a hash of the request:
+provider, model, prompts, sampling parameters and the image bytes. Re-running
+the same page with the same prompt (benchmarks, prompt comparisons, reruns after
+a downstream failure) then does not call the API again. The database uses
+write-ahead logging so that worker processes can share it. Entries expire after
+`RESPONSE_CACHE_TTL` seconds, and the least recently used ones are evicted once
+the stored responses exceed `RESPONSE_CACHE_MAX_BYTES`.
+
+Caching is enabled by setting the `RESPONSE_CACHE_PATH` environment variable.
+Cache hits report zero tokens and count in `response_cache_hits` of the token
+usage, so that costs are not counted twice.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from lexoid.core.utils import (
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTL,
+)
+from loguru import logger
+
+# Arguments holding base64 images, which are hashed rather than stored in the key
+IMAGE_ARGS = {"image_url", "base64_file"}
+
+_local = threading.local()
+
+
+class ResponseCache:
+    """LRU cache of JSON-serializable responses in a SQLite database."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads or forked processes
+        connections = _local.__dict__.setdefault("connections", {})
+        key = (os.getpid(), self.path)
+        if key not in connections:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, "
+                "value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+            connections[key] = connection
+        return connections[key]
+
+    def get(self, key: str) -> Optional[Any]:
+        connection = self._connect()
+        row = connection.execute(
+            "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.ttl:
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        connection.execute(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+        )
+        return json.loads(zlib.decompress(row[0]))
+
+    def set(self, key: str, value: Any):
+        blob = zlib.compress(json.dumps(value).encode("utf-8"))
+        now = time.time()
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+            (key, blob, len(blob), now, now),
+        )
+        self.evict(now)
+
+    def evict(self, now: Optional[float] = None):
+        """Drops expired entries, then the least recently used beyond the size limit."""
+        now = time.time() if now is None else now
+        connection = self._connect()
+        connection.execute(
+            "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+        )
+        (total,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total > self.max_bytes:
+            # Keep the most recently used entries that fit in 90% of the limit,
+            # so that eviction does not run again on every write
+            connection.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM (SELECT key, "
+                "SUM(size) OVER (ORDER BY accessed_at DESC, key) AS kept "
+                "FROM responses) WHERE kept > ?)",
+                (int(self.max_bytes * 0.9),),
+            )
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    if not RESPONSE_CACHE_PATH:
+        return None
+    return ResponseCache(
+        RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL
+    )
+
+
+def request_key(name: str, arguments: Dict) -> str:
+    """Hash of a request, with base64 images replaced by the hash of their bytes."""
+    request = {"function": name}
+    for arg, value in arguments.items():
+        if arg in IMAGE_ARGS and value:
+            images = [value] if isinstance(value, str) else value
+            value = [
+                hashlib.sha256(image.encode("utf-8")).hexdigest() for image in images
+            ]
+        request[arg] = value
+    return hashlib.sha256(
+        json.dumps(request, sort_keys=True, default=repr).encode("utf-8")
+    ).hexdigest()
+
+
+def cache_response(usage_key: str, key_args: Iterable[str]) -> Callable:
+    """
+    Memoizes an LLM request function in the response cache.
+
+    Args:
+        usage_key (str): Key of the token usage dict in the function's result,
+            which is zeroed on a cache hit.
+        key_args (Iterable[str]): Arguments that identify the request. Others
+            (callbacks, document titles, temporary paths) are ignored.
+
+    Returns:
+        Callable: The decorator.
+    """
+    key_args = set(key_args)
+
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = get_response_cache()
+            # Requests made inside a cached call are covered by its entry
+            if cache is None or getattr(_local, "active", False):
+                return func(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs).arguments
+            arguments.update(arguments.pop("kwargs", {}))
+            if arguments.get("stream_callback"):
+                # Per-page streaming cannot be replayed from a cached response
+                return func(*args, **kwargs)
+
+            key = request_key(
+                func.__name__,
+                {arg: value for arg, value in arguments.items() if arg in key_args},
+            )
+            try:
+                result = cache.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache lookup failed: {e}")
+                result = None
+            if result is not None:
+                logger.debug(f"Response cache hit for {func.__name__}")
+                result[usage_key] = {
+                    **{usage: 0 for usage in result[usage_key]},
+                    "response_cache_hits": 1,
+                }
+                for arg in ("title", "url", "parent_title"):
+                    if arg in result and arg in arguments:
+                        result[arg] = arguments[arg]
+                if arguments.get("text_callback"):
+                    arguments["text_callback"](
+                        result.get("response", result.get("raw"))
+                    )
+                return result
+
+            _local.active = True
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _local.active = False
+            try:
+                cache.set(key, result)
+            except (sqlite3.Error, TypeError, ValueError) as e:
+                logger.warning(f"Could not cache the response: {e}")
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,15 +1,17 @@
 import asyncio
 import hashlib
+import json
 import mimetypes
 import os
 import re
 from collections import defaultdict, deque
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import nest_asyncio
 import numpy as np
 import pikepdf
+import pypdfium2 as pdfium
 import requests
 from bs4 import BeautifulSoup
 from Levenshtein import distance
@@ -25,6 +27,124 @@ OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "120"))
 DEFAULT_STATIC_FRAMEWORK = os.getenv("DEFAULT_STATIC_FRAMEWORK", "pdfplumber")
 DEFAULT_MAX_IMAGE_DIMENSION = int(os.getenv("DEFAULT_MAX_IMAGE_DIMENSION", "1000"))
+BATCH_POLL_INTERVAL = int(os.getenv("BATCH_POLL_INTERVAL", "60"))
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "10000"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(150 * 1024 * 1024)))
+LOCAL_MODEL_CACHE_SIZE = int(os.getenv("LOCAL_MODEL_CACHE_SIZE", "1"))
+GEMINI_FILE_CACHE_PATH = os.getenv(
+    "GEMINI_FILE_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "lexoid", "gemini_files.json"),
+)
+MAX_CONTINUATIONS = int(os.getenv("MAX_CONTINUATIONS", "2"))
+ADAPTIVE_MAX_TOKENS_CEILING = int(os.getenv("ADAPTIVE_MAX_TOKENS_CEILING", "8192"))
+SCHEMA_CHUNK_TOKENS = int(os.getenv("SCHEMA_CHUNK_TOKENS", "32000"))
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024**3)))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+REPLAY_CASSETTE_DIR = os.getenv(
+    "REPLAY_CASSETTE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "lexoid", "cassettes"),
+)
+REPLAY_MODE = os.getenv("REPLAY_MODE", "replay")
+REPLAY_RECORD_API = os.getenv("REPLAY_RECORD_API", "")
+REPLAY_LATENCY = os.getenv("REPLAY_LATENCY", "recorded")
+REPLAY_ERROR_RATE = float(os.getenv("REPLAY_ERROR_RATE", "0"))
+REPLAY_ERROR_BURST = int(os.getenv("REPLAY_ERROR_BURST", "1"))
+REPLAY_SEED = os.getenv("REPLAY_SEED", "")
+TOKEN_USAGE_KEYS = [
+    "input",
+    "output",
+    "cached_input",
+    "cache_creation_input",
+    "response_cache_hits",
+]
+TOKEN_COST_KEYS = ["input", "input-cached", "input-image", "output", "total"]
+
+
+def merge_token_usage(token_usages: List[Dict]) -> Dict:
+    """
+    Sums a list of token usage dictionaries.
+
+    Args:
+        token_usages (list): Token usage dictionaries to combine.
+
+    Returns:
+        Dict: Combined token usage with input, output, cached_input,
+            cache_creation_input, response_cache_hits, llm_page_count and total
+            counts.
+    """
+    token_usage = {key: 0 for key in TOKEN_USAGE_KEYS + ["llm_page_count"]}
+    for usage in token_usages:
+        for key in token_usage:
+            token_usage[key] += usage.get(key, 0)
+    token_usage["total"] = token_usage["input"] + token_usage["output"]
+    return token_usage
+
+
+def merge_token_cost(token_costs: List[Dict]) -> Dict:
+    """
+    Sums a list of token cost dictionaries.
+
+    Args:
+        token_costs (list): Token cost dictionaries to combine.
+
+    Returns:
+        Dict: Combined cost broken down into input, input-cached, input-image,
+            output and total.
+    """
+    return {
+        key: sum(cost.get(key, 0) for cost in token_costs) for key in TOKEN_COST_KEYS
+    }
+
+
+def compute_token_cost(token_usage: Dict, api_cost: Dict) -> Dict:
+    """
+    Computes the cost of a parse from its token usage.
+
+    Prices in `api_cost` are per million tokens. Cache reads are billed at the
+    "input-cached" price and cache writes at the "input-cache-write" price; both
+    fall back to the regular "input" price when not given.
+
+    Args:
+        token_usage (dict): Token usage as returned in the parse result.
+        api_cost (dict): Prices for the model used.
+
+    Returns:
+        Dict: Cost broken down into input, input-cached, input-image, output and
+            total.
+    """
+    cached_input = token_usage.get("cached_input", 0)
+    cache_creation_input = token_usage.get("cache_creation_input", 0)
+    uncached_input = token_usage["input"] - cached_input - cache_creation_input
+    token_cost = {
+        "input": uncached_input * api_cost["input"] / 1_000_000,
+        "input-cached": (
+            cached_input * api_cost.get("input-cached", api_cost["input"])
+            + cache_creation_input
+            * api_cost.get("input-cache-write", api_cost["input"])
+        )
+        / 1_000_000,
+        "input-image": api_cost.get("input-image", 0)
+        * token_usage.get("llm_page_count", 0),
+        "output": token_usage["output"] * api_cost["output"] / 1_000_000,
+    }
+    token_cost["total"] = (
+        token_cost["input"]
+        + token_cost["input-cached"]
+        + token_cost["input-image"]
+        + token_cost["output"]
+    )
+    return token_cost
+
+
+def load_api_cost_mapping(api_cost_mapping: Union[Dict, str]) -> Dict:
+    """Returns the `api_cost_mapping` argument as a dict, loading it if it is a path."""
+    if isinstance(api_cost_mapping, dict):
+        return api_cost_mapping
+    if isinstance(api_cost_mapping, str) and os.path.exists(api_cost_mapping):
+        with open(api_cost_mapping, "r") as f:
+            return json.load(f)
+    raise ValueError(f"Unsupported API cost value: {api_cost_mapping}.")
 
 
 def split_pdf(input_path: str, output_dir: str, pages_per_split: int):
@@ -481,6 +601,206 @@ def has_hyperlink_in_pdf(path: str):
     )
 
 
+def get_pdf_page_count(path: str) -> int:
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        return len(pdf_document)
+    finally:
+        pdf_document.close()
+
+
+def find_duplicate_pages(
+    path: str, threshold: int = 0, scale: float = 0.5
+) -> Dict[int, int]:
+    """
+    Finds PDF pages that repeat an earlier page, such as recurring cover sheets.
+
+    Pages are rendered in grayscale at a low resolution. With ``threshold=0`` only
+    pages whose renders are pixel-identical are grouped; otherwise pages whose
+    64-bit difference hashes (dHash) differ in at most ``threshold`` bits are.
+
+    Args:
+        path (str): Path to the PDF.
+        threshold (int): Maximum Hamming distance between near-duplicate pages.
+        scale (float): Render scale used for hashing (1.0 = 72 DPI).
+
+    Returns:
+        Dict[int, int]: Maps each duplicate page number (1-indexed) to the first
+            page of its cluster, which is the one to parse.
+    """
+    from PIL import Image
+
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        hashes = []
+        for page_num in range(len(pdf_document)):
+            image = pdf_document[page_num].render(scale=scale, grayscale=True)
+            image = image.to_pil().convert("L")
+            if threshold == 0:
+                hashes.append(hashlib.sha256(image.tobytes()).digest())
+            else:
+                pixels = np.asarray(image.resize((9, 8), Image.LANCZOS), dtype=int)
+                bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+                hashes.append(int("".join("1" if b else "0" for b in bits), 2))
+    finally:
+        pdf_document.close()
+
+    duplicate_of = {}
+    representatives = []
+    for page, page_hash in enumerate(hashes, start=1):
+        for rep_page, rep_hash in representatives:
+            if (
+                page_hash == rep_hash
+                if threshold == 0
+                else bin(page_hash ^ rep_hash).count("1") <= threshold
+            ):
+                duplicate_of[page] = rep_page
+                break
+        else:
+            representatives.append((page, page_hash))
+    return duplicate_of
+
+
+def find_blank_pages(
+    path: str,
+    ink_threshold: float = 0.001,
+    char_threshold: int = 0,
+    scale: float = 0.5,
+) -> List[int]:
+    """
+    Finds blank or near-empty PDF pages, such as scanned separator sheets.
+
+    A page is blank when at most ``char_threshold`` non-whitespace characters are
+    in its text layer and dark pixels cover at most ``ink_threshold`` of a
+    low-resolution grayscale render.
+
+    Args:
+        path (str): Path to the PDF.
+        ink_threshold (float): Maximum fraction of dark pixels on a blank page.
+        char_threshold (int): Maximum text-layer character count on a blank page.
+        scale (float): Render scale used to measure ink coverage (1.0 = 72 DPI).
+
+    Returns:
+        List[int]: 1-indexed numbers of the blank pages.
+    """
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        blank_pages = []
+        for page_num in range(len(pdf_document)):
+            page = pdf_document[page_num]
+            text = page.get_textpage().get_text_range()
+            if len("".join(text.split())) > char_threshold:
+                continue
+            image = page.render(scale=scale, grayscale=True).to_pil().convert("L")
+            if (np.asarray(image) < 128).mean() <= ink_threshold:
+                blank_pages.append(page_num + 1)
+    finally:
+        pdf_document.close()
+    return blank_pages
+
+
+def get_pdf_page_texts(path: str) -> List[str]:
+    """Returns the text layer of each page of a PDF."""
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        return [
+            pdf_document[page_num].get_textpage().get_text_range()
+            for page_num in range(len(pdf_document))
+        ]
+    finally:
+        pdf_document.close()
+
+
+def estimate_page_chars(path: str, scale: float = 0.5) -> List[float]:
+    """
+    Estimates how many characters of text each page of a PDF or image holds.
+
+    The count comes from the PDF text layer or, for scanned pages and images,
+    from the dark-pixel coverage of a low-resolution grayscale render, whichever
+    is larger.
+
+    Args:
+        path (str): Path to the PDF or image.
+        scale (float): Render scale used to measure ink coverage (1.0 = 72 DPI).
+
+    Returns:
+        List[float]: Estimated non-whitespace character count per page.
+    """
+    from PIL import Image
+
+    # Characters per unit of dark-pixel coverage for printed text at this scale
+    chars_per_ink = 120_000
+
+    if not path.lower().endswith(".pdf"):
+        with Image.open(path) as image:
+            image = image.convert("L")
+            image.thumbnail((int(612 * scale), int(792 * scale)))
+            return [(np.asarray(image) < 128).mean() * chars_per_ink]
+
+    page_chars = []
+    pdf_document = pdfium.PdfDocument(path)
+    try:
+        for page_num in range(len(pdf_document)):
+            page = pdf_document[page_num]
+            text = page.get_textpage().get_text_range()
+            image = page.render(scale=scale, grayscale=True).to_pil().convert("L")
+            ink = (np.asarray(image) < 128).mean()
+            page_chars.append(max(len("".join(text.split())), ink * chars_per_ink))
+    finally:
+        pdf_document.close()
+    return page_chars
+
+
+def estimate_page_max_tokens(
+    path: str, floor: int = 256, ceiling: int = ADAPTIVE_MAX_TOKENS_CEILING
+) -> List[int]:
+    """
+    Estimates an output token budget for each page of a PDF or image from how
+    much text it holds (see `estimate_page_chars`).
+
+    Roughly 4 characters make a token; the estimate gets 50% headroom for
+    Markdown/HTML markup and is clamped to ``[floor, ceiling]``.
+
+    Args:
+        path (str): Path to the PDF or image.
+        floor (int): Smallest budget returned for a page.
+        ceiling (int): Largest budget returned for a page.
+
+    Returns:
+        List[int]: One max_tokens value per page.
+    """
+    return [
+        max(floor, min(ceiling, int(chars / 4 * 1.5)))
+        for chars in estimate_page_chars(path)
+    ]
+
+
+def group_segments_by_tokens(segments: List[Dict], max_tokens: int) -> List[List[Dict]]:
+    """
+    Groups consecutive page segments into chunks whose content fits an input token
+    budget, estimated at roughly 4 characters per token. A page larger than the
+    budget gets a chunk of its own.
+
+    Args:
+        segments (List[Dict]): Parsed page segments, in order.
+        max_tokens (int): Token budget per chunk.
+
+    Returns:
+        List[List[Dict]]: The chunks, in order.
+    """
+    chunks: List[List[Dict]] = []
+    chunk_tokens = 0
+    for segment in segments:
+        tokens = len(segment["content"]) / 4
+        if chunks and chunk_tokens + tokens <= max_tokens:
+            chunks[-1].append(segment)
+            chunk_tokens += tokens
+        else:
+            chunks.append([segment])
+            chunk_tokens = tokens
+    return chunks
+
+
 def get_api_provider_for_model(model: str) -> str:
     if model.startswith("gemini"):
         return "gemini"
@@ -612,18 +932,6 @@ def bbox_router(path: str) -> str:
     raise ValueError(f"No suitable bbox extraction method for file type: {file_type}")
 
 
-def get_uri_rect(path):
-    with open(path, "rb") as fp:
-        byte_str = str(fp.read())
-    pattern = r"\((https?://[^\s)]+)\)"
-    uris = re.findall(pattern, byte_str)
-    rect_splits = byte_str.split("/Rect [")[1:]
-    rects = [
-        list(map(float, rect_split.split("]")[0].split())) for rect_split in rect_splits
-    ]
-    return {uri: rect for uri, rect in zip(uris, rects)}
-
-
 def remove_html_tags(text: str):
     html = markdown(text, extensions=["tables"])
     return re.sub(HTML_TAG_PATTERN, " ", html)
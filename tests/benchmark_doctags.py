@@ -0,0 +1,80 @@
+# DocTags to markdown conversion throughput.
+# python3 tests/benchmark_doctags.py [--repeat 50]
+
+import argparse
+import random
+import time
+from glob import glob
+
+from lexoid.core.parse_type.doctags import (
+    TAG_PATTERN,
+    DocTagsParser,
+    doctags_to_markdown_and_bboxes,
+)
+
+
+def synthetic_page(n_blocks: int = 400, seed: int = 0) -> str:
+    """A dense page with tens of thousands of <loc_N> tokens."""
+    rng = random.Random(seed)
+
+    def locs(n=4):
+        return "".join(f"<loc_{rng.randint(0, 500)}>" for _ in range(n))
+
+    parts = ["<doctag>"]
+    for i in range(n_blocks):
+        kind = i % 4
+        if kind == 0:
+            parts.append(
+                f"<section_header_level_2>{locs()}Section {i}</section_header_level_2>"
+            )
+        elif kind == 3:
+            cells = "".join(f"<fcel>{locs()}v{j}" for j in range(6))
+            parts.append(
+                f"<otsl>{locs()}<ched>A<ched>B<nl>{(cells + '<nl>') * 4}</otsl>"
+            )
+        else:
+            parts.append(f"<text>{locs(40)}Paragraph {i} with some body text.</text>")
+    parts.append("</doctag>")
+    return "".join(parts)
+
+
+def time_it(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def streamed(doctags: str, chunk_size: int = 16):
+    parser = DocTagsParser()
+    for pos in range(0, len(doctags), chunk_size):
+        parser.feed(doctags[pos : pos + chunk_size])
+    return parser.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    pages = {
+        p: open(p, encoding="utf-8").read()
+        for p in glob("tests/fixtures/doctags/*.doctags")
+    }
+    pages["synthetic"] = synthetic_page()
+
+    print(
+        f"{'page':<50} {'tokens':>8} {'ms/page':>10} {'tokens/s':>12} {'streamed ms':>12}"
+    )
+    for name, doctags in pages.items():
+        n_tokens = len(TAG_PATTERN.findall(doctags))
+        elapsed = time_it(lambda: doctags_to_markdown_and_bboxes(doctags), args.repeat)
+        elapsed_streamed = time_it(lambda: streamed(doctags), args.repeat)
+        print(
+            f"{name:<50} {n_tokens:>8} {elapsed * 1000:>10.3f} "
+            f"{n_tokens / elapsed if elapsed else 0:>12.0f} {elapsed_streamed * 1000:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Pages-per-second benchmark for local docling models on CPU.
+# python3 tests/benchmark_local_cpu.py [--model ds4sd/SmolDocling-256M-preview]
+
+import argparse
+import os
+import time
+from glob import glob
+
+import pypdfium2 as pdfium
+
+from lexoid.api import parse
+
+PROFILES = [
+    {"label": "float32", "cpu_quantization": None},
+    {"label": "bf16", "cpu_quantization": "bf16"},
+    {"label": "int8", "cpu_quantization": "int8"},
+]
+
+
+def count_pages(path: str) -> int:
+    if path.lower().endswith(".pdf"):
+        pdf = pdfium.PdfDocument(path)
+        n_pages = len(pdf)
+        pdf.close()
+        return n_pages
+    return 1
+
+
+def run_profile(paths, model: str, max_processes: int, profile: dict) -> float:
+    config = {
+        "parser_type": "LLM_PARSE",
+        "api_provider": "local",
+        "model": model,
+        "max_processes": max_processes,
+    }
+    if profile["cpu_quantization"]:
+        config["cpu_quantization"] = profile["cpu_quantization"]
+
+    total_pages = 0
+    start = time.time()
+    for path in paths:
+        parse(path, **config)
+        total_pages += count_pages(path)
+    elapsed = time.time() - start
+    return total_pages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="ds4sd/SmolDocling-256M-preview")
+    parser.add_argument("--input-dir", default="examples/inputs")
+    parser.add_argument("--max-processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    paths = sorted(
+        path
+        for path in glob(os.path.join(args.input_dir, "*"))
+        if path.lower().endswith((".pdf", ".png", ".jpg", ".jpeg"))
+    )
+
+    print(f"{'profile':<10} {'pages/s':>10}")
+    for profile in PROFILES:
+        pages_per_second = run_profile(paths, args.model, args.max_processes, profile)
+        print(f"{profile['label']:<10} {pages_per_second:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
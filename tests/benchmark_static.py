@@ -0,0 +1,51 @@
+# Per-page CPU time of the pdfplumber static parser.
+# python3 tests/benchmark_static.py [--input-dir examples/inputs] [--repeat 3]
+
+import argparse
+import os
+import time
+from glob import glob
+
+from loguru import logger
+
+from lexoid.core.parse_type.static_parser import process_pdf_with_pdfplumber
+
+
+def benchmark_file(path: str, repeat: int):
+    """Returns the page count and the best CPU time over the runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        pages = process_pdf_with_pdfplumber(path)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(pages), best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", default="examples/inputs")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logger.remove()
+    paths = sorted(glob(os.path.join(args.input_dir, "*.pdf")))
+    total_pages = 0
+    total_time = 0.0
+    print(f"{'file':<45} {'pages':>5} {'ms/page':>9}")
+    for path in paths:
+        n_pages, elapsed = benchmark_file(path, args.repeat)
+        total_pages += n_pages
+        total_time += elapsed
+        print(
+            f"{os.path.basename(path):<45} {n_pages:>5} "
+            f"{1000 * elapsed / max(n_pages, 1):>9.1f}"
+        )
+    print(
+        f"{'total':<45} {total_pages:>5} "
+        f"{1000 * total_time / max(total_pages, 1):>9.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
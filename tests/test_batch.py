@@ -0,0 +1,241 @@
+# python3 -m pytest tests/test_batch.py -v
+# Runs against a local stand-in server implementing the OpenAI Batch and
+# Anthropic Message Batches endpoints, so no API keys are needed.
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from lexoid.api import parse_batch
+
+
+class BatchServer(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), BatchHandler)
+        self.files = {}
+        self.batches = {}
+        self.submitted_requests = []
+        self.polls = {}
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def fake_page_content(request: dict) -> str:
+    body = request.get("body") or request.get("params")
+    return f"<output>Parsed {request['custom_id']} with {body['model']}</output>"
+
+
+class BatchHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def ended(self, batch_id) -> bool:
+        # Report every batch as still running on its first poll
+        self.server.polls[batch_id] = self.server.polls.get(batch_id, 0) + 1
+        return self.server.polls[batch_id] > 1
+
+    def do_POST(self):
+        server = self.server
+        body = self.read_body()
+        if self.path == "/v1/files":
+            # Pull the JSONL lines out of the multipart upload
+            lines = re.findall(rb'^\{"custom_id".*$', body, flags=re.M)
+            file_id = f"file-{len(server.files)}"
+            server.files[file_id] = [json.loads(line) for line in lines]
+            self.send_json(
+                {
+                    "id": file_id,
+                    "object": "file",
+                    "bytes": len(body),
+                    "created_at": 0,
+                    "filename": "lexoid_batch.jsonl",
+                    "purpose": "batch",
+                    "status": "processed",
+                }
+            )
+        elif self.path == "/v1/batches":
+            params = json.loads(body)
+            batch_id = f"batch-{len(server.batches)}"
+            requests = server.files[params["input_file_id"]]
+            server.submitted_requests.extend(requests)
+            server.batches[batch_id] = requests
+            self.send_json(self.openai_batch(batch_id, params["input_file_id"]))
+        elif self.path == "/v1/messages/batches":
+            requests = json.loads(body)["requests"]
+            batch_id = f"msgbatch-{len(server.batches)}"
+            server.submitted_requests.extend(requests)
+            server.batches[batch_id] = requests
+            self.send_json(self.anthropic_batch(batch_id, ended=False))
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if match := re.fullmatch(r"/v1/batches/([\w-]+)", path):
+            batch_id = match.group(1)
+            self.send_json(self.openai_batch(batch_id, "file-0", self.ended(batch_id)))
+        elif match := re.fullmatch(r"/v1/files/output-([\w-]+)/content", path):
+            lines = [
+                {
+                    "id": f"resp-{request['custom_id']}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "id": "chatcmpl-1",
+                            "object": "chat.completion",
+                            "created": 0,
+                            "model": request["body"]["model"],
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "finish_reason": "stop",
+                                    "message": {
+                                        "role": "assistant",
+                                        "content": fake_page_content(request),
+                                    },
+                                }
+                            ],
+                            "usage": {
+                                "prompt_tokens": 100,
+                                "completion_tokens": 10,
+                                "total_tokens": 110,
+                            },
+                        },
+                    },
+                    "error": None,
+                }
+                for request in server.batches[match.group(1)]
+            ]
+            self.send_json(
+                "\n".join(json.dumps(line) for line in lines).encode(),
+                "application/octet-stream",
+            )
+        elif match := re.fullmatch(r"/v1/messages/batches/([\w-]+)", path):
+            batch_id = match.group(1)
+            self.send_json(self.anthropic_batch(batch_id, self.ended(batch_id)))
+        elif match := re.fullmatch(r"/v1/messages/batches/([\w-]+)/results", path):
+            lines = [
+                {
+                    "custom_id": request["custom_id"],
+                    "result": {
+                        "type": "succeeded",
+                        "message": {
+                            "id": "msg_1",
+                            "type": "message",
+                            "role": "assistant",
+                            "model": request["params"]["model"],
+                            "content": [
+                                {"type": "text", "text": fake_page_content(request)}
+                            ],
+                            "stop_reason": "end_turn",
+                            "stop_sequence": None,
+                            "usage": {"input_tokens": 100, "output_tokens": 10},
+                        },
+                    },
+                }
+                for request in server.batches[match.group(1)]
+            ]
+            self.send_json(
+                "\n".join(json.dumps(line) for line in lines).encode(),
+                "application/binary",
+            )
+        else:
+            self.send_error(404)
+
+    def openai_batch(self, batch_id, input_file_id, ended=False):
+        return {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": "/v1/chat/completions",
+            "input_file_id": input_file_id,
+            "completion_window": "24h",
+            "created_at": 0,
+            "status": "completed" if ended else "in_progress",
+            "output_file_id": f"output-{batch_id}" if ended else None,
+        }
+
+    def anthropic_batch(self, batch_id, ended):
+        count = len(self.server.batches[batch_id])
+        return {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else count,
+                "succeeded": count if ended else 0,
+                "errored": 0,
+                "canceled": 0,
+                "expired": 0,
+            },
+            "created_at": "2024-01-01T00:00:00Z",
+            "expires_at": "2024-01-02T00:00:00Z",
+            "ended_at": "2024-01-01T01:00:00Z" if ended else None,
+            "archived_at": None,
+            "cancel_initiated_at": None,
+            "results_url": (
+                f"{self.server.base_url}/v1/messages/batches/{batch_id}/results"
+                if ended
+                else None
+            ),
+        }
+
+
+@pytest.fixture
+def batch_server(monkeypatch):
+    server = BatchServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{server.base_url}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setenv("ANTHROPIC_BASE_URL", server.base_url)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("model", ["gpt-4o-mini", "claude-haiku-4-5-20251001"])
+def test_parse_batch_offline(batch_server, tmp_path, model):
+    paths = ["examples/inputs/test_1.pdf", "examples/inputs/test_4.jpg"]
+    manifest_path = str(tmp_path / "manifest.json")
+
+    results = parse_batch(
+        paths, model=model, manifest_path=manifest_path, poll_interval=0
+    )
+
+    assert len(results) == 2
+    assert len(batch_server.batches) == 1
+    for doc_idx, result in enumerate(results):
+        assert result["segments"]
+        for segment in result["segments"]:
+            page = segment["metadata"]["page"]
+            assert (
+                segment["content"] == f"Parsed doc{doc_idx}-page{page - 1} with {model}"
+            )
+        assert result["token_usage"]["input"] == 100 * len(result["segments"])
+        assert result["token_usage"]["llm_page_count"] == len(result["segments"])
+
+    # Resuming from the manifest reuses the finished batch instead of resubmitting
+    submitted = len(batch_server.submitted_requests)
+    resumed = parse_batch(
+        paths, model=model, manifest_path=manifest_path, poll_interval=0
+    )
+    assert len(batch_server.submitted_requests) == submitted
+    assert [r["raw"] for r in resumed] == [r["raw"] for r in results]
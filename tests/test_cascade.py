@@ -0,0 +1,191 @@
+# python3 -m pytest tests/test_cascade.py -v
+# The LLM calls are replaced by a stand-in that answers from the PDF text layer,
+# so the escalation logic can be checked without API keys.
+
+import pikepdf
+import pytest
+from lexoid.api import parse
+from lexoid.core import cascade
+from lexoid.core.cascade import check_page, has_malformed_table
+from lexoid.core.utils import create_sub_pdf, get_pdf_page_texts
+
+SAMPLE = "examples/inputs/sample_test_doc.pdf"
+API_COST_MAPPING = {
+    "cheap-model": {"input": 0.1, "output": 0.4},
+    "strong-model": {"input": 2.0, "output": 8.0},
+}
+
+
+def test_has_malformed_table():
+    assert not has_malformed_table("| a | b |\n| --- | --- |\n| 1 | 2 |")
+    assert has_malformed_table("| a | b |\n| --- | --- |\n| 1 | 2 | 3 |")
+    assert has_malformed_table("| a | b |\n| 1 | 2 |")
+    assert has_malformed_table("<table><tr><td>1</td></tr>")
+    assert not has_malformed_table("<table><tr><td>1</td></tr></table>")
+
+
+def test_check_page():
+    text_layer = " ".join(f"word{i}" for i in range(50))
+    segment = {"metadata": {}, "content": text_layer}
+    assert check_page(segment, len(text_layer), text_layer, {}) == []
+
+    segment = {"metadata": {"missing_output_tag": True}, "content": "word1"}
+    assert check_page(segment, len(text_layer), text_layer, {}) == [
+        "short_output",
+        "missing_output_tag",
+        "text_layer_mismatch",
+    ]
+    stage = {"escalate_on": ["malformed_table"]}
+    assert check_page(segment, len(text_layer), text_layer, stage) == []
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    calls = []
+
+    def fake_parse_llm_doc(path, **kwargs):
+        texts = get_pdf_page_texts(path)
+        calls.append((kwargs["model"], len(texts)))
+        segments = []
+        for page, text in enumerate(texts, start=1):
+            # The cheap model drops most of the second page
+            if kwargs["model"] == "cheap-model" and text.startswith("2"):
+                text = text[:20]
+            segments.append(
+                {
+                    "metadata": {
+                        "page": page,
+                        "token_usage": {
+                            "input": 1000,
+                            "output": 100,
+                            "total": 1100,
+                            "cached_input": 0,
+                            "cache_creation_input": 0,
+                        },
+                    },
+                    "content": text,
+                }
+            )
+        return {
+            "raw": "\n\n".join(segment["content"] for segment in segments),
+            "segments": segments,
+            "token_usage": {
+                "input": 1000 * len(texts),
+                "output": 100 * len(texts),
+                "total": 1100 * len(texts),
+            },
+        }
+
+    monkeypatch.setattr(cascade, "parse_llm_doc", fake_parse_llm_doc)
+    return calls
+
+
+@pytest.mark.parametrize("pages_per_split", [1, 4])
+def test_cascade_escalates_failing_pages(fake_llm, tmp_path, pages_per_split):
+    sample = create_sub_pdf(SAMPLE, str(tmp_path / "sample.pdf"), [1, 2, 5])
+    texts = get_pdf_page_texts(sample)
+    escalated = [2]
+
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        pages_per_split=pages_per_split,
+        max_processes=1,
+        cascade=[{"model": "cheap-model"}, {"model": "strong-model"}],
+        api_cost_mapping=API_COST_MAPPING,
+    )
+
+    # Only the failing pages are sent to the second model
+    pages_sent = {"cheap-model": 0, "strong-model": 0}
+    for model, n_pages in fake_llm:
+        pages_sent[model] += n_pages
+    assert pages_sent == {"cheap-model": len(texts), "strong-model": len(escalated)}
+    for segment in result["segments"]:
+        metadata = segment["metadata"]
+        page = metadata["page"]
+        expected_model = "strong-model" if page in escalated else "cheap-model"
+        assert metadata["model_used"] == expected_model
+        assert [attempt["model"] for attempt in metadata["cascade"]] == (
+            ["cheap-model", "strong-model"] if page in escalated else ["cheap-model"]
+        )
+        assert segment["content"] == texts[page - 1]
+        assert metadata["token_cost"]["total"] == pytest.approx(
+            sum(attempt["token_cost"]["total"] for attempt in metadata["cascade"])
+        )
+
+    assert result["token_usage"]["llm_page_count"] == len(texts) + len(escalated)
+    assert result["token_cost"]["total"] == pytest.approx(
+        sum(
+            segment["metadata"]["token_cost"]["total"] for segment in result["segments"]
+        )
+    )
+
+
+def test_cascade_keeps_missing_pages(fake_llm, tmp_path, monkeypatch):
+    sample = create_sub_pdf(SAMPLE, str(tmp_path / "sample.pdf"), [1, 5])
+    dropped_text = get_pdf_page_texts(sample)[1]
+    fake_parse_llm_doc = cascade.parse_llm_doc
+
+    def drop_second_page(path, **kwargs):
+        # Every stage leaves the second page out of its output
+        result = fake_parse_llm_doc(path, **kwargs)
+        result["segments"] = [
+            segment
+            for segment in result["segments"]
+            if not dropped_text.startswith(segment["content"])
+        ]
+        return result
+
+    monkeypatch.setattr(cascade, "parse_llm_doc", drop_second_page)
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        max_processes=1,
+        cascade=[{"model": "cheap-model"}, {"model": "strong-model"}],
+    )
+    assert [segment["metadata"]["page"] for segment in result["segments"]] == [1, 2]
+    missing = result["segments"][1]
+    assert missing["content"] == ""
+    assert missing["metadata"]["missing_page"]
+    assert missing["metadata"]["model_used"] is None
+    assert [attempt["failed_checks"] for attempt in missing["metadata"]["cascade"]] == [
+        ["missing_page"],
+        ["missing_page"],
+    ]
+
+
+def test_cascade_with_deduplicate_pages(fake_llm, tmp_path):
+    # The escalated page appears twice but is only parsed, and billed, once
+    sample = str(tmp_path / "sample.pdf")
+    with pikepdf.open(SAMPLE) as source, pikepdf.new() as pdf:
+        pdf.pages.extend([source.pages[i - 1] for i in [1, 2, 5, 2]])
+        pdf.save(sample)
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        pages_per_split=1,
+        max_processes=1,
+        deduplicate_pages=True,
+        cascade=[{"model": "cheap-model"}, {"model": "strong-model"}],
+        api_cost_mapping=API_COST_MAPPING,
+    )
+
+    assert result["deduplication"]["duplicates"] == {4: 2}
+    assert sorted(fake_llm) == [("cheap-model", 1)] * 3 + [("strong-model", 1)]
+    copy = result["segments"][3]["metadata"]
+    assert copy["duplicate_of"] == 2
+    assert "token_usage" not in copy and "token_cost" not in copy
+
+    cheap, strong = API_COST_MAPPING["cheap-model"], API_COST_MAPPING["strong-model"]
+    expected_total = (
+        3 * (1000 * cheap["input"] + 100 * cheap["output"])
+        + 1000 * strong["input"]
+        + 100 * strong["output"]
+    ) / 1_000_000
+    assert result["token_cost"]["total"] == pytest.approx(expected_total)
+    assert result["token_cost"]["total"] == pytest.approx(
+        sum(
+            segment["metadata"].get("token_cost", {}).get("total", 0)
+            for segment in result["segments"]
+        )
+    )
@@ -0,0 +1,56 @@
+# python3 -m pytest tests/test_continuation.py -v
+
+from lexoid.core.parse_type import llm_parser
+from lexoid.core.parse_type.llm_parser import create_response, join_continuation
+
+
+def test_join_continuation():
+    text = "<output>\n| Year | Revenue |\n| --- | --- |\n| 2021 | 10"
+    assert join_continuation(text, "0 |\n</output>") == text + "0 |\n</output>"
+    # Repeated opening tag and repeated tail are dropped
+    assert (
+        join_continuation(text, "<output>| --- | --- |\n| 2021 | 100 |") == text + "0 |"
+    )
+    assert join_continuation('```json\n{"a": [1, ', "```json\n2]}\n```") == (
+        '```json\n{"a": [1, 2]}\n```'
+    )
+
+
+def test_create_response_continues_truncated_output(monkeypatch):
+    pieces = ["<output>Line one\nLine t", "wo\nLine three</output>"]
+    requests = []
+
+    def fake_single_response(**kwargs):
+        requests.append(kwargs)
+        text = pieces[len(requests) - 1]
+        if kwargs.get("text_callback"):
+            kwargs["text_callback"](text)
+        return {
+            "response": text,
+            "usage": {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+            "finish_reason": "length" if len(requests) < len(pieces) else "stop",
+        }
+
+    monkeypatch.setattr(llm_parser, "create_single_response", fake_single_response)
+    deltas = []
+    response = create_response(
+        api="openai",
+        model="gpt-4o-mini",
+        user_prompt="Convert the page.",
+        text_callback=deltas.append,
+        max_continuations=2,
+    )
+
+    assert response["response"] == "<output>Line one\nLine two\nLine three</output>"
+    assert "".join(deltas) == response["response"]
+    assert response["continuations"] == 1
+    assert response["usage"]["input_tokens"] == 200
+    assert "Line t" in requests[1]["user_prompt"]
+
+    # Without continuations the truncated text is returned as is
+    requests.clear()
+    response = create_response(
+        api="openai", model="gpt-4o-mini", user_prompt="Convert the page."
+    )
+    assert response["finish_reason"] == "length"
+    assert response["continuations"] == 0
@@ -0,0 +1,47 @@
+# python3 -m pytest tests/test_doctags.py -v
+# The fixtures were recorded from the original re.split based converter, so these
+# tests pin the streaming parser to byte-identical markdown and bboxes.
+
+import json
+import random
+from glob import glob
+from pathlib import Path
+
+import pytest
+from lexoid.core.parse_type.doctags import (
+    DocTagsParser,
+    doctags_to_markdown_and_bboxes,
+)
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures" / "doctags"
+FIXTURES = sorted(Path(p).stem for p in glob(str(FIXTURE_DIR / "*.doctags")))
+
+
+def load_fixture(name: str):
+    doctags = (FIXTURE_DIR / f"{name}.doctags").read_text(encoding="utf-8")
+    expected = json.loads((FIXTURE_DIR / f"{name}.json").read_text(encoding="utf-8"))
+    return doctags, expected
+
+
+def as_json(markdown, bboxes) -> dict:
+    return {"markdown": markdown, "bboxes": [[text, box] for text, box in bboxes]}
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_doctags_matches_fixture(name):
+    doctags, expected = load_fixture(name)
+    assert as_json(*doctags_to_markdown_and_bboxes(doctags)) == expected
+
+
+@pytest.mark.parametrize("name", FIXTURES)
+def test_doctags_streamed_in_chunks(name):
+    doctags, expected = load_fixture(name)
+    rng = random.Random(name)
+    for _ in range(5):
+        parser = DocTagsParser()
+        pos = 0
+        while pos < len(doctags):
+            step = rng.randint(1, 12)
+            parser.feed(doctags[pos : pos + step])
+            pos += step
+        assert as_json(*parser.finish()) == expected
@@ -2,11 +2,30 @@
 # With logs: python3 -m pytest tests/test_parser.py -v -s
 
 import os
+import random
+import threading
+import time
 
+import pikepdf
 import pytest
 from benchmark_utils import calculate_similarities
 from dotenv import load_dotenv
-from lexoid.api import parse, parse_with_schema
+from lexoid.api import (
+    parse,
+    parse_speculative,
+    parse_to_latex,
+    parse_with_schema,
+    restore_skipped_pages,
+)
+from lexoid.core.conversion_utils import convert_doc_to_base64_images
+from lexoid.core.parse_type import llm_parser
+from lexoid.core.parse_type.static_parser import BBoxGridIndex, embed_links_in_text
+from lexoid.core.prompt_templates import (
+    LATEX_FIRST_PAGE_PROMPT,
+    LATEX_LAST_PAGE_PROMPT,
+    LATEX_MIDDLE_PAGE_PROMPT,
+)
+from lexoid.core.utils import get_pdf_page_texts
 from loguru import logger
 
 load_dotenv()
@@ -340,6 +359,127 @@ async def test_page_nums():
     assert "acp@dca.ca.gov" not in result["raw"]
 
 
+@pytest.mark.asyncio
+async def test_deduplicate_pages_offline(tmp_path):
+    sample = str(tmp_path / "repeated_pages.pdf")
+    with pikepdf.open("examples/inputs/test_2.pdf") as cover, pikepdf.open(
+        "examples/inputs/test_3.pdf"
+    ) as body, pikepdf.new() as pdf:
+        pdf.pages.extend([cover.pages[0], body.pages[0], cover.pages[0]])
+        pdf.save(sample)
+
+    expected = parse(sample, "STATIC_PARSE", pages_per_split=1)
+    result = parse(sample, "STATIC_PARSE", pages_per_split=1, deduplicate_pages=True)
+    assert result["deduplication"]["duplicates"] == {3: 1}
+    assert [seg["metadata"]["page"] for seg in result["segments"]] == [1, 2, 3]
+    assert result["segments"][2]["metadata"]["duplicate_of"] == 1
+    assert [seg["content"] for seg in result["segments"]] == [
+        seg["content"] for seg in expected["segments"]
+    ]
+
+
+def test_restore_skipped_pages_usage_offline():
+    usage = {"input": 100, "output": 20, "total": 120}
+    result = {
+        "raw": "cover\n\nbody",
+        "segments": [
+            {
+                "metadata": {"page": 1, "token_usage": dict(usage)},
+                "content": "cover",
+            },
+            {
+                "metadata": {"page": 2, "token_usage": dict(usage)},
+                "content": "body",
+            },
+        ],
+        "token_usage": {"input": 200, "output": 40, "total": 240, "llm_page_count": 2},
+    }
+    result = restore_skipped_pages(result, 3, {3: 1}, [])
+    copy = result["segments"][2]["metadata"]
+    assert copy["duplicate_of"] == 1
+    assert "token_usage" not in copy and "token_cost" not in copy
+    assert result["segments"][0]["metadata"]["token_usage"] == usage
+    assert result["deduplication"]["tokens_saved"] == 120
+
+
+@pytest.mark.asyncio
+async def test_skip_blank_pages_offline(tmp_path):
+    sample = str(tmp_path / "separator_pages.pdf")
+    with pikepdf.open("examples/inputs/test_1.pdf") as body, pikepdf.new() as pdf:
+        pdf.add_blank_page()
+        pdf.pages.append(body.pages[0])
+        pdf.add_blank_page()
+        pdf.save(sample)
+
+    result = parse(sample, "STATIC_PARSE", pages_per_split=1, skip_blank_pages=True)
+    assert [seg["metadata"].get("skipped") for seg in result["segments"]] == [
+        "blank",
+        None,
+        "blank",
+    ]
+    assert result["segments"][1]["metadata"]["page"] == 2
+    assert result["segments"][1]["content"]
+
+    # Nothing is sent to the LLM when every page is blank
+    with pikepdf.new() as pdf:
+        pdf.add_blank_page()
+        pdf.add_blank_page()
+        pdf.save(sample)
+    result = parse(sample, "LLM_PARSE", skip_blank_pages=True)
+    assert [seg["metadata"]["skipped"] for seg in result["segments"]] == [
+        "blank",
+        "blank",
+    ]
+    assert result["token_usage"]["llm_page_count"] == 0
+
+
+@pytest.mark.asyncio
+async def test_parse_speculative_offline(tmp_path, monkeypatch):
+    sample = str(tmp_path / "speculative.pdf")
+    with pikepdf.open("examples/inputs/test_1.pdf") as body, pikepdf.new() as pdf:
+        pdf.pages.append(body.pages[0])
+        pdf.add_blank_page()
+        pdf.pages.append(body.pages[0])
+        pdf.save(sample)
+
+    def fake_parse_llm_doc(path, **kwargs):
+        if not get_pdf_page_texts(path)[0].strip():
+            raise RuntimeError("LLM unavailable")
+        segment = {"metadata": {"page": 1}, "content": "LLM page"}
+        return {
+            "raw": "LLM page",
+            "segments": [segment],
+            "title": "",
+            "url": "",
+            "parent_title": "",
+            "recursive_docs": [],
+            "token_usage": {"input": 10, "output": 5, "total": 15},
+        }
+
+    monkeypatch.setattr("lexoid.api.parse_llm_doc", fake_parse_llm_doc)
+    refined_pages = []
+    result = parse_speculative(
+        sample,
+        pages_per_split=1,
+        on_page_refined=lambda segment: refined_pages.append(
+            segment["metadata"]["page"]
+        ),
+    )
+    assert [seg["metadata"]["page"] for seg in result["segments"]] == [1, 2, 3]
+    assert "LLM page" not in result["raw"]
+
+    refined = result["refined"].result(timeout=60)
+    assert sorted(refined_pages) == [1, 3]
+    assert [seg["metadata"].get("refined") for seg in refined["segments"]] == [
+        True,
+        None,
+        True,
+    ]
+    assert refined["segments"][1] == result["segments"][1]
+    assert refined["token_usage"]["llm_page_count"] == 2
+    assert refined["token_usage"]["total"] == 30
+
+
 @pytest.mark.parametrize("model", models)
 @pytest.mark.asyncio
 async def test_token_cost(model):
@@ -411,6 +551,52 @@ async def test_strikethrough_words():
     assert "~~" in results, "Markdown strikethrough text not found"
 
 
+def test_embed_links_in_text_offline():
+    class Page:
+        mediabox = (0, 0, 600, 800)
+
+        def extract_words(self, **kwargs):
+            return [
+                {"text": text, "x0": 100.0 * i, "top": 100.0}
+                for i, text in enumerate(["See", "docs", "and", "the", "FAQ."])
+            ]
+
+    text = "See **docs** and the FAQ."
+    docs = ([95, 695, 105, 705], "https://a.io")
+    faq = ([395, 695, 405, 705], "https://b.io")
+    assert (
+        embed_links_in_text(Page(), text, [docs, faq])
+        == "See [**docs**](https://a.io) and the [FAQ.](https://b.io)"
+    )
+    assert (
+        embed_links_in_text(Page(), text, [faq])
+        == "See **docs** and the [FAQ.](https://b.io)"
+    )
+
+
+def test_bbox_grid_index_offline():
+    rng = random.Random(0)
+
+    def random_bbox(max_size):
+        x0, top = rng.uniform(0, 600), rng.uniform(0, 800)
+        return (x0, top, x0 + rng.uniform(0, max_size), top + rng.uniform(0, max_size))
+
+    bboxes = [random_bbox(40) for _ in range(500)]
+    bboxes.append((100.0, 100.0, 150.0, 100.0))  # Zero-height box on cell edges
+    index = BBoxGridIndex(bboxes)
+    queries = [random_bbox(300) for _ in range(200)] + [(150.0, 50.0, 200.0, 100.0)]
+    for query in queries:
+        expected = [
+            i
+            for i, (x0, top, x1, bottom) in enumerate(bboxes)
+            if x0 <= query[2]
+            and x1 >= query[0]
+            and top <= query[3]
+            and bottom >= query[1]
+        ]
+        assert index.query(query) == expected
+
+
 @pytest.mark.parametrize(
     "sample",
     [
@@ -452,6 +638,74 @@ async def test_parse_with_schema():
     assert all(key in result for key in sample_schema.keys())
 
 
+@pytest.mark.asyncio
+async def test_parse_with_schema_concurrent_offline(monkeypatch):
+    sample = "examples/inputs/sample_test_doc.pdf"
+    image_pages = {
+        image: page_num + 1
+        for page_num, image in convert_doc_to_base64_images(sample, page_nums=(2, 4, 5))
+    }
+    lock = threading.Lock()
+    calls = {"active": 0, "peak": 0, "failed": False}
+
+    def fake_create_response(image_url, **kwargs):
+        with lock:
+            calls["active"] += 1
+            calls["peak"] = max(calls["peak"], calls["active"])
+            fail = image_pages[image_url] == 4 and not calls["failed"]
+            calls["failed"] |= fail
+        time.sleep(0.2)
+        with lock:
+            calls["active"] -= 1
+        if fail:
+            return {"response": "Sorry, the page is unreadable."}
+        return {"response": f'```json\n{{"page": {image_pages[image_url]}}}\n```'}
+
+    monkeypatch.setattr("lexoid.api.create_response", fake_create_response)
+    monkeypatch.setattr("lexoid.api.sleep", lambda seconds: None)
+    result = parse_with_schema(
+        sample, schema={"page": "int"}, page_nums=(2, 4, 5), max_processes=3
+    )
+    assert result == [{"page": 2}, {"page": 4}, {"page": 5}]
+    assert calls["failed"]
+    assert calls["peak"] > 1
+    with pytest.raises(ValueError, match="No pages to parse"):
+        parse_with_schema(sample, schema={"page": "int"}, page_nums=(99,))
+
+
+@pytest.mark.asyncio
+async def test_parse_to_latex_concurrent_offline(monkeypatch):
+    sample = "examples/inputs/sample_test_doc.pdf"
+    image_pages = {
+        image: page_num + 1 for page_num, image in convert_doc_to_base64_images(sample)
+    }
+    lock = threading.Lock()
+    calls = {"active": 0, "peak": 0}
+    prompts = {}
+
+    def fake_create_response(image_url, system_prompt, **kwargs):
+        page = image_pages[image_url]
+        with lock:
+            calls["active"] += 1
+            calls["peak"] = max(calls["peak"], calls["active"])
+            prompts[page] = system_prompt
+        # Later pages finish first
+        time.sleep(0.05 * (len(image_pages) - page))
+        with lock:
+            calls["active"] -= 1
+        return {"response": f"```latex\nPage {page}\n```"}
+
+    monkeypatch.setattr("lexoid.api.create_response", fake_create_response)
+    latex = parse_to_latex(sample, max_processes=3)
+    assert latex == "\n\n".join(f"Page {page}" for page in range(1, 7))
+    assert calls["peak"] == 3
+    assert prompts[1].startswith(LATEX_FIRST_PAGE_PROMPT)
+    assert all(prompts[page] == LATEX_MIDDLE_PAGE_PROMPT for page in range(2, 6))
+    assert prompts[6] == LATEX_LAST_PAGE_PROMPT
+    with pytest.raises(ValueError, match="No pages to parse"):
+        parse_to_latex(sample, page_nums=(99,))
+
+
 @pytest.mark.parametrize("character_threshold", [160, 100])
 @pytest.mark.asyncio
 async def test_cost_priority_routing(character_threshold):
@@ -509,3 +763,123 @@ async def test_ollama_parse_integration(input_file: str, expected_keywords: list
     assert result["raw"].strip()
     for keyword in expected_keywords:
         assert keyword.lower() in result["raw"].lower()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("model", ["gpt-4o-mini", "claude-haiku-4-5-20251001"])
+async def test_pages_per_request(model):
+    sample = "examples/inputs/sample_test_doc.pdf"
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        model=model,
+        page_nums=(3, 4),
+        pages_per_split=2,
+        pages_per_request=2,
+    )
+    assert len(result["segments"]) == 2
+    assert "Table 24" in result["segments"][0]["content"]
+    assert "apple" in result["segments"][1]["content"]
+    assert result["token_usage"]["input"] > 0
+
+
+def test_pages_per_request_fallback_offline(monkeypatch):
+    requests = []
+
+    def fake_single_response(image_url, text_callback=None, **kwargs):
+        requests.append(len(image_url))
+        if len(image_url) > 1:
+            # The two-page request comes back without a page break
+            text = "<output>Both pages</output>"
+        else:
+            text = f"<output>Page {len(requests) - 1}</output>"
+        if text_callback:
+            text_callback(text)
+        usage = {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110}
+        return {"response": text, "usage": usage, "finish_reason": "stop"}
+
+    monkeypatch.setattr(llm_parser, "create_single_response", fake_single_response)
+    streamed = []
+    results = llm_parser.parse_page_batch(
+        "openai",
+        [(0, "data:image/png;base64,AAAA"), (1, "data:image/png;base64,BBBB")],
+        model="gpt-4o-mini",
+        stream_callback=lambda page, delta: streamed.append((page, delta)),
+    )
+    assert requests == [2, 1, 1]
+    assert [content for _, content, _, _ in results] == ["Page 1", "Page 2"]
+    assert streamed == [(1, "Page 1"), (2, "Page 2")]
+    # The failed request's usage is counted with the first page
+    assert [usage["input"] for _, _, usage, _ in results] == [200, 100]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("model", ["gpt-4o-mini", "claude-haiku-4-5-20251001"])
+async def test_prompt_caching(model):
+    sample = "examples/inputs/sample_test_doc.pdf"
+    api_cost_path = os.path.join(os.path.dirname(__file__), "api_cost_mapping.json")
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        model=model,
+        page_nums=(1, 3),
+        prompt_caching=True,
+        api_cost_mapping=api_cost_path,
+    )
+    token_usage = result["token_usage"]
+    assert token_usage["input"] > 0
+    assert 0 <= token_usage["cached_input"] <= token_usage["input"]
+    assert token_usage["cache_creation_input"] >= 0
+    assert result["token_cost"]["input-cached"] >= 0
+    assert result["token_cost"]["total"] > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "model", ["gpt-4o-mini", "claude-haiku-4-5-20251001", "gemini-2.5-flash"]
+)
+async def test_stream_callback(model):
+    sample = "examples/inputs/sample_test_doc.pdf"
+    streamed = {}
+
+    def on_delta(page, delta):
+        streamed[page] = streamed.get(page, "") + delta
+
+    result = parse(
+        sample,
+        "LLM_PARSE",
+        model=model,
+        page_nums=(3, 4),
+        stream_callback=on_delta,
+    )
+    assert streamed
+    for segment in result["segments"]:
+        assert streamed[segment["metadata"]["page"]] == segment["content"].strip()
+    assert result["token_usage"]["output"] > 0
+
+
+@pytest.mark.asyncio
+async def test_gemini_file_api():
+    sample = "examples/inputs/sample_test_doc.pdf"
+    config = {"model": "gemini-2.5-flash", "page_nums": (3, 4), "use_file_api": True}
+    result = parse(sample, "LLM_PARSE", **config)
+    assert "Table 24" in result["raw"]
+    assert result["token_usage"]["input"] > 0
+
+    # The second run reuses the cached upload
+    result = parse(sample, "LLM_PARSE", **config)
+    assert "Table 24" in result["raw"]
+
+
+@pytest.mark.asyncio
+async def test_paddleocr_batched_pages():
+    sample = "examples/inputs/test_hidden_link_with_image.pdf"
+    config = {"parser_type": "STATIC_PARSE", "framework": "paddleocr"}
+    result = parse(sample, **config)
+    batched = parse(sample, paddleocr_batch_size=2, **config)
+    assert len(batched["segments"]) == len(result["segments"])
+    for segment, batched_segment in zip(result["segments"], batched["segments"]):
+        assert segment["metadata"]["page"] == batched_segment["metadata"]["page"]
+        assert batched_segment["bboxes"]
+    score = calculate_similarities(batched["raw"], result["raw"])["sequence_matcher"]
+    assert score > 0.9
@@ -0,0 +1,206 @@
+# python3 -m pytest tests/test_replay.py -v
+
+import os
+import random
+import subprocess
+import sys
+import time
+
+import pytest
+from lexoid.api import parse
+from lexoid.core import replay
+from lexoid.core.parse_type import llm_parser
+from lexoid.core.parse_type.llm_parser import get_gemini_text
+from lexoid.core.replay import (
+    ReplayConfigError,
+    create_replay_response,
+    sample_latency,
+)
+from requests.exceptions import HTTPError
+
+
+@pytest.fixture
+def cassettes(tmp_path, monkeypatch):
+    monkeypatch.setattr(replay, "REPLAY_CASSETTE_DIR", str(tmp_path))
+    monkeypatch.setattr(replay, "REPLAY_LATENCY", "none")
+    monkeypatch.setattr(
+        replay,
+        "_state",
+        {"rng": random.Random(0), "errors_left": 0, "latency_checked": False},
+    )
+    return tmp_path
+
+
+def test_record_and_replay_parse(cassettes, monkeypatch):
+    create_single_response = llm_parser.create_single_response
+    providers = []
+
+    def fake_provider(api, **kwargs):
+        if api == "replay":
+            return create_single_response(api=api, **kwargs)
+        providers.append(api)
+        page = len(providers)
+        return {
+            "response": f"<output>Page {page}</output>",
+            "usage": {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+            "finish_reason": "stop",
+        }
+
+    monkeypatch.setattr(llm_parser, "create_single_response", fake_provider)
+    config = {
+        "parser_type": "LLM_PARSE",
+        "api_provider": "replay",
+        "model": "gpt-4o-mini",
+        "pages_per_split": 3,
+        "max_processes": 1,
+    }
+    sample = "examples/inputs/sample_test_doc.pdf"
+    monkeypatch.setattr(replay, "REPLAY_MODE", "record")
+    recorded = parse(sample, **config)
+    assert providers == ["openai"] * 6
+    assert len(list(cassettes.glob("*.json"))) == 6
+
+    monkeypatch.setattr(replay, "REPLAY_MODE", "replay")
+    replayed = parse(sample, **config)
+    assert len(providers) == 6
+    assert replayed["raw"] == recorded["raw"]
+    assert replayed["token_usage"]["input"] == 600
+
+
+def test_replay_injects_errors_and_latency(cassettes, monkeypatch):
+    request = {"model": "gpt-4o-mini", "user_prompt": "Convert the page."}
+    with pytest.raises(FileNotFoundError):
+        create_replay_response(**request)
+
+    monkeypatch.setattr(replay, "REPLAY_MODE", "record")
+    monkeypatch.setattr(
+        llm_parser,
+        "create_single_response",
+        lambda **kwargs: {"response": "<output>Hi</output>", "usage": {}},
+    )
+    create_replay_response(**request)
+
+    monkeypatch.setattr(replay, "REPLAY_MODE", "replay")
+    monkeypatch.setattr(replay, "REPLAY_ERROR_RATE", 1.0)
+    monkeypatch.setattr(replay, "REPLAY_ERROR_BURST", 3)
+    with pytest.raises(HTTPError) as error:
+        create_replay_response(**request)
+    assert error.value.response.status_code == 429
+    # The rest of the burst fails even once errors are no longer drawn
+    monkeypatch.setattr(replay, "REPLAY_ERROR_RATE", 0.0)
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            create_replay_response(**request)
+
+    monkeypatch.setattr(replay, "REPLAY_LATENCY", "fixed:0.05")
+    start = time.perf_counter()
+    assert create_replay_response(**request)["response"] == "<output>Hi</output>"
+    assert time.perf_counter() - start >= 0.05
+
+
+def test_sample_latency():
+    rng = random.Random(0)
+    assert sample_latency("recorded", 1.5, rng) == 1.5
+    assert sample_latency("scale:2", 1.5, rng) == 3.0
+    assert 0.1 <= sample_latency("uniform:0.1,0.2", 1.5, rng) <= 0.2
+    assert sample_latency("lognormal:0.5,0.3", 1.5, rng) > 0
+    for spec in ("gaussian:1", "fixed:abc", "uniform:0.1"):
+        with pytest.raises(ValueError):
+            sample_latency(spec, 1.5, rng)
+
+
+def test_invalid_replay_latency_fails_on_first_request(cassettes, monkeypatch):
+    # A malformed value does not break importing lexoid
+    result = subprocess.run(
+        [sys.executable, "-c", "import lexoid.api"],
+        env={**os.environ, "REPLAY_LATENCY": "fixed:abc"},
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+
+    monkeypatch.setattr(replay, "REPLAY_LATENCY", "fixed:abc")
+    with pytest.raises(ReplayConfigError, match="Invalid replay latency: fixed:abc"):
+        create_replay_response("gpt-4o-mini", user_prompt="Hello")
+    # Not a ValueError, so that `retry_on_error` fails instead of retrying
+    assert not issubclass(ReplayConfigError, ValueError)
+
+
+def test_replay_uses_recorded_provider_prompts(cassettes, monkeypatch):
+    create_single_response = llm_parser.create_single_response
+    requests = []
+
+    def fake_provider(api, **kwargs):
+        if api == "replay":
+            return create_single_response(api=api, **kwargs)
+        requests.append((api, kwargs))
+        pages = "<page-break>".join(
+            f"Page {i}" for i in range(len(kwargs["image_url"]))
+        )
+        return {
+            "response": f"<output>{pages}</output>",
+            "usage": {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+            "finish_reason": "stop",
+        }
+
+    monkeypatch.setattr(llm_parser, "create_single_response", fake_provider)
+    monkeypatch.setattr(replay, "REPLAY_MODE", "record")
+    parse(
+        "examples/inputs/sample_test_doc.pdf",
+        parser_type="LLM_PARSE",
+        api_provider="replay",
+        model="gpt-4o-mini",
+        page_nums=(1, 2),
+        pages_per_split=2,
+        pages_per_request=2,
+        max_processes=1,
+    )
+    # Sent as an OpenAI request would be: OpenAI prompts, both pages at once
+    system_prompt, user_prompt = llm_parser.get_parser_prompts("openai", 2)
+    assert len(requests) == 1
+    api, request = requests[0]
+    assert api == "openai"
+    assert (request["system_prompt"], request["user_prompt"]) == (
+        system_prompt,
+        user_prompt,
+    )
+    assert len(request["image_url"]) == 2
+
+
+def test_record_and_replay_gemini_parse(cassettes, monkeypatch):
+    payloads = []
+
+    def fake_send_gemini_request(model, payload, text_callback=None):
+        payloads.append(payload)
+        result = {
+            "candidates": [
+                {
+                    "content": {"parts": [{"text": "<output>Gemini page</output>"}]},
+                    "finishReason": "STOP",
+                }
+            ],
+            "usageMetadata": {"promptTokenCount": 100, "candidatesTokenCount": 10},
+        }
+        return result, get_gemini_text(result)
+
+    monkeypatch.setattr(llm_parser, "send_gemini_request", fake_send_gemini_request)
+    config = {
+        "parser_type": "LLM_PARSE",
+        "api_provider": "replay",
+        "model": "gemini-2.5-flash",
+        "page_nums": (1, 2),
+        "pages_per_split": 2,
+        "max_processes": 1,
+    }
+    sample = "examples/inputs/sample_test_doc.pdf"
+    monkeypatch.setattr(replay, "REPLAY_MODE", "record")
+    recorded = parse(sample, **config)
+    # The whole split is sent in a single request, as parse_with_gemini does
+    assert len(payloads) == 1
+    assert len(list(cassettes.glob("*.json"))) == 1
+
+    monkeypatch.setattr(replay, "REPLAY_MODE", "replay")
+    replayed = parse(sample, **config)
+    assert len(payloads) == 1
+    assert replayed["raw"] == recorded["raw"] == "Gemini page"
+    assert replayed["token_usage"]["input"] == 100
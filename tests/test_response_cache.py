@@ -0,0 +1,87 @@
+# python3 -m pytest tests/test_response_cache.py -v
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from lexoid.core import response_cache
+from lexoid.core.parse_type import llm_parser
+from lexoid.core.parse_type.llm_parser import create_response
+from lexoid.core.response_cache import ResponseCache
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "responses.sqlite")
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_PATH", path)
+    return path
+
+
+def test_create_response_is_cached(cache_path, monkeypatch):
+    requests = []
+
+    def fake_single_response(**kwargs):
+        requests.append(kwargs)
+        return {
+            "response": f"<output>Page {len(requests)}</output>",
+            "usage": {"input_tokens": 100, "output_tokens": 10, "total_tokens": 110},
+            "finish_reason": "stop",
+        }
+
+    monkeypatch.setattr(llm_parser, "create_single_response", fake_single_response)
+    request = {
+        "api": "openai",
+        "model": "gpt-4o-mini",
+        "user_prompt": "Convert the page.",
+        "image_url": "data:image/png;base64,AAAA",
+    }
+    first = create_response(**request)
+    deltas = []
+    second = create_response(**request, text_callback=deltas.append)
+    assert len(requests) == 1
+    assert second["response"] == first["response"] == "<output>Page 1</output>"
+    assert first["usage"]["input_tokens"] == 100
+    assert second["usage"]["input_tokens"] == second["usage"]["total_tokens"] == 0
+    assert second["usage"]["response_cache_hits"] == 1
+    assert deltas == ["<output>Page 1</output>"]
+
+    # Any change to the request is a miss
+    create_response(**{**request, "image_url": "data:image/png;base64,BBBB"})
+    create_response(**request, temperature=0.5)
+    assert len(requests) == 3
+
+
+def test_response_cache_eviction_and_ttl(cache_path):
+    cache = ResponseCache(cache_path, max_bytes=10_000, ttl=60)
+    for i in range(20):
+        # Payloads of several hundred bytes once compressed
+        cache.set(f"key-{i}", {"response": f"{i}" + "".join(map(str, range(400)))})
+        cache._connect().execute(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?", (i, f"key-{i}")
+        )
+    cache.evict()
+    (total,) = cache._connect().execute("SELECT SUM(size) FROM responses").fetchone()
+    assert total <= 10_000
+    assert cache.get("key-0") is None
+    assert cache.get("key-19") is not None
+
+    cache.ttl = -1
+    assert cache.get("key-19") is None
+
+
+def write_and_read(args):
+    path, worker = args
+    cache = ResponseCache(path, max_bytes=10**9, ttl=60)
+    for i in range(50):
+        cache.set(f"{worker}-{i}", {"worker": worker, "i": i})
+    return [cache.get(f"{worker}-{i}")["i"] for i in range(50)]
+
+
+def test_response_cache_concurrent_processes(cache_path):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(write_and_read, [(cache_path, worker) for worker in range(4)])
+        )
+    assert results == [list(range(50))] * 4
+    cache = ResponseCache(cache_path, max_bytes=10**9, ttl=60)
+    (count,) = cache._connect().execute("SELECT COUNT(*) FROM responses").fetchone()
+    assert count == 200
@@ -0,0 +1,275 @@
+# python3 -m pytest tests/test_structured_output.py -v
+
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pytest
+from lexoid import api
+from lexoid.api import create_schema_response, parse_with_schema
+from lexoid.core.conversion_utils import (
+    convert_schema_to_dict,
+    find_schema_errors,
+    merge_schema_instances,
+    parse_json_response,
+)
+from lexoid.core.parse_type import llm_parser
+from lexoid.core.parse_type.llm_parser import (
+    get_anthropic_request_params,
+    get_openai_request_params,
+)
+from lexoid.core.utils import group_segments_by_tokens
+
+
+@dataclass
+class Invoice:
+    number: str
+    total: float
+    items: List[str] = field(default_factory=list)
+    currency: Optional[str] = None
+
+
+INVOICE_SCHEMA = convert_schema_to_dict(Invoice)
+
+
+@pytest.mark.parametrize(
+    "response,expected",
+    [
+        (
+            '```json\n{"number": "A1", "total": 3.5}\n```',
+            {"number": "A1", "total": 3.5},
+        ),
+        ('Sure! {"items": ["a", "b",], "total": 1}', {"items": ["a", "b"], "total": 1}),
+        # Truncated responses keep every complete member
+        ('{"number": "A1", "items": ["a", "b', {"number": "A1", "items": ["a", "b"]}),
+        (
+            '[{"number": "A1"}, {"number": "A2", "tot',
+            [{"number": "A1"}, {"number": "A2"}],
+        ),
+        ('{"number": "A1", "total": tru', {"number": "A1"}),
+    ],
+)
+def test_parse_json_response_repairs_output(response, expected):
+    assert parse_json_response(response) == expected
+
+
+def test_parse_json_response_without_json():
+    with pytest.raises(ValueError):
+        parse_json_response("The page is blank.")
+
+
+def test_find_schema_errors():
+    assert (
+        find_schema_errors(
+            {"number": "A1", "total": 2, "currency": None}, INVOICE_SCHEMA
+        )
+        == []
+    )
+    assert find_schema_errors(
+        {"number": 7, "items": ["a", 1], "total": True}, INVOICE_SCHEMA
+    ) == [
+        "$.number: expected string, got 7",
+        "$.total: expected number, got True",
+        "$.items[1]: expected string, got 1",
+    ]
+    assert find_schema_errors({}, INVOICE_SCHEMA) == [
+        "$: missing required property 'number'",
+        "$: missing required property 'total'",
+    ]
+
+
+def test_native_structured_output_params():
+    params = get_openai_request_params(
+        "openai",
+        "gpt-4o-mini",
+        "Schema",
+        "Extract",
+        None,
+        response_schema=INVOICE_SCHEMA,
+    )
+    assert params["response_format"]["type"] == "json_schema"
+    assert params["response_format"]["json_schema"]["schema"] == INVOICE_SCHEMA
+    params = get_openai_request_params(
+        "huggingface",
+        "model",
+        "Schema",
+        "Extract",
+        None,
+        response_schema=INVOICE_SCHEMA,
+    )
+    assert "response_format" not in params
+
+    params = get_anthropic_request_params(
+        "claude-sonnet-4-5", "Schema", "Extract", None, response_schema=INVOICE_SCHEMA
+    )
+    assert params["tools"][0]["input_schema"] == INVOICE_SCHEMA
+    assert params["tool_choice"] == {"type": "tool", "name": params["tools"][0]["name"]}
+
+
+def test_create_schema_response_reasks_invalid_output(monkeypatch):
+    responses = ['{"number": "A1"', '{"number": "A1", "total": 12.5}']
+    requests = []
+
+    def fake_create_response(**kwargs):
+        requests.append(kwargs)
+        return {"response": responses[len(requests) - 1]}
+
+    monkeypatch.setattr(api, "create_response", fake_create_response)
+    value = create_schema_response(
+        "openai", "gpt-4o-mini", "Schema", "Extract", INVOICE_SCHEMA
+    )
+    assert value == {"number": "A1", "total": 12.5}
+    assert len(requests) == 2
+    assert requests[0]["response_schema"] == INVOICE_SCHEMA
+    assert "missing required property 'total'" in requests[1]["user_prompt"]
+
+    # Informal schemas are not sent as structured output nor validated
+    requests.clear()
+    responses = ['{"Total": "12"}']
+    value = create_schema_response(
+        "openai", "gpt-4o-mini", "Schema", "Extract", {"Total": "int"}
+    )
+    assert value == {"Total": "12"}
+    assert requests[0]["response_schema"] is None
+
+
+def fake_gemini(responses, prompts):
+    def parse_image_with_gemini(system_prompt, **kwargs):
+        prompts.append(system_prompt)
+        usage = {"input": 100, "output": 10, "total": 110, "cached_input": 0}
+        return {
+            "raw": responses[len(prompts) - 1],
+            "token_usage": usage,
+            "finish_reason": "STOP",
+        }
+
+    return parse_image_with_gemini
+
+
+def test_create_schema_response_reasks_gemini(monkeypatch):
+    prompts = []
+    responses = ['{"number": "A1"}', '{"number": "A1", "total": 12.5}']
+    monkeypatch.setattr(
+        llm_parser, "parse_image_with_gemini", fake_gemini(responses, prompts)
+    )
+    value = create_schema_response(
+        "gemini", "gemini-2.5-flash", "Schema", "Extract the invoice", INVOICE_SCHEMA
+    )
+    assert value == {"number": "A1", "total": 12.5}
+    assert prompts[0] == "Schema\n\nExtract the invoice"
+    assert prompts[1].startswith("Schema\n\nExtract the invoice")
+    assert "missing required property 'total'" in prompts[1]
+
+
+def test_merge_schema_instances():
+    merged, conflicts = merge_schema_instances(
+        [
+            {"number": "A1", "total": None, "items": ["a", "b"]},
+            {"number": "", "total": 10.0, "items": ["b", "c"]},
+            {"number": "A2", "total": 10.0, "items": []},
+        ]
+    )
+    assert merged == {"number": "A1", "total": 10.0, "items": ["a", "b", "c"]}
+    assert conflicts == ["$.number"]
+
+
+def test_group_segments_by_tokens():
+    segments = [{"content": "x" * chars} for chars in (400, 400, 1000, 100)]
+    chunks = group_segments_by_tokens(segments, max_tokens=200)
+    assert [len(chunk) for chunk in chunks] == [2, 1, 1]
+
+
+def test_fill_single_schema_map_reduce(monkeypatch):
+    pages = [
+        "Invoice A1\nWidget",
+        "Gadget",
+        "Gadget\nTotal: 12.5",
+    ]
+
+    def fake_parse(path, **kwargs):
+        return {
+            "raw": "\n\n".join(pages),
+            "segments": [
+                {"metadata": {"page": i + 1}, "content": content * 100}
+                for i, content in enumerate(pages)
+            ],
+        }
+
+    partials = {
+        "Invoice": {"number": "A1", "total": None, "items": ["Widget"]},
+        "GadgetGadget": {"number": "", "total": None, "items": ["Gadget"]},
+        "Gadget\nTotal": {"number": "", "total": 12.5, "items": ["Gadget"]},
+    }
+    prompts = []
+
+    def fake_create_response(user_prompt, **kwargs):
+        prompts.append(user_prompt)
+        content = user_prompt.split("<content>\n")[-1]
+        partial = next(v for k, v in partials.items() if content.startswith(k))
+        return {"response": json.dumps(partial)}
+
+    monkeypatch.setattr(api, "parse", fake_parse)
+    monkeypatch.setattr(api, "create_response", fake_create_response)
+    result = parse_with_schema(
+        "invoice.pdf",
+        Invoice,
+        fill_single_schema=True,
+        schema_chunk_tokens=500,
+    )
+    assert len(prompts) == 3
+    assert result == [{"number": "A1", "total": 12.5, "items": ["Widget", "Gadget"]}]
+
+
+def test_fill_single_schema_map_reduce_gemini(monkeypatch):
+    pages = ["Invoice A1\nWidget", "Gadget\nTotal: 12.5"]
+
+    def fake_parse(path, **kwargs):
+        return {
+            "raw": "\n\n".join(pages),
+            "segments": [
+                {"metadata": {"page": i + 1}, "content": content * 100}
+                for i, content in enumerate(pages)
+            ],
+        }
+
+    partials = [
+        {"number": "A1", "total": None, "items": ["Widget"]},
+        {"number": "", "total": 12.5, "items": ["Gadget"]},
+    ]
+    final = {"number": "A1", "total": 12.5, "items": ["Widget", "Gadget"]}
+    prompts = []
+
+    def fake_parse_image_with_gemini(system_prompt, **kwargs):
+        prompts.append(system_prompt)
+        if "<instances>" in system_prompt:
+            response = final
+        else:
+            response = next(
+                partial
+                for page, partial in zip(pages, partials)
+                if f"<content>\n{page}" in system_prompt
+            )
+        return {
+            "raw": json.dumps(response),
+            "token_usage": {"input": 1, "output": 1, "total": 2, "cached_input": 0},
+            "finish_reason": "STOP",
+        }
+
+    monkeypatch.setattr(api, "parse", fake_parse)
+    monkeypatch.setattr(
+        llm_parser, "parse_image_with_gemini", fake_parse_image_with_gemini
+    )
+    result = parse_with_schema(
+        "invoice.pdf",
+        Invoice,
+        model="gemini-2.5-flash",
+        fill_single_schema=True,
+        schema_chunk_tokens=500,
+        reconcile_schema=True,
+        max_processes=1,
+    )
+    assert result == [final]
+    # Each chunk and the partial instances reach the model
+    assert len(prompts) == 3
+    assert all(f"<content>\n{page}" in "".join(prompts) for page in pages)
+    assert json.dumps(partials, indent=2) in prompts[-1]